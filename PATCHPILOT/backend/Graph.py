@@ -5,16 +5,39 @@ from typing import List , Annotated
 from RAGs.KnowledgeRetrieval import KnowledgeRetriever
 from RAGs.ProjectIngestion import ProjectIngestor
 import os
+import sys
 from pathlib import Path
 import subprocess
 from RAGs.target_discovery import TargetDiscovery
 from RAGs.RuleSynthesis import RuleSynthesizer
 from RAGs.Migration_Planner import MigrationPlanner
 import re
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from RAGs.PatchGenerator import PatchGenerator
 from RAGs.Reflection_agent import ReflectionAgent
+from RAGs.sandbox import get_sandbox
+from RAGs.workspace import get_workspaces, relative_entry
+from RAGs.rule_store import StaleLayoutError, get_rule_store
+from RAGs.python_imports import canonical_name
+from RAGs.codemods import apply_codemods, compile_rules, rule_key
+from cache_utils import CACHE_DIR
+from telemetry import telemetry
+from jobs import JobCancelled, check_cancelled
+from langgraph.checkpoint.memory import MemorySaver
 from IPython.display import Image, display
 
+MAX_PATCH_RETRIES = 3
+# Compiles of the synthesized rules when a concurrent run saved the same libraries first
+RULE_SAVE_ATTEMPTS = 3
+# Number of files migrated concurrently; 1 keeps the one-file-per-loop graph path
+MIGRATION_PARALLELISM = int(os.getenv("PATCHPILOT_MIGRATION_PARALLELISM", "1"))
+# Files handed to the parallel node per step; every step is checkpointed
+PARALLEL_BATCH_FACTOR = 4
+CHECKPOINT_PATH = Path(os.getenv("PATCHPILOT_CHECKPOINT_DB", str(CACHE_DIR / "checkpoints.sqlite3")))
+# Graph steps per work item: Select Target, Migration, then Patch + Reflection per attempt
+STEPS_PER_WORK_ITEM = 2 + 2 * (MAX_PATCH_RETRIES + 1)
+MIN_RECURSION_LIMIT = 50
 
 class InputState(BaseModel):
     git_link : str = Field(description="The git link of the project")
@@ -46,16 +69,27 @@ class InputState(BaseModel):
     validation_success : bool = Field(default=True, description="Status of the last validation/reflection step")
     run_id : str = Field(default="",description="The run id of the project")
     generated_code : dict = Field(default_factory=dict,description="The generated code of the project")
+    generated_diffs : dict = Field(default_factory=dict,description="Unified diff of each generated file against its original, when the patch was applied as edits")
     current_target_file : str = Field(default="", description="The current file being targeted")
+    project_root : str = Field(default="", description="Root directory of the project checkout")
+    verification_entry : str = Field(default="", description="Path of the patched file inside its verification workspace")
     current_file_language : str = Field(default="", description="The current file language")
     retry_count: int = Field(default=0, description="Number of patch retry attempts")
-    final_generated_code : dict = Field(default_factory=dict,description="The final generated code of the project")
+    retry_counts : dict = Field(default_factory=dict,description="Patch retry attempts per work item (dependency::file)")
+    current_work_item : str = Field(default="", description="The dependency::file work item being processed")
+    parallel_width : int = Field(default=MIGRATION_PARALLELISM, description="Number of files migrated concurrently")
+    final_generated_code : dict = Field(default_factory=dict,description="The final generated code of the project, only ever verified patches")
+    codemod_code : dict = Field(default_factory=dict,description="Codemod output per file, where the LLM starts until a patch of the file is verified")
+    codemod_rules : dict = Field(default_factory=dict,description="Rule ids per file that codemods applied completely, left out of the LLM prompts")
+    completed_work_items : list = Field(default_factory=list,description="Work items (dependency::file) already patched and verified, skipped on resume")
 
 
+@telemetry.traced(kind="node")
 def User_confirmation_Graph(state: InputState):
     return state
 
 
+@telemetry.traced(kind="node")
 def Knowledge_Graph(state: InputState):
     knowledge_retriever = KnowledgeRetriever()
     topic = state.topics
@@ -77,6 +111,7 @@ def check_authentication(state: InputState):
         return "Rule Synthesis"
     return "Rule Synthesis"
 
+@telemetry.traced(kind="node")
 def RuleSynthesis_Graph(state: InputState):
     if not state.retrieved_docs:
         print("No docs retrieved, skipping rule synthesis")
@@ -85,29 +120,27 @@ def RuleSynthesis_Graph(state: InputState):
     synthesizer = RuleSynthesizer()
     rules = synthesizer.rules_synthesis(state.retrieved_docs)
     import orjson
-    from pathlib import Path
-    BASE_DIR = Path(__file__).resolve()
-    while BASE_DIR.name != "backend":
-        BASE_DIR = BASE_DIR.parent
-    orjson_dir = BASE_DIR / "orjsonfiles"
-    orjson_dir = Path(orjson_dir)
-    orjson_dir.mkdir(parents=True, exist_ok=True)
-    path = orjson_dir / "initial_rules.json"
-    data = []
-    if path.exists():
+    rule_store = get_rule_store()
+    # Chunks compiled by an attempt that lost the save; keyed by content, so still valid
+    compiled_chunks = {}
+    for attempt in range(1, RULE_SAVE_ATTEMPTS + 1):
+        partitions = rule_store.load_partitions()
+        seeded = {library: dict(partition) for library, partition in partitions.items()}
+        for library, chunks in compiled_chunks.items():
+            partition = seeded.setdefault(library, {"rules": [], "chunks": {}})
+            partition["chunks"] = {**chunks, **partition.get("chunks", {})}
+        compiled_rules, updated = synthesizer.compile_incremental(rules, seeded)
         try:
-            data = orjson.loads(path.read_bytes())
-            if not isinstance(data, list):
-                data = []
-        except:
-            data = []
-    if isinstance(rules, list):
-         data.extend(rules)
+            rule_store.save_partitions(updated, previous=partitions)
+            break
+        except StaleLayoutError as e:
+            # The retry only sends the supervisor chunks neither run compiled
+            print(f"Rule save attempt {attempt}/{RULE_SAVE_ATTEMPTS} lost a race: {e}")
+            for library, partition in updated.items():
+                compiled_chunks.setdefault(library, {}).update(partition.get("chunks", {}))
     else:
-        data.append(rules)
-    compiled_rules = synthesizer.rule_compiler(data)
-    path.write_bytes(orjson.dumps(compiled_rules, option=orjson.OPT_INDENT_2))
-    state.initial_rules = compiled_rules
+        raise RuntimeError(f"Synthesized rules could not be saved: {RULE_SAVE_ATTEMPTS} attempts lost to concurrent runs")
+    state.initial_rules = orjson.dumps(compiled_rules, option=orjson.OPT_INDENT_2).decode()
     
     if state.targets and state.topics:
         try:
@@ -126,6 +159,14 @@ def RuleSynthesis_Graph(state: InputState):
 
     return state
 
+def dependency_files(state: InputState, dependency_name):
+    """Files importing a target; Python imports are keyed by canonical distribution name."""
+    files = state.dependencies_in_code_files
+    if dependency_name in files:
+        return files[dependency_name]
+    return files.get(canonical_name(dependency_name), [])
+
+@telemetry.traced(kind="node")
 def select_next_target(state: InputState):
     print(f"DEBUG: Targets remaining: {len(state.targets)}")
     state.retry_count = 0 
@@ -133,7 +174,7 @@ def select_next_target(state: InputState):
         target = state.targets[0]
         dependency_name = target['dependency']
         
-        files_using_dep = state.dependencies_in_code_files.get(dependency_name, [])
+        files_using_dep = dependency_files(state, dependency_name)
         print(f"DEBUG: Processing target {dependency_name}, files remaining: {len(files_using_dep)}")
         
         if not files_using_dep:
@@ -143,6 +184,9 @@ def select_next_target(state: InputState):
             
         file_info = files_using_dep.pop(0)
         file_path = file_info['file']
+        if f"{dependency_name}::{file_path}" in state.completed_work_items:
+            print(f"DEBUG: {dependency_name}::{file_path} already patched, skipping.")
+            continue
         state.current_file_language = file_info['lang']
         try:
             with open(file_path, "r", encoding="utf-8") as f:
@@ -152,6 +196,8 @@ def select_next_target(state: InputState):
             state.code.update({file_path: code})
             state.current_target_file = file_path
             state.current_target_dependency = dependency_name
+            state.current_work_item = f"{dependency_name}::{file_path}"
+            state.retry_count = state.retry_counts.get(state.current_work_item, 0)
             return state
         except Exception as e:
             print(f"Error reading file {file_path}: {e}")
@@ -171,14 +217,67 @@ def check_target_availability(state: InputState):
         return "Finished State"
 
 
-def Migration_Graph(state: InputState):
+def current_source(state: InputState):
+    """
+    Code of the file being migrated: the verified patch from an earlier
+    dependency when there is one, else the codemods' output on a first
+    attempt, else the original. Output that failed verification is never
+    patched again; a retry starts over with the errors. state.code keeps
+    the originals of every visited file for the change listing, but only
+    this file goes into the prompts.
+    """
+    curr_file = state.current_target_file
+    verified = state.final_generated_code.get(curr_file)
+    if verified:
+        return verified
+    if curr_file in state.codemod_code and not state.retry_counts.get(state.current_work_item, 0):
+        return state.codemod_code[curr_file]
+    return state.code.get(curr_file, "")
+
+
+@telemetry.traced(kind="node")
+def Codemod_Graph(state: InputState):
+    """
+    Applies the rules that are pure renames (e.g. `parse_obj` -> `model_validate`)
+    to every target file in one pass, before any LLM call. Each file is read
+    and parsed once for all of its dependencies' codemods. The rules a file
+    has nothing left of are recorded so the planner never sees them there.
+    """
+    store = get_rule_store()
+    files = {}
+    for target in state.targets:
+        dependency_name = target['dependency']
+        rules = compile_rules(store.compiled_rules(dependency_name), library=dependency_name)
+        if not rules:
+            continue
+        for file_info in dependency_files(state, dependency_name):
+            if f"{dependency_name}::{file_info['file']}" in state.completed_work_items:
+                continue
+            files.setdefault(file_info['file'], (file_info['lang'], []))[1].extend(rules)
+    if not files:
+        return state
+    changed = 0
+    for file_path, result in apply_codemods(files).items():
+        state.codemod_rules[file_path] = result.applied
+        if result.patched != result.original:
+            changed += 1
+            state.code[file_path] = result.original
+            state.generated_code[file_path] = result.patched
+            # The LLM, if any rule is left, starts from the codemods' output
+            state.codemod_code[file_path] = result.patched
+    telemetry.count("codemod_files", changed, outcome="changed")
+    telemetry.count("codemod_files", len(files) - changed, outcome="unchanged")
+    print(f"DEBUG: Codemods changed {changed} of {len(files)} target files")
+    return state
+
+
+def plan_steps(state: InputState, rules):
     planner = MigrationPlanner()
-    rules = state.initial_rules
-    code = state.code
+    code = current_source(state)
     errors = state.errors.get(state.current_target_file, "")
     if not code:
         return state
-    response = planner.plan_migration(rules, code, errors)
+    response = planner.plan_migration(rules, {state.current_target_file: code}, errors)
     risks_match = re.search(r"Risks and Caveats:[\s\S]*?(?=\Z)", response)
     migration_steps_match = re.search(r"Migration Steps:[\s\S]*?(?=(?:Risks and Caveats:|(?=\Z)))", response)
     state.risks = risks_match.group(0).strip() if risks_match else ""
@@ -186,6 +285,30 @@ def Migration_Graph(state: InputState):
     return state
 
 
+def dump_rules(rules):
+    import orjson
+    return orjson.dumps({"final_rules": rules}, option=orjson.OPT_INDENT_2).decode()
+
+
+@telemetry.traced(kind="node")
+def Migration_Graph(state: InputState):
+    rules = state.initial_rules
+    # Only the rules for the dependency being migrated, when the store has them
+    library_rules = get_rule_store().compiled_rules(state.current_target_dependency)
+    if library_rules:
+        applied = set(state.codemod_rules.get(state.current_target_file, []))
+        leftover = [rule for rule in library_rules if rule_key(rule) not in applied]
+        telemetry.count("codemod_rules", len(library_rules) - len(leftover), handled_by="codemod")
+        telemetry.count("codemod_rules", len(leftover), handled_by="llm")
+        if not leftover:
+            print(f"DEBUG: Codemods applied every rule of {state.current_target_dependency} to {state.current_target_file}")
+            state.migration_rules = ""
+            state.risks = ""
+            return state
+        rules = dump_rules(leftover)
+    return plan_steps(state, rules)
+
+
 def detect_language(code_str: str) -> tuple[str, str]:
     code_str = code_str.lower()
     if 'public class' in code_str or 'import java.' in code_str or ('package ' in code_str and ';' in code_str):
@@ -198,17 +321,31 @@ def detect_language(code_str: str) -> tuple[str, str]:
          return 'node', '.js'
     return 'unknown', ''
 
+@telemetry.traced(kind="node")
 def Patch_Graph(state: InputState):
     generator = PatchGenerator()
     steps = state.migration_rules
-    code = state.code
-    generated_code = generator.generate_code(steps, code)
     curr_depend = state.current_target_dependency
     curr_file = state.current_target_file
+    source = current_source(state)
+    if curr_file in state.codemod_rules and state.retry_counts.get(state.current_work_item, 0):
+        # The codemods' output failed verification and the retry starts from the
+        # original, so the LLM gets every rule, codemod-applied ones included, and the errors
+        steps = plan_steps(state, dump_rules(get_rule_store().compiled_rules(curr_depend))).migration_rules
+    if not steps and curr_file in state.codemod_rules:
+        # Nothing left after the codemods; Reflection only has to verify their output
+        generated_code, diff = source, ""
+    else:
+        generated_code, diff = generator.patch_file(steps, curr_file, source, state.current_file_language)
     
     if not isinstance(state.generated_code, dict):
         state.generated_code = {}
     state.generated_code.update({curr_file: generated_code})
+    # The edits' diff only describes the file's change when they were made to the original
+    if diff and source == state.code.get(curr_file):
+        state.generated_diffs[curr_file] = diff
+    else:
+        state.generated_diffs.pop(curr_file, None)
     
     new_lang, new_ext = detect_language(generated_code)
     
@@ -216,53 +353,37 @@ def Patch_Graph(state: InputState):
         print(f"DEBUG: Detected language {new_lang} for generated code.")
         state.current_file_language = new_lang
         
-    BASE_DIR = Path(__file__).resolve()
-    while BASE_DIR.name != "backend":
-        BASE_DIR = BASE_DIR.parent
-    virtual_dir = BASE_DIR / "RAGs" / "virtual_testing"
-    
-    # Save to virtual_testing for Docker verification
+    # Determine the entry path inside the workspace
+    entry = relative_entry(curr_file, state.project_root)
+    if new_ext and new_lang != 'unknown':
+         # Replace extension
+         entry = Path(entry).with_suffix(new_ext).as_posix()
+    state.verification_entry = entry
+
+    # Save into this work item's own copy of the project for Docker verification
     try:
-        virtual_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Determine filename
-        if new_ext and new_lang != 'unknown':
-             # Replace extension
-             file_name = Path(curr_file).stem + new_ext
-        else:
-             file_name = Path(curr_file).name
-             
-        target_path = virtual_dir / file_name
-        print(f"DEBUG: Saving patched file to {target_path} for verification")
-        
-        # Update current target file to point to the new location/name for subsequent steps if needed?
-        # ReflectionAgent uses project_context or state.current_file_language.
-        # But we need to make sure ReflectionAgent knows the ENTRY POINT.
-        # We will set a temporary field or rely on ReflectionAgent logic update.
-        # Let's save the effective filepath in state for Reflection to pick up.
-        state.current_target_file = str(target_path.name) # Just basename for Docker context?
-        # Actually Graph state expects full paths usually, but for virtual testing we use basename.
-        # Let's keep curr_file as original for tracking, but maybe add a new field or just rely on basename calc.
-        
-        with open(target_path, "w", encoding="utf-8") as f:
-            f.write(generated_code)
-            
+        workspace = get_workspaces().prepare(
+            state.run_id, state.current_work_item or curr_file, state.project_root, {entry: generated_code}
+        )
+        print(f"DEBUG: Saved patched file to {workspace / entry} for verification")
     except Exception as e:
-        print(f"Error writing file {target_path}: {e}")
+        print(f"Error preparing verification workspace for {curr_file}: {e}")
     return state
 
 
+@telemetry.traced(kind="node")
 def Reflection_Graph(state: InputState):
     agent = ReflectionAgent()
     flag = True
     curr_file = state.current_target_file
+    entry = state.verification_entry or relative_entry(curr_file, state.project_root)
     
-    agent.generate_dockerfile(
+    spec = agent.build_spec(
         code_language=state.current_file_language,
         code_version=state.code_version,
         install_preset=state.install_preset,
         run_profile=state.run_profile,
-        run_args={"entry": curr_file}, # Pass explicit entry point
+        run_args={"entry": entry}, # Pass explicit entry point
         project_context={
             "dependencies": state.dependencies,
             "code_files": state.code_files
@@ -270,42 +391,230 @@ def Reflection_Graph(state: InputState):
     )
 
     
-    BASE_DIR = Path(__file__).resolve() 
-    while BASE_DIR.name != "backend":
-        BASE_DIR = BASE_DIR.parent
-    build_context = BASE_DIR / "RAGs" / "virtual_testing"
-    
-    subprocess.run(["docker", "build", "-t", "my-image", "."], cwd=build_context)
+    # Rebuilt from state if missing, e.g. when a run resumes at this node
+    build_context = get_workspaces().prepare(
+        state.run_id, state.current_work_item or curr_file, state.project_root,
+        {entry: state.generated_code.get(curr_file, "")},
+    )
     
+    # Warm container from the cached dependency image; no per-attempt build/rmi
     try:
-        ans = subprocess.check_output(["docker", "run", "--rm", "my-image"])
-    except subprocess.CalledProcessError as e:
-        state.errors.update({curr_file: e.output})
+        result = get_sandbox().verify(state.run_id, spec, build_context)
+        print(f"DEBUG: Verified {curr_file} in {result.container} ({result.duration:.1f}s, ok={result.ok})")
+        if not result.ok:
+            state.errors.update({curr_file: result.output})
+            flag = False
+    except Exception as e:
+        state.errors.update({curr_file: f"Verification sandbox error: {e}"})
         flag = False
     
-    subprocess.run(["docker", "rmi", "my-image"])
-    
     generated_code = state.generated_code.get(curr_file)
     if not isinstance(state.final_generated_code, dict):
         state.final_generated_code = {}
-    if generated_code:
+    # Only verified code is built on; a retry patches the last verified source again
+    if flag and generated_code:
         state.final_generated_code.update({curr_file: generated_code})
     state.validation_success = flag
+    if not flag:
+        # Counted here rather than in the router: routers cannot update state
+        attempts = state.retry_counts.get(state.current_work_item, 0) + 1
+        state.retry_counts[state.current_work_item] = attempts
+        state.retry_count = attempts
+    if flag or state.retry_counts.get(state.current_work_item, 0) > MAX_PATCH_RETRIES:
+        mark_completed(state, state.current_work_item)
     return state
 
 def reflection_condition(state: InputState):
-    MAX_RETRIES = 3
     if not state.validation_success:
-        if state.retry_count < MAX_RETRIES:
-            state.retry_count += 1
-            print(f"Validation failed. Retrying patch attempt {state.retry_count}/{MAX_RETRIES}...")
+        attempts = state.retry_counts.get(state.current_work_item, state.retry_count)
+        if attempts <= MAX_PATCH_RETRIES:
+            print(f"Validation failed. Retrying patch attempt {attempts}/{MAX_PATCH_RETRIES}...")
             return "Patch"
         else:
-            print(f"Max retries ({MAX_RETRIES}) reached. Proceeding to next target.")
+            print(f"Max retries ({MAX_PATCH_RETRIES}) reached. Proceeding to next target.")
             return "Select Target"
     return "Select Target"
 
 
+def mark_completed(state: InputState, work_item: str):
+    if work_item and work_item not in state.completed_work_items:
+        state.completed_work_items.append(work_item)
+
+def collect_work_items(state: InputState):
+    """
+    Groups the remaining (dependency, file) pairs by file. Different files are
+    independent; dependencies touching the same file run in order on that file.
+    """
+    items = {}
+    for target in state.targets:
+        dependency_name = target['dependency']
+        for file_info in dependency_files(state, dependency_name):
+            if f"{dependency_name}::{file_info['file']}" in state.completed_work_items:
+                continue
+            item = items.setdefault(file_info['file'], {"file_info": file_info, "dependencies": []})
+            if dependency_name not in item["dependencies"]:
+                item["dependencies"].append(dependency_name)
+    return list(items.values())
+
+def migrate_work_item(state: InputState, file_info: dict, dependencies: list):
+    """Runs Migration -> Patch -> Reflection (with retries) for one file on a private copy of the state."""
+    file_path = file_info['file']
+    result = {"file": file_path, "original": None, "generated": None, "diff": None, "validated": False,
+              "errors": {}, "retry_counts": {}}
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            code = f.read()
+    except Exception as e:
+        print(f"Error reading file {file_path}: {e}")
+        return result
+    result["original"] = code
+    # Dependencies finished before a resume already left their verified patch here
+    code = state.final_generated_code.get(file_path, code)
+
+    for dependency_name in dependencies:
+        check_cancelled()
+        work_item = f"{dependency_name}::{file_path}"
+        item_state = state.model_copy(update={
+            "targets": [],
+            "code": {file_path: result["original"]},
+            "generated_code": {},
+            "generated_diffs": {},
+            # current_source() starts from here when an earlier dependency already patched the file
+            "final_generated_code": {file_path: code} if code != result["original"] else {},
+            "errors": {},
+            "retry_counts": {},
+            "completed_work_items": [],
+            "retry_count": 0,
+            "validation_success": True,
+            "current_target_file": file_path,
+            "current_target_dependency": dependency_name,
+            "current_work_item": work_item,
+            "current_file_language": file_info['lang'],
+        })
+        Migration_Graph(item_state)
+        while True:
+            check_cancelled()
+            Patch_Graph(item_state)
+            Reflection_Graph(item_state)
+            if item_state.validation_success:
+                break
+            if item_state.retry_counts.get(work_item, 0) > MAX_PATCH_RETRIES:
+                print(f"Max retries ({MAX_PATCH_RETRIES}) reached for {work_item}.")
+                break
+            print(f"Validation failed for {work_item}. Retrying patch attempt {item_state.retry_counts[work_item]}/{MAX_PATCH_RETRIES}...")
+
+        generated = item_state.generated_code.get(file_path)
+        result["retry_counts"][work_item] = item_state.retry_counts.get(work_item, 0)
+        if item_state.errors:
+            result["errors"][dependency_name] = "\n".join(
+                e.decode(errors="replace") if isinstance(e, bytes) else str(e) for e in item_state.errors.values()
+            )
+        if generated:
+            result["generated"] = generated
+            result["diff"] = item_state.generated_diffs.get(file_path)
+            result["validated"] = item_state.validation_success
+            if item_state.validation_success:
+                # Next dependency builds on the verified patch
+                code = generated
+    return result
+
+@telemetry.traced(kind="node")
+def Parallel_Migration_Graph(state: InputState):
+    """
+    Migrates the next batch of files concurrently. The node loops back on
+    itself until no work is left, so every batch is its own checkpoint.
+    """
+    items = collect_work_items(state)
+    width = max(1, state.parallel_width)
+    batch = items[:width * PARALLEL_BATCH_FACTOR]
+    print(f"DEBUG: Migrating {len(batch)} of {len(items)} remaining files with parallel width {width}")
+
+    with ThreadPoolExecutor(max_workers=width) as pool:
+        futures = [
+            pool.submit(contextvars.copy_context().run, migrate_work_item, state, item["file_info"], item["dependencies"])
+            for item in batch
+        ]
+        results = []
+        for item, future in zip(batch, futures):
+            try:
+                results.append(future.result())
+            except JobCancelled:
+                # Items not started yet are dropped; running ones stop at their next check
+                for pending in futures:
+                    pending.cancel()
+                raise
+            except Exception as e:
+                print(f"Work item failed: {e}")
+                state.errors[item["file_info"]["file"]] = str(e)
+
+    for result in results:
+        file_path = result["file"]
+        if result["original"] is not None:
+            state.code[file_path] = result["original"]
+        if result["generated"]:
+            state.generated_code[file_path] = result["generated"]
+            if result["diff"]:
+                state.generated_diffs[file_path] = result["diff"]
+            else:
+                state.generated_diffs.pop(file_path, None)
+            if result["validated"]:
+                state.final_generated_code[file_path] = result["generated"]
+        if result["errors"]:
+            state.errors[file_path] = "\n".join(f"[{dep}] {err}" for dep, err in result["errors"].items())
+        state.retry_counts.update(result["retry_counts"])
+
+    # Attempted items are done either way; failures are recorded in errors
+    for item in batch:
+        for dependency_name in item["dependencies"]:
+            mark_completed(state, f"{dependency_name}::{item['file_info']['file']}")
+
+    if not collect_work_items(state):
+        state.targets = []
+    state.current_target_dependency = ""
+    state.current_work_item = ""
+    return state
+
+def parallel_migration_condition(state: InputState):
+    if collect_work_items(state):
+        return "Parallel Migration"
+    return "Finished State"
+
+def select_execution_mode(state: InputState):
+    if state.parallel_width > 1:
+        return "Parallel Migration"
+    return "Select Target"
+
+def create_checkpointer(path: Path = CHECKPOINT_PATH):
+    """
+    Durable SQLite checkpoints when langgraph-checkpoint-sqlite is installed,
+    otherwise in-memory ones (runs then only resume within the same process).
+    """
+    try:
+        from langgraph.checkpoint.sqlite import SqliteSaver
+    except ImportError:
+        print(
+            "WARNING: langgraph-checkpoint-sqlite is not installed; run checkpoints are kept in memory. "
+            "Runs cannot resume after a restart and each run's checkpoints are dropped when it ends.",
+            file=sys.stderr, flush=True,
+        )
+        return MemorySaver()
+    import sqlite3
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return SqliteSaver(sqlite3.connect(str(path), check_same_thread=False))
+
+def checkpoints_persistent(checkpointer):
+    """False for in-memory checkpoints, which only grow until their threads are deleted."""
+    return not isinstance(checkpointer, MemorySaver)
+
+def run_config(run_id: str, state: InputState = None):
+    """Checkpoint thread and a recursion limit sized to the run's remaining work."""
+    limit = MIN_RECURSION_LIMIT
+    if state is not None:
+        pairs = sum(len(item["dependencies"]) for item in collect_work_items(state))
+        limit = max(limit, 10 + len(state.targets) + STEPS_PER_WORK_ITEM * pairs)
+    return {"configurable": {"thread_id": run_id}, "recursion_limit": limit}
+
+
 
 graph_builder = StateGraph(InputState)
 
@@ -313,10 +622,12 @@ graph_builder.add_node("User Confirmation", User_confirmation_Graph)
 graph_builder.add_node("Knowledge", Knowledge_Graph)
 
 graph_builder.add_node("Rule Synthesis", RuleSynthesis_Graph)
+graph_builder.add_node("Codemods", Codemod_Graph)
 graph_builder.add_node("Select Target", select_next_target)
 graph_builder.add_node("Migration", Migration_Graph)
 graph_builder.add_node("Patch", Patch_Graph)
 graph_builder.add_node("Reflection", Reflection_Graph)
+graph_builder.add_node("Parallel Migration", Parallel_Migration_Graph)
 
 graph_builder.set_entry_point("User Confirmation")
 
@@ -329,7 +640,23 @@ graph_builder.add_conditional_edges(
         "Rule Synthesis": "Rule Synthesis"
     }
 )
-graph_builder.add_edge("Rule Synthesis", "Select Target")
+graph_builder.add_edge("Rule Synthesis", "Codemods")
+graph_builder.add_conditional_edges(
+    "Codemods",
+    select_execution_mode,
+    {
+        "Select Target": "Select Target",
+        "Parallel Migration": "Parallel Migration"
+    }
+)
+graph_builder.add_conditional_edges(
+    "Parallel Migration",
+    parallel_migration_condition,
+    {
+        "Parallel Migration": "Parallel Migration",
+        "Finished State": END
+    }
+)
 
 graph_builder.add_conditional_edges(
     "Select Target",
@@ -354,10 +681,8 @@ graph_builder.add_conditional_edges(
     }
 )
 
-graph = graph_builder.compile()
-
-
-graph = graph_builder.compile()
+# Checkpointed per node under thread_id=run_id so failed or cancelled runs can resume
+graph = graph_builder.compile(checkpointer=create_checkpointer())
 
 # ---------------- RENDER AS PNG ----------------
 
@@ -1,17 +1,65 @@
 from huggingface_hub import InferenceClient
 from .api_import import HUGGING_FACE, TAVILY
 from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import threading
+import time
 from langchain_community.document_loaders import WebBaseLoader
 from tavily import TavilyClient
 from pydantic import AnyUrl
 from utils import retry_with_backoff
+from .web_cache import get_web_cache
+from telemetry import propagate_context, telemetry
 
 from model_utils import get_llm_client, MODEL_NAME
 
+# Concurrency limits for the retrieval fan-out
+MAX_RETRIEVAL_WORKERS = 8
+PER_HOST_LIMIT = 2
+RETRIEVAL_DEADLINE_SECONDS = 90
+
+
+class HostLimiter:
+    """Caps the number of in-flight requests per hostname."""
+    def __init__(self, limit=PER_HOST_LIMIT):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    def for_url(self, url):
+        host = urlparse(url).hostname or ""
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.limit)
+            return self._semaphores[host]
+
+
+class CachedWebBaseLoader(WebBaseLoader):
+    """WebBaseLoader that reads page HTML through the on-disk web cache."""
+    def __init__(self, web_path, web_cache, **kwargs):
+        super().__init__(web_path, **kwargs)
+        self.web_cache = web_cache
+
+    def _scrape(self, url, parser=None, bs_kwargs=None):
+        from bs4 import BeautifulSoup
+
+        if parser is None:
+            parser = "xml" if url.endswith(".xml") else self.default_parser
+        html = self.web_cache.fetch_page(url)
+        return BeautifulSoup(html, parser, **(bs_kwargs or {}))
+
+
 class KnowledgeRetriever:
-    def __init__(self):
+    def __init__(self, search_client=None, max_workers=MAX_RETRIEVAL_WORKERS,
+                 per_host_limit=PER_HOST_LIMIT, deadline=RETRIEVAL_DEADLINE_SECONDS,
+                 web_cache=None, use_cache=True):
         self.hf_token = HUGGING_FACE
         self.tavily_api_key = TAVILY
+        self.search_client = search_client
+        self.web_cache = (web_cache or get_web_cache()) if use_cache else None
+        self.max_workers = max_workers
+        self.deadline = deadline
+        self.host_limiter = HostLimiter(per_host_limit)
         self.ui_patterns = [
             r"skip to content",
             r"table of contents",
@@ -78,7 +126,10 @@ class KnowledgeRetriever:
 
     def chunking_results(self, link: AnyUrl):
         try:
-            docs = WebBaseLoader(link).load()
+            if self.web_cache:
+                docs = CachedWebBaseLoader(link, self.web_cache).load()
+            else:
+                docs = WebBaseLoader(link).load()
         except Exception as e:
             print(f"Error loading {link}: {e}")
             return None
@@ -149,48 +200,90 @@ class KnowledgeRetriever:
             except Exception:
                 return 'Low'
 
+    def _run_query(self, client, q):
+        print(f"Searching for: {q}")
+        try:
+            with telemetry.span("tavily.search", "http", cached=bool(self.web_cache)):
+                if self.web_cache:
+                    response = self.web_cache.cached_search(client, q, max_results=1)
+                else:
+                    response = client.search(
+                        query=q,
+                        max_results=1,
+                    )
+        except Exception as e:
+            print(f"Error searching for {q}: {e}")
+            return []
+        return [r for r in response.get("results", []) if r.get("url") and "youtube" not in r.get("url")]
+
+    def _process_result(self, q, r):
+        flag = True
+        url = r.get("url")
+        print(f"Processing URL: {url}")
+        with self.host_limiter.for_url(url):
+            try:
+                with telemetry.span("page.load", "http", host=urlparse(url).netloc):
+                    content = self.chunking_results(url)
+                if not content:
+                    flag = False
+            except Exception as e:
+                print(f"  Failed to chunk {url}: {e}")
+                return None
+
+        priority = self.priority_assignment(url)
+
+        return {
+            "priority": priority,
+            "query": q,
+            "title": r.get("title"),
+            "url": r.get("url"),
+            "content": r.get("content"),
+            "score": r.get("score"),
+            "chunk": "\n\n".join([d.page_content for d in content]) if flag and content else 'no_content',
+            "status": 'works' if flag else 'broken'
+        }
+
     def search(self, search_queries=None):
         if not search_queries:
             print("No generated queries provided. Falling back to default queries.")
             search_queries = self.default_queries
-        client = TavilyClient(api_key=self.tavily_api_key)
-        documents = []
-        for q in search_queries:
-            print(f"Searching for: {q}")
-            try:
-                response = client.search(
-                    query=q,
-                    max_results=1,
-                )
-            except Exception as e:
-                print(f"Error searching for {q}: {e}")
-                continue
-                
-            for r in response.get("results", []):
-                flag = True
-                url = r.get("url")
-                if "youtube" in url:
-                    continue
-                print(f"Processing URL: {url}")
-                try:
-                    content = self.chunking_results(url)
-                    if not content:
-                        flag = False
-                except Exception as e:
-                    print(f"  Failed to chunk {url}: {e}")
-                    flag = False
-                    continue
-                
-                priority = self.priority_assignment(url)
-                
-                documents.append({
-                    "priority": priority,
-                    "query": q,
-                    "title": r.get("title"),
-                    "url": r.get("url"),
-                    "content": r.get("content"),
-                    "score": r.get("score"),
-                    "chunk": "\n\n".join([d.page_content for d in content]) if flag and content else 'no_content',
-                    "status": 'works' if flag else 'broken'
-                })
-        return documents
+        client = self.search_client or TavilyClient(api_key=self.tavily_api_key)
+        deadline = time.monotonic() + self.deadline
+
+        # Searches, page fetches and authority classification all share one
+        # bounded pool; a finished search immediately schedules its page loads.
+        # Documents are returned in query order, like the sequential version.
+        results = {}
+        pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            pending = {}
+            for idx, q in enumerate(search_queries):
+                pending[pool.submit(propagate_context(self._run_query), client, q)] = ("search", idx, q)
+
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    print(f"Retrieval deadline of {self.deadline}s reached, dropping {len(pending)} pending tasks.")
+                    for future in pending:
+                        future.cancel()
+                    break
+                done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, idx, q = pending.pop(future)
+                    try:
+                        outcome = future.result()
+                    except Exception as e:
+                        print(f"Retrieval task failed for {q}: {e}")
+                        continue
+                    if kind == "search":
+                        for pos, r in enumerate(outcome):
+                            pending[pool.submit(propagate_context(self._process_result), q, r)] = ("page", (idx, pos), q)
+                    elif outcome:
+                        results[idx] = outcome
+        finally:
+            # Do not block on stragglers once the deadline has passed.
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        if self.web_cache:
+            print(f"DEBUG: Web cache stats: {self.web_cache.snapshot()}")
+        return [results[key] for key in sorted(results)]
@@ -30,7 +30,21 @@ Risks and Caveats:
 from RAGs.api_import import HUGGING_FACE
 from pathlib import Path
 import os
+import ast
+import re
+import textwrap
+from concurrent.futures import ThreadPoolExecutor
 from utils import retry_with_backoff
+from telemetry import propagate_context, telemetry
+from RAGs.code_chunker import CHUNK_MIN_LINES, import_context, referenced_names, select_chunks, splice, split_code
+from RAGs.patch_edits import EDIT_FORMAT, EditError, apply_edits, parse_edits, render_diff
+
+# Chunks of one file patched concurrently
+CHUNK_WORKERS = int(os.getenv("PATCHPILOT_CHUNK_WORKERS", "4"))
+# "diff" asks for search/replace edits, "chunked" has the chunks the steps touch rewritten,
+# "full" has the whole file rewritten; the first two only show long files' relevant chunks
+PATCH_MODE = os.getenv("PATCHPILOT_PATCH_MODE", "diff")
+CODE_FENCE = re.compile(r"^\s*```[\w+-]*[ \t]*\n(.*?)\n?```\s*$", re.DOTALL)
 
 CODING_GUIDE = """You are a code modification engine.
 
@@ -147,3 +161,159 @@ class PatchGenerator:
         queries = queries.strip()
         return queries
 
+    @retry_with_backoff()
+    def generate_chunk(self, migration_steps: str, path: str, context: str, chunk: str) -> str:
+        USER_PROMPT = f"""Apply the following migration steps to an excerpt of the file {path}.
+
+                        Migration Steps:
+                        {migration_steps}
+
+                        Imports of the file (context only, do NOT return them):
+                        {context}
+
+                        Excerpt to modify:
+                        {chunk}
+
+                        OUTPUT REQUIREMENTS:
+                        - Return the FULL updated excerpt and nothing else.
+                        - Only apply steps that concern code inside the excerpt; return untouched code unchanged.
+                        - Apply migration steps respecting rule priority.
+                        - Every modified or added line MUST include an inline comment containing:
+                          - The migration step's description of the code change
+                          - The source URL(s) for that rule
+                        - Do NOT add explanations outside code comments.
+                        - Do NOT change formatting except where required by the change.
+                        """
+        response = self.client.chat.completions.create(
+            messages=[
+                {"role": "system", "content": CODING_GUIDE},
+                {"role": "user", "content": USER_PROMPT}
+            ],
+            max_tokens=2048,
+            temperature=0.0
+        )
+        return response.choices[0].message.content
+
+    def _patch_chunk(self, migration_steps, path, context, text):
+        # Sent dedented (methods of a long class), so the model sees plain top-level code
+        body = textwrap.dedent(text)
+        first = next((line for line in text.splitlines() if line.strip()), "")
+        first_body = next((line for line in body.splitlines() if line.strip()), "")
+        indent = first[:len(first) - len(first_body)]
+        patched = self.generate_chunk(migration_steps, path, context, body)
+        fenced = CODE_FENCE.match(patched)
+        patched = (fenced.group(1) if fenced else patched).strip("\n")
+        if indent:
+            patched = textwrap.indent(patched, indent)
+        # Blank lines around the chunk separate it from its neighbours; the model tends to drop them
+        leading = text[:len(text) - len(text.lstrip("\n"))]
+        trailing = text[len(text.rstrip("\n")):]
+        return leading + patched + trailing
+
+    @retry_with_backoff()
+    def generate_edits(self, migration_steps: str, path: str, code: str) -> str:
+        USER_PROMPT = f"""Apply the following migration steps to the code of {path}.
+
+                        Migration Steps:
+                        {migration_steps}
+
+                        Code to modify (excerpts of a longer file are separated by lines containing only "..."):
+                        {code}
+
+                        OUTPUT REQUIREMENTS:
+                        {EDIT_FORMAT}
+                        - Apply migration steps respecting rule priority.
+                        - Every modified or added line MUST include an inline comment containing:
+                          - The migration step's description of the code change
+                          - The source URL(s) for that rule
+                        - If a lower-priority step is skipped or overridden, document it with a TODO comment.
+                        """
+        response = self.client.chat.completions.create(
+            messages=[
+                {"role": "system", "content": CODING_GUIDE},
+                {"role": "user", "content": USER_PROMPT}
+            ],
+            max_tokens=2048,
+            temperature=0.0
+        )
+        return response.choices[0].message.content
+
+    def _chunks_to_patch(self, migration_steps, code, language):
+        """
+        (lines, chunks, selected) for a long file that can be cut into
+        chunks, selected being those that mention an API the steps name.
+        None when the file is to be patched whole.
+        """
+        lines = code.splitlines(keepends=True)
+        names = referenced_names(migration_steps)
+        if PATCH_MODE == "full" or len(lines) <= CHUNK_MIN_LINES or not names:
+            return None
+        chunks = split_code(code, language)
+        if not chunks:
+            return None
+        selected = select_chunks(chunks, lines, names)
+        telemetry.count("patch_chunks", len(selected), mode="patched")
+        telemetry.count("patch_chunks", len(chunks) - len(selected), mode="skipped")
+        return lines, chunks, selected
+
+    def _regenerate(self, migration_steps, path, code, language, split):
+        """The file with the selected chunks (or the whole file) written out again by the model."""
+        if split is None:
+            telemetry.count("patch_chunks", mode="whole_file")
+            return self.generate_code(migration_steps, code)
+        lines, chunks, selected = split
+        print(f"DEBUG: Patching {len(selected)} of {len(chunks)} chunks of {path}")
+        context = import_context(lines)
+        with ThreadPoolExecutor(max_workers=max(1, min(CHUNK_WORKERS, len(selected)))) as pool:
+            patch = propagate_context(self._patch_chunk)
+            futures = {chunk: pool.submit(patch, migration_steps, path, context, chunk.text(lines)) for chunk in selected}
+            patched = splice(lines, {chunk: future.result() for chunk, future in futures.items()})
+        if language == "python":
+            try:
+                ast.parse(patched)
+            except (SyntaxError, ValueError) as e:
+                # A chunk that no longer fits its surroundings; the whole-file prompt sees all of it
+                print(f"Chunked patch of {path} does not parse ({e}); patching the whole file")
+                telemetry.count("patch_chunks", mode="whole_file")
+                return self.generate_code(migration_steps, code)
+        return patched
+
+    def _apply_model_edits(self, migration_steps, path, code, language, split):
+        """(patched code, unified diff) from model edits; raises EditError when they do not apply."""
+        shown, within = code, None
+        if split is not None:
+            lines, _, selected = split
+            shown = "...\n".join(chunk.text(lines) for chunk in selected)
+            # SEARCH blocks can only be unique within what the model saw
+            within = [(chunk.start, chunk.end) for chunk in selected]
+        edits = parse_edits(self.generate_edits(migration_steps, path, shown))
+        patched, matches = apply_edits(code, edits, language, within)
+        return patched, render_diff(code, matches)
+
+    def patch_file(self, migration_steps: str, path: str, code: str, language: str = None) -> tuple[str, str]:
+        """
+        (patched code, unified diff) for one file; the diff is "" when the
+        code was written out again rather than edited.
+
+        In "diff" mode the model answers with search/replace blocks, which
+        are applied here with fuzzy matching and checked to parse, so output
+        tokens scale with the change instead of the file. Edits that do not
+        apply fall back to regeneration. Long files are cut at function and
+        class boundaries and only the chunks that mention an API named in
+        the steps are shown to the model; regenerated chunks are spliced
+        back in place. Short files, code that cannot be split and steps
+        naming no API are patched whole.
+        """
+        split = self._chunks_to_patch(migration_steps, code, language)
+        if split is not None and not split[2]:
+            print(f"DEBUG: No chunk of {path} uses an API the migration steps change")
+            return code, ""
+        if PATCH_MODE == "diff":
+            try:
+                patched, diff = self._apply_model_edits(migration_steps, path, code, language, split)
+                telemetry.count("patch_edits", outcome="applied")
+                return patched, diff
+            except EditError as e:
+                print(f"Edits for {path} did not apply ({e}); regenerating the code")
+                telemetry.count("patch_edits", outcome="fallback")
+        return self._regenerate(migration_steps, path, code, language, split), ""
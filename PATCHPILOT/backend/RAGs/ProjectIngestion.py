@@ -1,14 +1,28 @@
 import os 
 from pathlib import Path
-import zipfile
 import json
 import re
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from RAGs.archive_extractor import SafeExtractor, archive_kind, archive_root, extract_archive
+from RAGs.ingest_manifest import ManifestEntry, get_manifest
+from RAGs.project_walker import DEFAULT_IGNORED_DIRS, walk_files
+from RAGs.sandbox import DEPENDENCY_MANIFESTS
+from RAGs.import_scanner import IMPORT_PATTERNS, open_buffer, scan_imports
+from RAGs.python_imports import (
+    PARSE_BATCH, batch_result, local_modules, parse_batch, submit_batch, third_party,
+)
 
 BASE_DIR = Path(__file__).resolve()
 while BASE_DIR.name != "backend":
     BASE_DIR = BASE_DIR.parent
 uploads_dir = BASE_DIR / "uploads"
 
+INGEST_WORKERS = int(os.getenv("PATCHPILOT_INGEST_WORKERS", "4"))
+# Paths per classification task on the pool
+CLASSIFY_BATCH = 256
+
 ALLOWED_EXTENSIONS = {
     "python": {".py"},
     "node": {".js", ".mjs", ".cjs", ".ts", ".jsx", ".tsx"},
@@ -26,52 +40,136 @@ AUX_FILES = {
     "pyproject.toml",
 }
 
+
+def classify_file(file_path):
+    """('code', {"file", "lang"}), ('aux', path) or None, decided by file name alone."""
+    filename = os.path.basename(file_path)
+    for key, val in ALLOWED_EXTENSIONS.items():
+        if "." + filename.split('.')[-1] in val:
+            return "code", {"file": file_path, "lang": key}
+    if filename in AUX_FILES:
+        return "aux", file_path
+    return None
+
+
+def classify_batch(paths):
+    return [result for result in map(classify_file, paths) if result]
+
+
 class ProjectIngestor:
-    def __init__(self):
+    def __init__(self, use_manifest=True, ignore_dirs=DEFAULT_IGNORED_DIRS, use_gitignore=True, workers=INGEST_WORKERS):
         self.code_files = []
         self.text_docs = []
         self.dependencies_in_code_files = {}
+        # dependency -> ids (positions in self.code_files) of the files importing it
+        self.import_index = {}
+        self.root = None
+        self.manifest = get_manifest() if use_manifest else None
+        self.ignore_dirs = ignore_dirs
+        self.use_gitignore = use_gitignore
+        self.workers = max(1, workers)
+        # Files whose imports were scanned vs. reused from the manifest
+        self.stats = {"scanned": 0, "reused": 0}
                     
     def process_file(self, file_path):
-        filename = os.path.basename(file_path)
-        # print(f"DEBUG: Processing potential file: {filename}")
-        for key, val in ALLOWED_EXTENSIONS.items():
-            if "." + filename.split('.')[-1] in val:
-                print(f"DEBUG: Found code file ({key}): {filename}")
-                self.code_files.append({"file": file_path, "lang": key})
-                return
-        
-        if filename in AUX_FILES:
-            print(f"DEBUG: Found aux file: {filename}")
-            self.text_docs.append(file_path)
+        result = classify_file(file_path)
+        if result:
+            self._record(*result)
 
-    def ingest_directory_recursive(self, directory):
+    def _record(self, kind, value):
+        if kind == "code":
+            self.code_files.append(value)
+        else:
+            self.text_docs.append(value)
+
+    def keeps_member(self, name):
+        """Whether an archive member is worth writing: code, aux, dependency files and archives outside ignored dirs."""
+        parts = name.replace("\\", "/").split("/")
+        if any(part in self.ignore_dirs or part.startswith(".") for part in parts[:-1] if part not in ("", ".")):
+            return False
+        return classify_file(name) is not None or parts[-1] in DEPENDENCY_MANIFESTS or archive_kind(name) is not None
+
+    def iter_archive(self, source, name, dest):
+        """
+        Streams a zip or tar.gz (path or file object) into dest and yields
+        each code file record as soon as it is written, so ingestion runs
+        while the archive is still being unpacked. Raises
+        ArchiveLimitExceeded when the archive breaks a size cap.
+        """
+        dest = os.path.abspath(dest)
+        if self.root is None:
+            self.root = dest
+        return self._extract_and_classify(source, name, dest)
+
+    def _extract_and_classify(self, source, name, dest):
+        print(f"DEBUG: Ingesting archive: {os.path.basename(name)}")
+        code_count, aux_count = len(self.code_files), len(self.text_docs)
+        extractor = SafeExtractor(dest, keep=self.keeps_member)
+        for path in extractor.extract(source, name):
+            result = classify_file(path)
+            if result:
+                self._record(*result)
+                if result[0] == "code":
+                    yield result[1]
+        print(f"DEBUG: Found {len(self.code_files) - code_count} code files and "
+              f"{len(self.text_docs) - aux_count} aux files in {os.path.basename(name)} "
+              f"({extractor.bytes_written} bytes written, {extractor.skipped} members skipped)")
+
+    def iter_directory(self, directory):
+        """
+        Walks directory and yields each code file record as soon as its batch
+        is classified, so dependency detection can start before the walk ends.
+        Nested .zip and .tar.gz archives are safely extracted on the pool and
+        walked afterwards.
+        """
+        directory = os.path.abspath(directory)
+        # Set before the walk starts: detect_dependencies() needs it up front
+        if self.root is None:
+            self.root = directory
+        return self._walk_and_classify(directory)
+
+    def _walk_and_classify(self, directory):
         print(f"DEBUG: Ingesting directory: {directory}")
-        try:
-            for item in os.listdir(directory):
-                item_path = os.path.join(directory, item)
-                
-                if os.path.isdir(item_path):
-                    if item.startswith('.') or item == "node_modules" or item == "venv":
+        code_count, aux_count = len(self.code_files), len(self.text_docs)
+        skip_dirs = set()
+        roots = [directory]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while roots:
+                root = roots.pop(0)
+                skip_dirs.discard(root)
+                pending = deque()
+                archives = []
+                batch = []
+                for entry in walk_files(root, self.ignore_dirs, self.use_gitignore, skip_dirs):
+                    if archive_kind(entry.name):
+                        # Its extraction directory is walked once the archive is unpacked
+                        extract_path = archive_root(entry.path)
+                        skip_dirs.add(extract_path)
+                        archives.append(pool.submit(extract_archive, entry.path, extract_path, self.keeps_member))
                         continue
-                    self.ingest_directory_recursive(item_path)
-                    continue
-
-                if item.endswith(".zip"):
-                    try:
-                        extract_path = os.path.splitext(item_path)[0]
-                        os.makedirs(extract_path, exist_ok=True)
-                        with zipfile.ZipFile(item_path, 'r') as zip_ref:
-                            zip_ref.extractall(extract_path)
-                        self.ingest_directory_recursive(extract_path)
-                    except Exception as e:
-                        print(f"Error processing zip {item}: {e}")
-                    continue
-
-                self.process_file(item_path)
-                
-        except Exception as e:
-            print(f"Error accessing directory {directory}: {e}")
+                    batch.append(entry.path)
+                    if len(batch) >= CLASSIFY_BATCH:
+                        pending.append(pool.submit(classify_batch, batch))
+                        batch = []
+                        while len(pending) > self.workers * 2:
+                            yield from self._collect(pending.popleft())
+                if batch:
+                    pending.append(pool.submit(classify_batch, batch))
+                while pending:
+                    yield from self._collect(pending.popleft())
+                roots.extend(path for path in (f.result() for f in archives) if path)
+        print(f"DEBUG: Found {len(self.code_files) - code_count} code files and "
+              f"{len(self.text_docs) - aux_count} aux files under {directory}")
+
+    def _collect(self, future):
+        for kind, value in future.result():
+            self._record(kind, value)
+            if kind == "code":
+                yield value
+
+    def ingest_directory_recursive(self, directory):
+        for _ in self.iter_directory(directory):
+            pass
 
     def load_project_dependencies(self):
         deps = {
@@ -120,37 +218,112 @@ class ProjectIngestor:
 
         return deps
 
-    def detect_dependencies(self):
-        project_deps = self.load_project_dependencies()
+    def _cached_imports(self, path, lang, entry):
+        """(stat, imports) with imports reused from the manifest when size and mtime are unchanged."""
+        stat = path.stat()
+        if entry and entry.lang == lang and entry.size == stat.st_size and entry.mtime_ns == stat.st_mtime_ns:
+            self.stats["reused"] += 1
+            return stat, entry.imports
+        return stat, None
+
+    def _store(self, path, lang, stat, entry, content_hash, imports, updated):
+        if imports is None:
+            self.stats["reused"] += 1
+            imports = entry.imports
+        else:
+            self.stats["scanned"] += 1
+        updated[str(path)] = ManifestEntry(stat.st_size, stat.st_mtime_ns, content_hash, lang, imports)
+        return imports
+
+    def _file_imports(self, path, lang, previous, updated):
+        entry = previous.get(str(path))
+        stat, imports = self._cached_imports(path, lang, entry)
+        if imports is not None:
+            return imports
+        with open_buffer(path) as buf:
+            content_hash = hashlib.sha1(buf).hexdigest()
+            same = entry and entry.lang == lang and entry.content_hash == content_hash
+            imports = None if same else scan_imports(buf, lang)
+        return self._store(path, lang, stat, entry, content_hash, imports, updated)
+
+    def _parse_python(self, pending, previous, updated, scanned):
+        """Stores the results of a (batch, future) parse; future is None for a batch parsed in-process."""
+        batch, future = pending
+        results = batch_result(future, [item[3] for item in batch]) if future else parse_batch([item[3] for item in batch])
+        for (file, path, stat, _), result in zip(batch, results):
+            if result is None:
+                continue
+            entry = previous.get(str(path))
+            content_hash, imports = result
+            scanned.append((file, self._store(path, "python", stat, entry, content_hash, imports, updated)))
+
+    def detect_dependencies(self, files=None):
+        """
+        Scans imports of self.code_files, or of `files` as they arrive (e.g.
+        the iter_directory() generator, to overlap the scan with the walk).
+
+        Python files are parsed with ast on a process pool, and their imports
+        are reported as canonical distribution names (jose -> python-jose),
+        leaving out the standard library and the project's own modules.
+        Each file is listed at most once per dependency, and counts are the
+        number of files importing a dependency.
+        """
         count_dependencies = {}
-        PATTERNS = {
-            "python": re.compile(r'^\s*(?:import|from)\s+([a-zA-Z_][\w.]*)', re.IGNORECASE),
-            "node": re.compile(r'(?:from\s+[\'"]([^\'"]+)[\'"])|(?:require\s*\(\s*[\'"]([^\'"]+)[\'"])', re.IGNORECASE),
-            "java": re.compile(r'^\s*import\s+([a-zA-Z_][\w.]*);', re.IGNORECASE),
-            "go": re.compile(r'^\s*import\s+[\'"]([^\'"]+)[\'"]', re.IGNORECASE),
-            "c": re.compile(r'^\s*#include\s*[<"]([^>"]+)[>"]', re.IGNORECASE),
-            "cpp": re.compile(r'^\s*#include\s*[<"]([^>"]+)[>"]', re.IGNORECASE),
-        }
-        for file in self.code_files:
-            used = set()
+        manifest = self.manifest if self.root else None
+        previous = manifest.load(self.root) if manifest else {}
+        updated = {}
+        seen = set()
+        scanned = []
+        python_batch = []
+        submitted = []
+        for file in (self.code_files if files is None else files):
             path = Path(file["file"])
             if not path.exists():
                 continue
-            lines = path.read_text(errors="ignore").splitlines()
             lang = file["lang"]
-            pattern = PATTERNS.get(lang)
-            if not pattern:
+            if lang not in IMPORT_PATTERNS:
+                continue
+            seen.add(str(path))
+            if lang != "python":
+                scanned.append((file, self._file_imports(path, lang, previous, updated)))
                 continue
-            for line in lines:
-                line = line.strip()
-                match = pattern.search(line)
-                if match:
-                    dep = next((g for g in match.groups() if g is not None), None)
-                    if dep:
-                        used.add(dep)
-                        count_dependencies[dep] = count_dependencies.get(dep, 0) + 1
-                        if dep not in self.dependencies_in_code_files:
-                            self.dependencies_in_code_files[dep] = []
-                        self.dependencies_in_code_files[dep].append(file)
-            file["dependencies"] = list(used)
-        return self.code_files, count_dependencies , self.dependencies_in_code_files
\ No newline at end of file
+            entry = previous.get(str(path))
+            stat, imports = self._cached_imports(path, lang, entry)
+            if imports is not None:
+                scanned.append((file, imports))
+                continue
+            known_hash = entry.content_hash if entry and entry.lang == lang else None
+            python_batch.append((file, path, stat, (str(path), known_hash)))
+            if len(python_batch) >= PARSE_BATCH:
+                submitted.append((python_batch, submit_batch([item[3] for item in python_batch])))
+                python_batch = []
+        # Scans too small to fill a batch never pay for starting worker processes
+        if python_batch:
+            pending = (python_batch, submit_batch([item[3] for item in python_batch]) if submitted else None)
+            submitted.append(pending)
+        for pending in submitted:
+            self._parse_python(pending, previous, updated, scanned)
+
+        python_files = {file["file"]: imports for file, imports in scanned if file["lang"] == "python"}
+        local = local_modules(list(python_files), self.root, python_files)
+        # Streamed records are already in code_files; anything else is added
+        file_ids = {id(file): i for i, file in enumerate(self.code_files)}
+        for file, imports in scanned:
+            if file["lang"] == "python":
+                imports = third_party(imports, local)
+            else:
+                imports = list(dict.fromkeys(imports))
+            file["dependencies"] = imports
+            if id(file) not in file_ids:
+                file_ids[id(file)] = len(self.code_files)
+                self.code_files.append(file)
+            for dep in imports:
+                self.import_index.setdefault(dep, set()).add(file_ids[id(file)])
+        for dep, ids in self.import_index.items():
+            count_dependencies[dep] = len(ids)
+            self.dependencies_in_code_files[dep] = [self.code_files[i] for i in sorted(ids)]
+        project_deps = self.load_project_dependencies()
+        if manifest:
+            manifest.save(self.root, updated, removed=set(previous) - seen)
+        print(f"DEBUG: Import scan: {self.stats['scanned']} files scanned, {self.stats['reused']} reused from manifest")
+        return self.code_files, count_dependencies , self.dependencies_in_code_files
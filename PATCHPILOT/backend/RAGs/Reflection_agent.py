@@ -71,7 +71,7 @@ class ReflectionAgent:
 
         return inferred
 
-    def generate_dockerfile(
+    def build_spec(
         self,
         code_language: str,
         code_version: str = "",
@@ -80,6 +80,7 @@ class ReflectionAgent:
         run_args: dict | None = None,
         project_context: dict | None = None
     ):
+        """Resolves the base image, install steps and run command for a verification."""
         if not self.config:
             if self.config_path.exists():
                  self.config = json.loads(self.config_path.read_text())
@@ -112,8 +113,6 @@ class ReflectionAgent:
                 print(f"Warning: Unknown install preset '{install_preset}', defaulting to valid one.")
              install_steps = list(self.config["install_presets"].values())[0]["steps"]
 
-        install_block = "\n".join(install_steps)
-        
         try:
             run_cmd_template = self.config["run_profiles"][run_profile]["cmd"]
         except KeyError:
@@ -136,13 +135,34 @@ class ReflectionAgent:
             # If formatting fails (e.g. missing other keys), fallback
             run_cmd = ["python", run_args.get("entry")] 
 
+        return {
+            "language": lang_key,
+            "version": code_version,
+            "install_preset": install_preset or "",
+            "base_image": base_image,
+            "install_steps": list(install_steps),
+            "run_cmd": run_cmd,
+        }
+
+    def generate_dockerfile(
+        self,
+        code_language: str,
+        code_version: str = "",
+        install_preset: str = "",
+        run_profile: str = "",
+        run_args: dict | None = None,
+        project_context: dict | None = None
+    ):
+        spec = self.build_spec(code_language, code_version, install_preset, run_profile, run_args, project_context)
+        install_block = "\n".join(spec["install_steps"])
+
         if self.template_path.exists():
             template = self.template_path.read_text()
             dockerfile = (
                 template
-                .replace("{{ BASE_IMAGE }}", base_image)
+                .replace("{{ BASE_IMAGE }}", spec["base_image"])
                 .replace("{{ INSTALL_STEPS }}", install_block)
-                .replace("{{ RUN_COMMAND }}", json.dumps(run_cmd))
+                .replace("{{ RUN_COMMAND }}", json.dumps(spec["run_cmd"]))
             )
             output_path = self.base_dir / "virtual_testing" / "Dockerfile"
             output_path.parent.mkdir(parents=True, exist_ok=True)
@@ -150,4 +170,3 @@ class ReflectionAgent:
             return dockerfile
         else:
             raise FileNotFoundError(f"Template not found at {self.template_path}")
-
@@ -1,10 +1,34 @@
 from RAGs.api_import import HUGGING_FACE
+from RAGs.rule_store import REDUCE_PREFIX, normalize_library
 from utils import retry_with_backoff
+from concurrent.futures import ThreadPoolExecutor
+from telemetry import propagate_context, telemetry
+from jobs import check_cancelled
+import hashlib
+import math
+import os
+import re
+import time
+import numpy as np
+import orjson
 
 from model_utils import get_llm_client, MODEL_NAME
 
+# Match Ollama's server-side parallelism so requests don't just queue up there
+RULE_SYNTHESIS_CONCURRENCY = int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))
+# Upper bound on rules sent to the supervisor in a single compile prompt
+MAX_RULES_PER_COMPILE = 30
+DEFAULT_PARTITION = "general"
+# Cosine similarity (TF-IDF) above which two rules are treated as duplicates
+DEDUP_SIMILARITY_THRESHOLD = 0.85
+PRIORITY_RANK = {"CRITICAL": 3, "HIGH": 2, "MEDIUM": 1, "LOW": 0}
+STOPWORDS = {"a", "an", "the", "to", "of", "in", "on", "for", "and", "or", "is", "are", "be", "should", "must"}
+
 class RuleSynthesizer:
-    def __init__(self):
+    def __init__(self, concurrency=RULE_SYNTHESIS_CONCURRENCY):
+        self.concurrency = max(1, concurrency)
+        self.failed_docs = []
+        self.dedup_stats = {}
         self.model_guide = MODEL_NAME
         self.model_supervise = MODEL_NAME
         self.client_guide = get_llm_client(self.model_guide)
@@ -32,6 +56,8 @@ class RuleSynthesizer:
         3. Each rule must be atomic and unambiguous.
         4. Do NOT invent or generalize rules.
         5. Write rules suitable for later overlap comparison.
+        6. Set "library" to the lowercase package name the rule applies to.
+        7. Set "version_range" to the versions the rule applies to (e.g. ">=2.0,<3.0"), or "" if unknown.
 
         PRIORITY LEVELS:
         - CRITICAL
@@ -45,6 +71,8 @@ class RuleSynthesizer:
             "rules": [
                 {{
                     "rule_id": "short-id",
+                    "library": "package-name",
+                    "version_range": ">=2.0,<3.0",
                     "rule_text": "Clear enforceable rule",
                     "priority": "CRITICAL | HIGH | MEDIUM | LOW",
                     "source": {{
@@ -122,13 +150,296 @@ class RuleSynthesizer:
         queries = self._clean_json(queries)
         return queries
 
+    def _safe_guidance(self, doc):
+        # get_guidance already retries on its own; a doc that still fails is
+        # dropped instead of aborting the whole synthesis.
+        check_cancelled()
+        try:
+            return self.get_guidance(doc)
+        except Exception as e:
+            print(f"Rule synthesis failed for {doc.get('url', '')}: {e}")
+            self.failed_docs.append(doc.get("url", ""))
+            return None
+
     def rules_synthesis(self, docs):
-        rules = []
-        for doc in docs:
-            rule = self.get_guidance(doc)
-            rules.append(rule)
-        return rules
+        self.failed_docs = []
+        if self.concurrency == 1 or len(docs) <= 1:
+            results = [self._safe_guidance(doc) for doc in docs]
+        else:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                # map() keeps results in document order
+                results = list(pool.map(propagate_context(self._safe_guidance), docs))
+        return [rule for rule in results if rule is not None]
+
+    @staticmethod
+    def parse_rules(raw, key="rules"):
+        """Best-effort parse of an LLM rule payload into a list of rule dicts."""
+        if isinstance(raw, dict):
+            data = raw
+        elif isinstance(raw, list):
+            return [r for item in raw for r in RuleSynthesizer.parse_rules(item, key)]
+        else:
+            try:
+                data = orjson.loads(raw)
+            except Exception:
+                match = re.search(r"\{[\s\S]*\}", raw or "")
+                if not match:
+                    return []
+                try:
+                    data = orjson.loads(match.group(0))
+                except Exception:
+                    return []
+        if isinstance(data, list):
+            return [r for r in data if isinstance(r, dict)]
+        if not isinstance(data, dict):
+            return []
+        rules = data.get(key, data.get("rules", data.get("final_rules", [])))
+        return [r for r in rules if isinstance(r, dict)]
+
+    @staticmethod
+    def partition_key(rule):
+        library = normalize_library(rule.get("library"))
+        if library:
+            return library
+        rule_id = str(rule.get("rule_id") or "").strip().lower()
+        prefix = re.split(r"[-_.:/\s]", rule_id, maxsplit=1)[0] if rule_id else ""
+        return normalize_library(prefix) or DEFAULT_PARTITION
+
+    @staticmethod
+    def _digest(rules):
+        return hashlib.sha256(orjson.dumps(rules, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+    @staticmethod
+    def _normalize_text(text):
+        tokens = re.findall(r"[a-z0-9_]+(?:\.[a-z0-9_]+)*", str(text or "").lower())
+        return " ".join(t for t in tokens if t not in STOPWORDS)
+
+    @staticmethod
+    def _rule_sources(rule):
+        sources = []
+        for src in ([rule.get("source")] if rule.get("source") else []) + list(rule.get("sources") or []):
+            if isinstance(src, dict) and src.get("url"):
+                sources.append({k: v for k, v in src.items() if k in ("url", "title", "evidence_snippet")})
+            elif isinstance(src, str):
+                sources.append({"url": src})
+        return sources
+
+    def _similarity_matrix(self, texts):
+        # TF-IDF over word tokens, L2 normalised, so cosine is a dot product
+        vocab = {}
+        rows = []
+        for text in texts:
+            counts = {}
+            for token in text.split():
+                idx = vocab.setdefault(token, len(vocab))
+                counts[idx] = counts.get(idx, 0) + 1
+            rows.append(counts)
+        tf = np.zeros((len(texts), max(len(vocab), 1)), dtype=np.float32)
+        for i, counts in enumerate(rows):
+            for idx, count in counts.items():
+                tf[i, idx] = count
+        df = np.count_nonzero(tf, axis=0)
+        idf = np.log((1 + len(texts)) / (1 + df)) + 1.0
+        tfidf = tf * idf
+        norms = np.linalg.norm(tfidf, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        tfidf /= norms
+        return tfidf @ tfidf.T
+
+    def dedupe_rules(self, rules):
+        """
+        Collapse exact and near-duplicate rules before they reach the supervisor.
+
+        Exact duplicates share a normalised rule_id or rule text; near duplicates
+        have TF-IDF cosine similarity >= DEDUP_SIMILARITY_THRESHOLD. Each cluster
+        is represented by its first member, raised to the cluster's highest
+        priority and carrying every member's source URLs.
+        """
+        start = time.perf_counter()
+        if len(rules) < 2:
+            return list(rules), {"input": len(rules), "output": len(rules), "ratio": 1.0,
+                                 "chars_saved": 0, "seconds": 0.0}
+
+        texts = [self._normalize_text(r.get("rule_text")) for r in rules]
+        cluster_of = list(range(len(rules)))
+        seen = {}
+        for i, rule in enumerate(rules):
+            keys = [("text", texts[i])] if texts[i] else []
+            rule_id = self._normalize_text(rule.get("rule_id"))
+            if rule_id:
+                keys.append(("id", rule_id))
+            for key in keys:
+                if key in seen:
+                    cluster_of[i] = cluster_of[seen[key]]
+                    break
+            for key in keys:
+                seen.setdefault(key, i)
+
+        heads = [i for i in range(len(rules)) if cluster_of[i] == i]
+        if len(heads) > 1:
+            sims = self._similarity_matrix([texts[i] for i in heads])
+            for a in range(len(heads)):
+                if cluster_of[heads[a]] != heads[a]:
+                    continue
+                for b in np.nonzero(sims[a, a + 1:] >= DEDUP_SIMILARITY_THRESHOLD)[0]:
+                    j = heads[a + 1 + b]
+                    if cluster_of[j] == j:
+                        cluster_of[j] = heads[a]
+            for i in range(len(rules)):
+                cluster_of[i] = cluster_of[cluster_of[i]]
+
+        clusters = {}
+        for i, head in enumerate(cluster_of):
+            clusters.setdefault(head, []).append(rules[i])
+
+        representatives = []
+        for head in sorted(clusters):
+            members = clusters[head]
+            rep = dict(members[0])
+            if len(members) > 1:
+                best = max(members, key=lambda r: PRIORITY_RANK.get(str(r.get("priority", "")).upper(), -1))
+                if best.get("priority"):
+                    rep["priority"] = best["priority"]
+                sources, urls = [], set()
+                for member in members:
+                    for src in self._rule_sources(member):
+                        if src["url"] not in urls:
+                            urls.add(src["url"])
+                            sources.append(src)
+                rep.pop("source", None)
+                rep["sources"] = sources
+            representatives.append(rep)
+
+        before = len(orjson.dumps(rules))
+        after = len(orjson.dumps(representatives))
+        stats = {
+            "input": len(rules),
+            "output": len(representatives),
+            "ratio": round(len(rules) / max(len(representatives), 1), 2),
+            "chars_saved": before - after,
+            "seconds": round(time.perf_counter() - start, 4),
+        }
+        return representatives, stats
+
+    def _compile_chunk(self, rules):
+        check_cancelled()
+        try:
+            output = self.get_supervision(orjson.dumps({"rules": rules}, option=orjson.OPT_INDENT_2).decode())
+            compiled = self.parse_rules(output, key="final_rules")
+        except Exception as e:
+            print(f"Rule compilation failed for a partition chunk: {e}")
+            compiled = []
+        # Never lose rules because the supervisor returned something unparsable
+        return compiled or rules
+
+    def compile_incremental(self, new_rules, partitions=None):
+        """
+        Map-reduce rule compilation.
+
+        Rules are partitioned by library and each partition is split into
+        chunks of at most MAX_RULES_PER_COMPILE rules. Only chunks whose
+        content changed since the last compile (new or replaced rules) are sent
+        to the supervisor, in parallel. The reduce step then merges each
+        library's chunk outputs: when it has more than one chunk, duplicates
+        across chunks are collapsed and the supervisor resolves conflicts
+        between them in one more pass, cached like the chunks.
+
+        Returns (final_rules, partitions) where partitions is the updated
+        state to persist for the next run.
+        """
+        partitions = {k: dict(v) for k, v in (partitions or {}).items()}
+        touched = set()
+        incoming = self.parse_rules(new_rules)
+        for rule in incoming:
+            key = self.partition_key(rule)
+            partition = partitions.setdefault(key, {"rules": [], "chunks": {}})
+            existing = partition["rules"] = list(partition.get("rules", []))
+            rule_id = rule.get("rule_id")
+            for i, old in enumerate(existing):
+                if rule_id and old.get("rule_id") == rule_id:
+                    existing[i] = rule
+                    break
+            else:
+                existing.append(rule)
+            touched.add(key)
+
+        totals = {"input": 0, "output": 0, "chars_saved": 0, "seconds": 0.0, "supervisor_calls_saved": 0}
+        for key in touched:
+            deduped, stats = self.dedupe_rules(partitions[key]["rules"])
+            partitions[key]["rules"] = deduped
+            for name in ("input", "output", "chars_saved", "seconds"):
+                totals[name] += stats[name]
+            # Supervisor chunks the duplicates would have filled
+            totals["supervisor_calls_saved"] += (
+                math.ceil(stats["input"] / MAX_RULES_PER_COMPILE) - math.ceil(stats["output"] / MAX_RULES_PER_COMPILE)
+            )
+        totals["ratio"] = round(totals["input"] / max(totals["output"], 1), 2)
+        # Supervisor prompt the duplicates would have taken, at ~4 chars per token
+        totals["prompt_tokens_saved"] = max(totals["chars_saved"], 0) // 4
+        self.dedup_stats = totals
+        telemetry.count("rule_dedup_rules", totals["output"], outcome="kept")
+        telemetry.count("rule_dedup_rules", totals["input"] - totals["output"], outcome="merged")
+        telemetry.count("rule_dedup_saved", totals["supervisor_calls_saved"], unit="supervisor_calls")
+        telemetry.count("rule_dedup_saved", totals["prompt_tokens_saved"], unit="prompt_tokens")
+        print(f"DEBUG: Rule dedup: {totals}")
+
+        jobs = []
+        layout = {}
+        for key, partition in partitions.items():
+            rules = partition.get("rules", [])
+            cached = partition.get("chunks", {})
+            chunk_keys = []
+            for start in range(0, len(rules), MAX_RULES_PER_COMPILE):
+                chunk = rules[start:start + MAX_RULES_PER_COMPILE]
+                digest = self._digest(chunk)
+                chunk_keys.append(digest)
+                if digest not in cached:
+                    jobs.append((key, digest, chunk))
+            layout[key] = chunk_keys
+
+        print(f"DEBUG: Rule compiler: {len(partitions)} partitions, {len(touched)} touched, {len(jobs)} chunks to compile")
+        compiled = {}
+        if jobs:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                outputs = pool.map(propagate_context(lambda job: self._compile_chunk(job[2])), jobs)
+                for (key, digest, _), output in zip(jobs, outputs):
+                    compiled[(key, digest)] = output
+
+        merged = {}
+        reduces = []
+        for key in sorted(layout):
+            cached = partitions[key].get("chunks", {})
+            chunks = {}
+            merged[key] = []
+            for digest in layout[key]:
+                output = compiled.get((key, digest), cached.get(digest, []))
+                chunks[digest] = output
+                merged[key].extend(output)
+            if len(layout[key]) > 1:
+                reduce_key = REDUCE_PREFIX + self._digest(layout[key])
+                if reduce_key in cached:
+                    chunks[reduce_key] = merged[key] = cached[reduce_key]
+                else:
+                    reduces.append((key, reduce_key))
+            partitions[key]["chunks"] = chunks
+
+        print(f"DEBUG: Rule compiler: {len(reduces)} libraries to reduce across chunks")
+        if reduces:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                outputs = pool.map(propagate_context(lambda job: self._reduce_library(merged[job[0]])), reduces)
+                for (key, reduce_key), output in zip(reduces, outputs):
+                    partitions[key]["chunks"][reduce_key] = merged[key] = output
+
+        final_rules = [
+            {**rule, "library": rule.get("library") or key} for key in sorted(merged) for rule in merged[key]
+        ]
+        return {"final_rules": final_rules}, partitions
+
+    def _reduce_library(self, rules):
+        """One library's chunk outputs as one rule set: duplicates across chunks dropped, conflicts resolved by the supervisor."""
+        deduped, _ = self.dedupe_rules(rules)
+        return self._compile_chunk(deduped)
 
     def rule_compiler(self, rules_json):
-        final_rules = self.get_supervision(rules_json)
+        final_rules, _ = self.compile_incremental(rules_json)
         return final_rules
\ No newline at end of file
@@ -0,0 +1,195 @@
+import os
+import shutil
+import stat
+import tarfile
+import zipfile
+
+MAX_ARCHIVE_BYTES = int(os.getenv("PATCHPILOT_ARCHIVE_MAX_BYTES", str(512 * 1024 * 1024)))
+MAX_ARCHIVE_MEMBERS = int(os.getenv("PATCHPILOT_ARCHIVE_MAX_MEMBERS", "50000"))
+# Archives nested inside the uploaded one that are still unpacked
+MAX_ARCHIVE_DEPTH = int(os.getenv("PATCHPILOT_ARCHIVE_MAX_DEPTH", "2"))
+# Uncompressed/compressed size above which a zip member is treated as a bomb
+MAX_COMPRESSION_RATIO = int(os.getenv("PATCHPILOT_ARCHIVE_MAX_RATIO", "200"))
+# Small members legitimately compress very well, so the ratio only applies above this size
+RATIO_MIN_BYTES = 1024 * 1024
+COPY_CHUNK = 1024 * 1024
+
+ARCHIVE_SUFFIXES = {".zip": "zip", ".tar.gz": "tar", ".tgz": "tar"}
+
+
+class ArchiveLimitExceeded(Exception):
+    pass
+
+
+def archive_kind(name):
+    """'zip', 'tar' or None, from the file name."""
+    lowered = name.lower()
+    for suffix, kind in ARCHIVE_SUFFIXES.items():
+        if lowered.endswith(suffix):
+            return kind
+    return None
+
+
+def archive_root(path):
+    """Directory an archive unpacks into: its path without the archive suffix."""
+    lowered = path.lower()
+    for suffix in ARCHIVE_SUFFIXES:
+        if lowered.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+
+class SafeExtractor:
+    """
+    Streams members of zip and tar.gz archives to disk one at a time.
+
+    Only members accepted by `keep` (given the member's path inside the
+    archive, nested archives included) are written; everything else is skipped without touching the
+    disk. Links, devices and paths escaping `dest` are never written. Totals
+    are capped across the archive and everything nested in it: bytes
+    written, members seen and nesting depth, plus a compression ratio per zip
+    member. Exceeding a cap raises ArchiveLimitExceeded and leaves no partial
+    file behind. Nested archives are unpacked next to where they sit and then
+    deleted; one that cannot be read is skipped. When a member name repeats,
+    only the first copy is written.
+    """
+    def __init__(self, dest, keep=None, max_bytes=MAX_ARCHIVE_BYTES, max_members=MAX_ARCHIVE_MEMBERS,
+                 max_depth=MAX_ARCHIVE_DEPTH, max_ratio=MAX_COMPRESSION_RATIO):
+        self.dest = os.path.abspath(dest)
+        self.keep = keep
+        self.max_bytes = max_bytes
+        self.max_members = max_members
+        self.max_depth = max_depth
+        self.max_ratio = max_ratio
+        self.bytes_written = 0
+        self.members = 0
+        self.skipped = 0
+        # Targets already written; a repeated member name keeps its first copy
+        self._written = set()
+
+    def extract(self, source, name, depth=0, subdir=""):
+        """
+        Yields the path of every file written, as soon as it is complete.
+        source is a path or a binary file object; tar.gz is read as a stream
+        and zip needs it to be seekable.
+        """
+        kind = archive_kind(name)
+        if kind == "zip":
+            yield from self._zip(source, depth, subdir)
+        elif kind == "tar":
+            yield from self._tar(source, depth, subdir)
+        else:
+            raise ValueError(f"Unsupported archive type: {os.path.basename(name)}")
+
+    def _zip(self, source, depth, subdir):
+        with zipfile.ZipFile(source) as zf:
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+                if stat.S_ISLNK(info.external_attr >> 16):
+                    self._count()
+                    self.skipped += 1
+                    continue
+                if (info.file_size > RATIO_MIN_BYTES
+                        and info.file_size > self.max_ratio * max(info.compress_size, 1)):
+                    raise ArchiveLimitExceeded(
+                        f"{info.filename} expands {info.file_size // max(info.compress_size, 1)}x, "
+                        f"limit is {self.max_ratio}x"
+                    )
+                yield from self._member(info.filename, lambda info=info: zf.open(info), info.file_size, depth, subdir)
+
+    def _tar(self, source, depth, subdir):
+        if isinstance(source, (str, os.PathLike)):
+            tf = tarfile.open(source, mode="r|*")
+        else:
+            tf = tarfile.open(fileobj=source, mode="r|*")
+        with tf:
+            for member in tf:
+                if member.isdir():
+                    continue
+                if not member.isfile():
+                    self._count()
+                    self.skipped += 1
+                    continue
+                yield from self._member(member.name, lambda member=member: tf.extractfile(member), member.size, depth, subdir)
+
+    def _count(self):
+        self.members += 1
+        if self.members > self.max_members:
+            raise ArchiveLimitExceeded(f"Archive has more than {self.max_members} members")
+
+    def _target(self, subdir, name):
+        parts = [part for part in name.replace("\\", "/").split("/") if part not in ("", ".")]
+        if not parts or ".." in parts or ":" in parts[0]:
+            return None
+        target = os.path.join(self.dest, subdir, *parts)
+        # Resolved, so a symlinked directory already under dest cannot redirect the write
+        real_dest = os.path.realpath(self.dest)
+        if os.path.commonpath([real_dest, os.path.realpath(target)]) != real_dest:
+            return None
+        return target
+
+    def _member(self, name, opener, size, depth, subdir):
+        self._count()
+        nested = archive_kind(name)
+        if nested and depth + 1 > self.max_depth:
+            self.skipped += 1
+            return
+        if self.keep is not None and not self.keep(name):
+            self.skipped += 1
+            return
+        target = self._target(subdir, name)
+        if target is None or target in self._written:
+            self.skipped += 1
+            return
+        if self.bytes_written + size > self.max_bytes:
+            raise ArchiveLimitExceeded(f"Archive expands beyond {self.max_bytes} bytes")
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with opener() as stream:
+            self._write(stream, target)
+        self._written.add(target)
+        if not nested:
+            yield target
+            return
+        try:
+            nested_dir = os.path.relpath(archive_root(target), self.dest)
+            with open(target, "rb") as f:
+                yield from self.extract(f, target, depth + 1, nested_dir)
+        except (zipfile.BadZipFile, tarfile.TarError) as e:
+            # A corrupt nested archive loses only itself, not the upload around it
+            print(f"Skipping unreadable nested archive {name}: {e}")
+            self.skipped += 1
+        finally:
+            os.unlink(target)
+
+    def _write(self, stream, target):
+        """Copies in chunks, counting against the byte cap as it goes (declared sizes can lie)."""
+        try:
+            with open(target, "wb") as out:
+                while True:
+                    chunk = stream.read(COPY_CHUNK)
+                    if not chunk:
+                        break
+                    self.bytes_written += len(chunk)
+                    if self.bytes_written > self.max_bytes:
+                        raise ArchiveLimitExceeded(f"Archive expands beyond {self.max_bytes} bytes")
+                    out.write(chunk)
+        except BaseException:
+            if os.path.exists(target):
+                os.unlink(target)
+            raise
+
+
+def extract_archive(archive_path, extract_path, keep=None):
+    """Unpacks archive_path into extract_path; returns extract_path, or None on failure."""
+    created = not os.path.exists(extract_path)
+    try:
+        os.makedirs(extract_path, exist_ok=True)
+        for _ in SafeExtractor(extract_path, keep).extract(archive_path, archive_path):
+            pass
+        return extract_path
+    except Exception as e:
+        print(f"Error processing archive {os.path.basename(archive_path)}: {e}")
+        if created:
+            shutil.rmtree(extract_path, ignore_errors=True)
+        return None
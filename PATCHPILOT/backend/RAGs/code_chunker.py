@@ -0,0 +1,186 @@
+import ast
+import keyword
+import os
+import re
+from dataclasses import dataclass
+
+# Chunks longer than this are split again one level down (class bodies, nested blocks)
+MAX_CHUNK_LINES = int(os.getenv("PATCHPILOT_CHUNK_MAX_LINES", "120"))
+# Files up to this many lines are patched whole; below it chunking saves little
+CHUNK_MIN_LINES = int(os.getenv("PATCHPILOT_CHUNK_MIN_LINES", "80"))
+# Import lines given to the model as read-only context for each chunk
+MAX_CONTEXT_LINES = 40
+
+PYTHON_DEFINITIONS = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+# Backticked code in a migration step, e.g. `User.parse_obj(data)`
+CODE_SPAN = re.compile(r"`([^`\n]+)`")
+# Words that end the old API in "Replace `old` with `new`" style descriptions
+REPLACEMENT_WORDS = re.compile(r"\s(?:with|by|to|into)\s|→|->|=>")
+IDENTIFIER = re.compile(r"[A-Za-z_]\w*")
+# Called or attribute names in a code span: `user.json()` -> json
+API_NAME = re.compile(r"(?:\.\s*([A-Za-z_]\w*))|(?:([A-Za-z_]\w*)\s*\()")
+# Too common to tell one chunk from another
+COMMON_NAMES = frozenset({
+    "self", "cls", "data", "value", "args", "kwargs", "none", "true", "false", "null",
+    "new", "old", "the", "var", "let", "const", "function", "return", "public", "static",
+})
+IMPORT_LINE = re.compile(r"\s*(?:import\s|from\s+\S+\s+import\s|package\s|using\s|#include\b|.*\brequire\s*\()")
+STRING_OR_COMMENT = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|`[^`]*`|//.*$')
+
+
+@dataclass(frozen=True)
+class Chunk:
+    """Lines [start, end) of a file, 0-based; name is the definition it holds."""
+    start: int
+    end: int
+    name: str
+
+    def text(self, lines):
+        return "".join(lines[self.start:self.end])
+
+
+def _node_start(node):
+    return min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])]) - 1
+
+
+def _python_chunks(body, start, end, lines, prefix=""):
+    """
+    Chunks covering lines[start:end]: one per definition in body, with runs
+    of other statements kept together. Comments right above a statement go
+    with it. Classes too long for one chunk are cut again at their members.
+    """
+    cuts = []
+    previous_simple = False
+    for node in body:
+        simple = not isinstance(node, PYTHON_DEFINITIONS)
+        if simple and previous_simple:
+            continue
+        cut = _node_start(node)
+        while cut > start and lines[cut - 1].lstrip().startswith("#"):
+            cut -= 1
+        cuts.append((max(cut, start), node, simple))
+        previous_simple = simple
+    if not cuts:
+        return [Chunk(start, end, prefix.rstrip(".") or "module")]
+    cuts[0] = (start,) + cuts[0][1:]
+    chunks = []
+    for i, (cut, node, simple) in enumerate(cuts):
+        stop = cuts[i + 1][0] if i + 1 < len(cuts) else end
+        if stop <= cut:
+            continue
+        name = prefix + ("statements" if simple else node.name)
+        if isinstance(node, ast.ClassDef) and stop - cut > MAX_CHUNK_LINES:
+            chunks.extend(_python_chunks(node.body, cut, stop, lines, f"{prefix}{node.name}."))
+        else:
+            chunks.append(Chunk(cut, stop, name))
+    return chunks
+
+
+def _brace_depths(lines):
+    """Brace depth at the start of each line, ignoring strings and // comments."""
+    depths = []
+    depth = 0
+    for line in lines:
+        depths.append(depth)
+        code = STRING_OR_COMMENT.sub("", line)
+        depth = max(0, depth + code.count("{") - code.count("}"))
+    return depths
+
+
+def _brace_chunks(lines, start, end, depths, base=0):
+    """
+    Chunks of lines[start:end] cut where a block at depth base closes or a
+    blank line separates two declarations at that depth. Too long chunks
+    are cut again one level deeper (e.g. the methods of a Java class).
+    """
+    cuts = [start]
+    for i in range(start + 1, end):
+        if depths[i] != base or not lines[i].strip():
+            continue
+        before = lines[i - 1]
+        if not before.strip() or (depths[i - 1] > base and "}" in before):
+            cuts.append(i)
+    chunks = []
+    for i, cut in enumerate(cuts):
+        stop = cuts[i + 1] if i + 1 < len(cuts) else end
+        inner = [d for d in depths[cut:stop] if d > base]
+        if stop - cut > MAX_CHUNK_LINES and inner:
+            nested = _brace_chunks(lines, cut, stop, depths, base + 1)
+            if len(nested) > 1:
+                chunks.extend(nested)
+                continue
+        first = next((line.strip() for line in lines[cut:stop] if line.strip()), "")
+        chunks.append(Chunk(cut, stop, first[:60]))
+    return chunks
+
+
+def split_code(code, language=None):
+    """
+    Chunks covering every line of code, in order. Python is cut at
+    statement boundaries found by ast, other languages at brace-delimited
+    blocks. None when Python code does not parse, so callers patch it whole.
+    """
+    lines = code.splitlines(keepends=True)
+    if not lines:
+        return []
+    if language == "python":
+        try:
+            tree = ast.parse(code)
+        except (SyntaxError, ValueError):
+            return None
+        return _python_chunks(tree.body, 0, len(lines), lines)
+    return _brace_chunks(lines, 0, len(lines), _brace_depths(lines))
+
+
+def referenced_names(migration_steps):
+    """
+    API names the migration steps change, taken from their backticked code.
+    In "Replace `old` with `new`" only the old side counts, since code
+    already using the new API needs no patch. Called and attribute names
+    are preferred (`user.json()` -> json); a span without any contributes
+    its identifiers.
+    """
+    names = set()
+    for line in str(migration_steps).splitlines():
+        spans = list(CODE_SPAN.finditer(line))
+        if not spans:
+            continue
+        replacement = REPLACEMENT_WORDS.search(line, spans[0].end())
+        if replacement:
+            spans = [span for span in spans if span.start() < replacement.start()]
+        for span in spans:
+            snippet = span.group(1)
+            found = {a or b for a, b in API_NAME.findall(snippet)}
+            if not found:
+                found = set(IDENTIFIER.findall(snippet))
+            names.update(
+                name for name in found
+                if len(name) > 2 and not keyword.iskeyword(name) and name.lower() not in COMMON_NAMES
+            )
+    return names
+
+
+def select_chunks(chunks, lines, names):
+    """The chunks that mention any of names as a whole word."""
+    if not names:
+        return []
+    pattern = re.compile(r"\b(?:" + "|".join(re.escape(name) for name in sorted(names)) + r")\b")
+    return [chunk for chunk in chunks if pattern.search(chunk.text(lines))]
+
+
+def import_context(lines):
+    """The file's import lines, as read-only context for patching one chunk."""
+    found = [line for line in lines if IMPORT_LINE.match(line)]
+    return "".join(found[:MAX_CONTEXT_LINES])
+
+
+def splice(lines, replacements):
+    """The file with each chunk in replacements ({Chunk: text}) swapped for its text."""
+    out = []
+    position = 0
+    for chunk in sorted(replacements, key=lambda c: c.start):
+        out.extend(lines[position:chunk.start])
+        out.append(replacements[chunk])
+        position = chunk.end
+    out.extend(lines[position:])
+    return "".join(out)
@@ -0,0 +1,543 @@
+import ast
+import itertools
+import re
+from dataclasses import dataclass, field, replace
+
+from RAGs.python_imports import canonical_name, distribution_for
+
+# Backticked code in a rule, e.g. `User.parse_obj(data)`
+CODE_SPAN = re.compile(r"`([^`\n]+)`")
+# Rules that only apply in some cases need judgement, so they stay with the LLM
+CONDITIONAL = re.compile(
+    r"\b(?:if|when|whenever|unless|only|except|depending|where|may|might|should\s+consider|consider|manually|review)\b",
+    re.IGNORECASE,
+)
+
+# Rule texts are matched with their code spans masked as @<index>@
+_SPAN = r"@(\d+)@"
+_KIND = r"(?:\s+(?:method|methods|function|functions|call|calls|attribute|attributes|property|import|imports|decorator|class|module|name|alias))?"
+_OLD_PREFIX = r"(?:(?:all|the|any|every|calls?\s+to|uses?\s+of|usages?\s+of|occurrences?\s+of|references?\s+to|imports?\s+of|deprecated|legacy|old)\s+)*"
+_NEW_PREFIX = r"(?:(?:the|new|equivalent)\s+)*"
+_PAIR = rf"{_SPAN}{_KIND}\s+(?:with|to|by|into)\s+{_NEW_PREFIX}{_SPAN}{_KIND}"
+RULE_PATTERNS = (
+    # Replace `old` with `new`
+    (re.compile(rf"\b(?:replace|rename|change|convert|migrate|update|switch)\s+{_OLD_PREFIX}{_PAIR}", re.IGNORECASE), False),
+    # `old` has been renamed to `new`
+    (re.compile(
+        rf"{_OLD_PREFIX}{_SPAN}{_KIND}\s+(?:is|was|has\s+been|have\s+been|are|were)\s+(?:now\s+)?"
+        rf"(?:renamed|replaced|moved)\s+(?:to|by|with|into)\s+{_NEW_PREFIX}{_SPAN}{_KIND}", re.IGNORECASE), False),
+    # Use `new` instead of `old`
+    (re.compile(rf"\buse\s+{_NEW_PREFIX}{_SPAN}{_KIND}\s+instead\s+of\s+{_OLD_PREFIX}{_SPAN}{_KIND}", re.IGNORECASE), True),
+    # `old` -> `new`
+    (re.compile(rf"{_SPAN}\s*(?:→|->|=>)\s*{_SPAN}"), False),
+)
+# ", and `old2` with `new2`" after a replace clause
+RULE_CONTINUATION = re.compile(rf"\s*(?:,\s*(?:and\s+)?|;\s*|\s+and\s+)(?:(?:replace|rename)\s+)?{_OLD_PREFIX}{_PAIR}", re.IGNORECASE)
+
+# Strings and comments of C-like languages, left alone by the text codemods
+C_LITERALS = re.compile(
+    r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|`(?:\\.|[^`\\])*`|//[^\n]*|/\*.*?\*/', re.DOTALL
+)
+
+
+@dataclass(frozen=True)
+class Codemod:
+    """
+    One deterministic rewrite. kind is "attribute" (rename .old to .new),
+    "call" (rewrite .old(args) into .new(template) when called with arity
+    positional arguments), "name" (rename a name imported from module, or
+    from any module of library) or "module" (import names from new instead
+    of old). Attribute and call codemods only match on receiver, the object
+    the rule accesses .old on, and only where that object is tied to
+    library: the class the rule names (User.parse_obj) or a name imported
+    from the library (np.float).
+    """
+    kind: str
+    old: str
+    new: str
+    module: str = None
+    receiver: str = None
+    library: str = None
+    names: tuple = ()
+    arity: int = 0
+    args: tuple = ()        # ("arg", i) for the i-th original argument, or ("src", code)
+    keywords: tuple = ()    # (keyword, ("arg", i) or ("src", code))
+
+
+@dataclass
+class CodemodResult:
+    original: str
+    patched: str
+    # Rules with nothing left for the LLM in this file
+    applied: list = field(default_factory=list)
+
+
+def rule_key(rule):
+    return str(rule.get("rule_id") or rule.get("rule_text") or "")
+
+
+def mechanical_pairs(text):
+    """
+    (old, new) code pairs of a rule that is nothing but renames, e.g.
+    "Replace `User.parse_obj(data)` with `User.model_validate(data)`". None
+    when the rule says anything else: conditions, or code that is not part
+    of a replacement.
+    """
+    spans = CODE_SPAN.findall(text or "")
+    if not spans or CONDITIONAL.search(CODE_SPAN.sub("", text)):
+        return None
+    counter = itertools.count()
+    masked = CODE_SPAN.sub(lambda m: f"@{next(counter)}@", text)
+    pairs = {}
+    for pattern, reversed_ in RULE_PATTERNS:
+        for match in pattern.finditer(masked):
+            groups = [int(g) for g in match.groups()]
+            position = match.end()
+            while True:
+                old, new = (groups[1], groups[0]) if reversed_ else (groups[0], groups[1])
+                pairs.setdefault(old, new)
+                more = RULE_CONTINUATION.match(masked, position)
+                if not more or reversed_:
+                    break
+                groups = [int(g) for g in more.groups()]
+                position = more.end()
+    used = set(pairs) | set(pairs.values())
+    if len(used) != len(spans) or len(used) != 2 * len(pairs):
+        return None
+    return [(spans[old], spans[new]) for old, new in sorted(pairs.items())]
+
+
+def _parse_snippet(snippet):
+    source = snippet.strip().rstrip(";")
+    # Decorators are named with their @, `.json()` without its receiver
+    source = source[1:] if source.startswith("@") else source
+    if source.startswith("."):
+        source = "_" + source
+    try:
+        return ast.parse(source, mode="eval").body
+    except SyntaxError:
+        pass
+    try:
+        body = ast.parse(source).body
+    except SyntaxError:
+        return None
+    return body[0] if len(body) == 1 else None
+
+
+def _dotted(node):
+    """Dotted form (a.b.c) of a chain of attribute accesses on a name, else None."""
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    return ".".join([node.id] + parts[::-1])
+
+
+def _receiver(node):
+    """
+    Dotted receiver of a method in a rule, or None when there is none to
+    tie the rename to, as in `.json()`: the method name alone also matches
+    other libraries' objects (a requests response's .json()).
+    """
+    chain = _dotted(node)
+    return chain if chain and chain != "_" else None
+
+
+def _same(a, b):
+    return ast.dump(a) == ast.dump(b)
+
+
+def _case(name):
+    if name.isupper():
+        return "constant"
+    return "class" if name[:1].isupper() else "lower"
+
+
+def _template(node, placeholders):
+    """("arg", i) when node is the i-th placeholder, ("src", code) when it uses none, else None."""
+    if isinstance(node, ast.Name) and node.id in placeholders:
+        return "arg", placeholders[node.id]
+    if any(isinstance(n, ast.Name) and n.id in placeholders for n in ast.walk(node)):
+        return None
+    return "src", ast.unparse(node)
+
+
+def _call_codemod(old, new):
+    if not (isinstance(old.func, ast.Attribute) and isinstance(new.func, ast.Attribute)):
+        if isinstance(old.func, ast.Name) and isinstance(new.func, ast.Name) and _same_arguments(old, new):
+            return _name_codemod(old.func.id, new.func.id)
+        return None
+    receiver = _receiver(old.func.value)
+    if receiver is None or not _same(old.func.value, new.func.value):
+        return None
+    if _same_arguments(old, new):
+        return Codemod("attribute", old.func.attr, new.func.attr, receiver=receiver) if old.func.attr != new.func.attr else None
+    if old.keywords or not all(isinstance(arg, ast.Name) for arg in old.args):
+        return None
+    placeholders = {arg.id: i for i, arg in enumerate(old.args)}
+    if len(placeholders) != len(old.args) or any(isinstance(arg, ast.Starred) for arg in new.args):
+        return None
+    args = tuple(_template(arg, placeholders) for arg in new.args)
+    keywords = tuple((kw.arg, _template(kw.value, placeholders)) for kw in new.keywords)
+    if None in args or any(kw is None or value is None for kw, value in keywords):
+        return None
+    return Codemod("call", old.func.attr, new.func.attr, receiver=receiver,
+                   arity=len(old.args), args=args, keywords=keywords)
+
+
+def _same_arguments(old, new):
+    return (len(old.args) == len(new.args) and len(old.keywords) == len(new.keywords)
+            and all(_same(a, b) for a, b in zip(old.args, new.args))
+            and all(_same(a, b) for a, b in zip(old.keywords, new.keywords)))
+
+
+def _name_codemod(old, new, module=None):
+    if old == new or _case(old) != _case(new):
+        return None
+    return Codemod("name", old, new, module=module)
+
+
+def compile_pair(old_source, new_source):
+    """The codemod doing what "replace old with new" says, or None when it is not a plain rename."""
+    old, new = _parse_snippet(old_source), _parse_snippet(new_source)
+    if old is None or new is None or type(old) is not type(new):
+        return None
+    if isinstance(old, ast.ImportFrom):
+        if old.level or new.level or not old.module or not new.module:
+            return None
+        old_names = [(a.name, a.asname) for a in old.names]
+        new_names = [(a.name, a.asname) for a in new.names]
+        if old.module != new.module and old_names == new_names and not any(asname for _, asname in old_names):
+            names = () if old_names == [("*", None)] else tuple(name for name, _ in old_names)
+            return Codemod("module", old.module, new.module, names=names)
+        if old.module == new.module and len(old_names) == len(new_names) == 1:
+            return _name_codemod(old_names[0][0], new_names[0][0], module=old.module)
+        return None
+    if isinstance(old, ast.Call):
+        return _call_codemod(old, new)
+    if isinstance(old, ast.Attribute):
+        if _same(old.value, new.value):
+            receiver = _receiver(old.value)
+            if receiver is None or old.attr == new.attr:
+                return None
+            return Codemod("attribute", old.attr, new.attr, receiver=receiver)
+        old_module, new_module = _dotted(old.value), _dotted(new.value)
+        if old.attr == new.attr and old_module and new_module:
+            return Codemod("module", old_module, new_module, names=(old.attr,))
+        return None
+    if isinstance(old, ast.Name):
+        return _name_codemod(old.id, new.id)
+    return None
+
+
+def compile_rules(rules, library=None):
+    """[(rule key, [Codemod])] for library's rules that are pure renames; the rest are left out."""
+    compiled = []
+    for rule in rules:
+        pairs = mechanical_pairs(rule.get("rule_text", ""))
+        if not pairs:
+            continue
+        codemods = [compile_pair(old, new) for old, new in pairs]
+        if codemods and None not in codemods:
+            compiled.append((rule_key(rule), [replace(codemod, library=library) for codemod in codemods]))
+    return compiled
+
+
+class _PythonSource:
+    """Character offsets for ast positions, which count UTF-8 bytes within a line."""
+    def __init__(self, source):
+        self.source = source
+        self.lines = source.splitlines(keepends=True)
+        self.starts = [0]
+        for line in self.lines:
+            self.starts.append(self.starts[-1] + len(line))
+
+    def offset(self, lineno, col):
+        line = self.lines[lineno - 1]
+        return self.starts[lineno - 1] + len(line.encode("utf-8")[:col].decode("utf-8", errors="replace"))
+
+    def span(self, node):
+        return self.offset(node.lineno, node.col_offset), self.offset(node.end_lineno, node.end_col_offset)
+
+    def text(self, node):
+        start, end = self.span(node)
+        return self.source[start:end]
+
+
+def _index(codemods):
+    """Codemods by kind and old name; attribute and call codemods as lists, one per receiver."""
+    by_kind = {"attribute": {}, "call": {}, "name": {}, "module": {}}
+    for codemod in codemods:
+        if codemod.kind in ("attribute", "call"):
+            by_kind[codemod.kind].setdefault(codemod.old, []).append(codemod)
+        else:
+            by_kind[codemod.kind][codemod.old] = codemod
+    return by_kind
+
+
+def _from_library(module, library):
+    if library is None:
+        return True
+    library = canonical_name(library)
+    return library in (distribution_for(module), canonical_name(module.split(".")[0]))
+
+
+def _name_from(codemod, module):
+    """Whether a name codemod covers a name imported from module: its own module, else any module of its library."""
+    if codemod.module:
+        return module == codemod.module
+    return bool(module) and _from_library(module, codemod.library)
+
+
+def _tied(receiver, codemod, bound):
+    """Whether receiver (dotted, as written in the file) is the object the codemod's rule means."""
+    if receiver != codemod.receiver:
+        return False
+    root = receiver.split(".")[0]
+    if root[:1].isupper():
+        return True
+    return root in bound and _from_library(bound[root], codemod.library)
+
+
+def _bindings(tree):
+    """Module each top-level name the file imports comes from (`import a.b` binds a)."""
+    bound = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                bound[alias.asname or alias.name.split(".")[0]] = alias.name if alias.asname else alias.name.split(".")[0]
+        elif isinstance(node, ast.ImportFrom) and not node.level and node.module:
+            for alias in node.names:
+                bound[alias.asname or alias.name] = node.module
+    return bound
+
+
+def _alias(alias):
+    return f"{alias.name} as {alias.asname}" if alias.asname else alias.name
+
+
+def _rebuild_import(node, index, indent):
+    """Source of an ImportFrom with names renamed and moved modules split out, or None if unchanged."""
+    groups = {}
+    for alias in node.names:
+        module = node.module
+        move = index["module"].get(node.module)
+        if move and (not move.names or alias.name in move.names):
+            module = move.new
+        rename = index["name"].get(alias.name)
+        name = alias.name
+        if rename and _name_from(rename, node.module):
+            name = rename.new
+        groups.setdefault(module, []).append(ast.alias(name=name, asname=alias.asname))
+    if list(groups) == [node.module] and [a.name for a in groups[node.module]] == [a.name for a in node.names]:
+        return None
+    return f"\n{indent}".join(f"from {module} import {', '.join(_alias(a) for a in aliases)}" for module, aliases in groups.items())
+
+
+def _python_edits(source, tree, index):
+    """(start, end, text) replacements for every codemod match in the tree."""
+    imported = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and not node.level:
+            for alias in node.names:
+                if not alias.asname:
+                    imported[alias.name] = node.module
+    bound = _bindings(tree)
+
+    def match(node, candidates):
+        receiver = _dotted(node.value)
+        return next((c for c in candidates if receiver and _tied(receiver, c, bound)), None)
+
+    edits = []
+    calls = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and not node.level and node.module:
+            line = source.lines[node.lineno - 1]
+            text = _rebuild_import(node, index, line[:len(line) - len(line.lstrip())])
+            if text is not None:
+                edits.append((*source.span(node), text))
+        elif isinstance(node, ast.Name):
+            rename = index["name"].get(node.id)
+            if rename and node.id in imported and _name_from(rename, imported[node.id]):
+                edits.append((*source.span(node), rename.new))
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+            codemod = match(node.func, index["call"].get(node.func.attr, ()))
+            if (codemod and len(node.args) == codemod.arity and not node.keywords
+                    and not any(isinstance(arg, ast.Starred) for arg in node.args)):
+                calls.append((node, codemod))
+        if isinstance(node, ast.Attribute) and node.attr in index["attribute"]:
+            codemod = match(node, index["attribute"][node.attr])
+            _, end = source.span(node)
+            if codemod and source.source[end - len(node.attr):end] == node.attr:
+                edits.append((end - len(node.attr), end, codemod.new))
+    # Innermost calls first, so an outer call's arguments already carry every edit made inside them
+    calls.sort(key=lambda call: len(source.text(call[0])))
+    for node, codemod in calls:
+        arguments = []
+        for arg in node.args:
+            start, end = source.span(arg)
+            inner = [(s - start, e - start, text) for s, e, text in edits if start <= s and e <= end]
+            arguments.append(_splice(source.source[start:end], inner))
+
+        def render(part):
+            return arguments[part[1]] if part[0] == "arg" else part[1]
+        rendered = [render(part) for part in codemod.args] + [f"{kw}={render(part)}" for kw, part in codemod.keywords]
+        _, attr_end = source.span(node.func)
+        _, end = source.span(node)
+        edits.append((attr_end - len(node.func.attr), end, f"{codemod.new}({', '.join(rendered)})"))
+    return edits
+
+
+def _splice(text, edits):
+    """text with non-overlapping edits applied; edits overlapping an earlier one are dropped."""
+    out = []
+    position = 0
+    for start, end, replacement in sorted(edits, key=lambda e: (e[0], -e[1])):
+        if start < position:
+            continue
+        out.append(text[position:start])
+        out.append(replacement)
+        position = end
+    out.append(text[position:])
+    return "".join(out)
+
+
+def _python_residual(tree, codemods):
+    """The codemods whose old API the tree still uses."""
+    attributes, imports, dotted, bare = set(), set(), set(), set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            bare.add(node.id)
+        elif isinstance(node, ast.Attribute):
+            attributes.add(node.attr)
+            chain = _dotted(node)
+            if chain:
+                dotted.add(chain)
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            imports.update((node.module, alias.name) for alias in node.names)
+    residual = set()
+    for codemod in codemods:
+        if codemod.kind in ("attribute", "call"):
+            left = codemod.old in attributes
+        elif codemod.kind == "name":
+            left = any(name == codemod.old and _name_from(codemod, module) for module, name in imports)
+            # Without an import to tie it to the library, any other use may be what the rule meant
+            left = left or (codemod.module is None and (codemod.old in attributes or codemod.old in bare))
+        else:
+            left = any(module == codemod.old and (not codemod.names or name in codemod.names or name == "*")
+                       for module, name in imports)
+            left = left or any(f"{codemod.old}.{name}" in dotted for name in codemod.names)
+        if left:
+            residual.add(codemod)
+    return residual
+
+
+def apply_python(code, codemods):
+    """(patched code, codemods still left to do); nothing is changed when the code does not parse."""
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return code, set(codemods)
+    source = _PythonSource(code)
+    patched = _splice(code, _python_edits(source, tree, _index(codemods)))
+    try:
+        return patched, _python_residual(ast.parse(patched), codemods)
+    except (SyntaxError, ValueError):
+        return code, set(codemods)
+
+
+def _code_parts(code):
+    """Alternating (is_code, text) parts, strings and comments being the non-code ones."""
+    parts = []
+    position = 0
+    for match in C_LITERALS.finditer(code):
+        parts.append((True, code[position:match.start()]))
+        parts.append((False, match.group(0)))
+        position = match.end()
+    parts.append((True, code[position:]))
+    return parts
+
+
+def apply_text(code, codemods):
+    """
+    (patched code, codemods still left to do) for C-like languages: renames
+    of attributes and of imported names outside strings and comments, all
+    codemods of a kind in one regex. An attribute is only renamed on the
+    rule's receiver, and a lowercase receiver only when the file imports
+    it. Call templates and module moves are Python-shaped and left to the
+    LLM.
+    """
+    index = _index(codemods)
+    import_lines = "\n".join(line for line in code.splitlines() if re.match(r"\s*(?:import|from|using|#include)\b|.*\brequire\s*\(", line))
+
+    def imported(name):
+        return re.search(rf"\b{re.escape(name)}\b", import_lines) is not None
+
+    def imported_from(codemod):
+        # Import lines are not parsed here, so the library (or module) only has to appear on the name's line
+        origin = canonical_name(codemod.module or codemod.library or "")
+        return any(
+            re.search(rf"\b{re.escape(codemod.old)}\b", line) and origin in canonical_name(line)
+            for line in import_lines.splitlines()
+        )
+
+    names = {old: c for old, c in index["name"].items() if imported_from(c)}
+    attributes = {
+        (c.receiver, c.old): c for candidates in index["attribute"].values() for c in candidates
+        if c.receiver[:1].isupper() or imported(c.receiver.split(".")[0])
+    }
+    attribute_pattern = re.compile(
+        r"(?<![\w$.])(" + "|".join(sorted({re.escape(r) for r, _ in attributes}, key=len, reverse=True)) + r")(\s*\.\s*)("
+        + "|".join(sorted({re.escape(old) for _, old in attributes}, key=len, reverse=True)) + r")\b"
+    ) if attributes else None
+
+    def rename_attribute(m):
+        codemod = attributes.get((m.group(1), m.group(3)))
+        return f"{m.group(1)}{m.group(2)}{codemod.new}" if codemod else m.group(0)
+    name_pattern = re.compile(r"(?<![\w$.])(" + "|".join(map(re.escape, names)) + r")\b") if names else None
+    out = []
+    for is_code, text in _code_parts(code):
+        if is_code:
+            if attribute_pattern:
+                text = attribute_pattern.sub(rename_attribute, text)
+            if name_pattern:
+                text = name_pattern.sub(lambda m: names[m.group(1)].new, text)
+        out.append(text)
+    patched = "".join(out)
+    code_only = "".join(text for is_code, text in _code_parts(patched) if is_code)
+    residual = set()
+    for codemod in codemods:
+        if codemod.kind in ("attribute", "call"):
+            pattern = rf"\.\s*{re.escape(codemod.old)}\b"
+        elif codemod.kind == "name":
+            pattern = rf"(?<![\w$.]){re.escape(codemod.old)}\b"
+        else:
+            pattern = re.escape(codemod.old)
+        if re.search(pattern, code_only if codemod.kind != "module" else patched):
+            residual.add(codemod)
+    return patched, residual
+
+
+def apply_codemods(files):
+    """
+    Runs the codemods over every file in one pass: each file is read and
+    parsed once, and all its codemods are matched in the same walk.
+    files maps path -> (language, [(rule key, [Codemod])]). Returns
+    {path: CodemodResult} for the files that could be read.
+    """
+    results = {}
+    for path, (language, rules) in files.items():
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                code = f.read()
+        except (OSError, UnicodeDecodeError) as e:
+            print(f"Codemods skipped {path}: {e}")
+            continue
+        codemods = list(dict.fromkeys(codemod for _, rule_codemods in rules for codemod in rule_codemods))
+        apply = apply_python if language == "python" else apply_text
+        patched, residual = apply(code, codemods)
+        applied = [key for key, rule_codemods in rules if not residual.intersection(rule_codemods)]
+        results[path] = CodemodResult(code, patched, list(dict.fromkeys(applied)))
+    return results
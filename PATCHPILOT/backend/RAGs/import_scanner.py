@@ -0,0 +1,76 @@
+import mmap
+import re
+from contextlib import contextmanager
+
+# Bump when scanning rules change so cached manifest entries are rescanned
+SCANNER_VERSION = 3
+# Smaller files are read in one go; larger ones are mapped so only touched pages are loaded
+MMAP_THRESHOLD = 64 * 1024
+
+# Import keywords are case-sensitive in every supported language
+_FLAGS = re.MULTILINE
+
+IMPORT_PATTERNS = {
+    "python": re.compile(rb'^[ \t]*(?:import|from)[ \t]+([a-zA-Z_][\w.]*)', _FLAGS),
+    "node": re.compile(rb'(?:from\s+|require\s*\(\s*)[\'"]([^\'"\n]+)[\'"]'),
+    "java": re.compile(rb'^[ \t]*import[ \t]+([a-zA-Z_][\w.]*)[ \t]*;', _FLAGS),
+    "go": re.compile(rb'^[ \t]*import[ \t]+(?:[\w.]+[ \t]+)?"([^"\n]+)"', _FLAGS),
+    "c": re.compile(rb'^[ \t]*#[ \t]*include[ \t]*[<"]([^>"\n]+)[>"]', _FLAGS),
+    "cpp": re.compile(rb'^[ \t]*#[ \t]*include[ \t]*[<"]([^>"\n]+)[>"]', _FLAGS),
+}
+
+# Languages whose imports must precede the first declaration: scanning stops there
+HEADER_END_PATTERNS = {
+    "java": re.compile(
+        rb'^[ \t]*(?:(?:public|protected|private|abstract|final|static|sealed|non-sealed|strictfp)[ \t]+)*'
+        rb'(?:class|interface|enum|record|@interface)\b',
+        re.MULTILINE,
+    ),
+    "go": re.compile(rb'^(?:func|type|var|const)\b', re.MULTILINE),
+}
+
+GO_IMPORT_BLOCK = re.compile(rb'^[ \t]*import[ \t]*\(([^)]*)\)', re.MULTILINE)
+GO_BLOCK_PATH = re.compile(rb'"([^"\n]+)"')
+
+
+@contextmanager
+def open_buffer(path):
+    """Yields the file's content as a bytes-like object (mmap for large files)."""
+    with open(path, "rb") as f:
+        size = f.seek(0, 2)
+        f.seek(0)
+        if size < MMAP_THRESHOLD:
+            yield f.read()
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+
+
+def scan_imports(buf, lang):
+    """Unique imports of one file in first-seen order, from a single pass over its bytes."""
+    pattern = IMPORT_PATTERNS.get(lang)
+    if pattern is None:
+        return []
+    end = len(buf)
+    header_end = HEADER_END_PATTERNS.get(lang)
+    if header_end is not None:
+        match = header_end.search(buf)
+        if match:
+            end = match.start()
+    found = {}
+    for match in pattern.finditer(buf, 0, end):
+        dep = next((g for g in match.groups() if g is not None), None)
+        if dep:
+            found.setdefault(dep.decode("utf-8", errors="ignore"), None)
+    if lang == "go":
+        for block in GO_IMPORT_BLOCK.finditer(buf, 0, end):
+            for path in GO_BLOCK_PATH.finditer(block.group(1)):
+                found.setdefault(path.group(1).decode("utf-8", errors="ignore"), None)
+    return list(found)
+
+
+def scan_file(path, lang):
+    if lang not in IMPORT_PATTERNS:
+        return []
+    with open_buffer(path) as buf:
+        return scan_imports(buf, lang)
@@ -0,0 +1,104 @@
+import sqlite3
+import threading
+import time
+import orjson
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from cache_utils import CACHE_DIR
+from RAGs.import_scanner import SCANNER_VERSION
+
+MANIFEST_PATH = CACHE_DIR / "ingest_manifest.sqlite3"
+
+
+@dataclass
+class ManifestEntry:
+    size: int
+    mtime_ns: int
+    content_hash: str
+    lang: str
+    imports: list = field(default_factory=list)
+
+
+class IngestionManifest:
+    """
+    Per-project record of what ingestion learned about each file, keyed on
+    (root, path) and validated by (size, mtime, content hash).
+
+    Files whose size and mtime are unchanged are reused without being read;
+    files that were touched but hash the same (e.g. a fresh clone) are reused
+    after hashing, and only the rest are rescanned. Entries written by another
+    scanner version are discarded on open.
+    """
+    def __init__(self, path=MANIFEST_PATH, version=SCANNER_VERSION):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS files (
+                root TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                content_hash TEXT NOT NULL,
+                lang TEXT NOT NULL,
+                imports BLOB NOT NULL,
+                scanned_at REAL NOT NULL,
+                PRIMARY KEY (root, path)
+            )"""
+        )
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] != version:
+            self._conn.execute("DELETE FROM files")
+            self._conn.execute(f"PRAGMA user_version = {int(version)}")
+
+    def load(self, root):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, size, mtime_ns, content_hash, lang, imports FROM files WHERE root = ?", (str(root),)
+            ).fetchall()
+        return {
+            path: ManifestEntry(size, mtime_ns, content_hash, lang, orjson.loads(imports))
+            for path, size, mtime_ns, content_hash, lang, imports in rows
+        }
+
+    def save(self, root, entries, removed=()):
+        """Upserts {path: ManifestEntry} and drops paths that no longer exist, in one transaction."""
+        root = str(root)
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO files (root, path, size, mtime_ns, content_hash, lang, imports, scanned_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (root, path, e.size, e.mtime_ns, e.content_hash, e.lang, orjson.dumps(e.imports), now)
+                        for path, e in entries.items()
+                    ],
+                )
+                self._conn.executemany(
+                    "DELETE FROM files WHERE root = ? AND path = ?", [(root, path) for path in removed]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def clear(self, root):
+        with self._lock:
+            self._conn.execute("DELETE FROM files WHERE root = ?", (str(root),))
+
+
+_manifest = None
+_manifest_lock = threading.Lock()
+
+
+def get_manifest():
+    global _manifest
+    with _manifest_lock:
+        if _manifest is None:
+            _manifest = IngestionManifest()
+    return _manifest
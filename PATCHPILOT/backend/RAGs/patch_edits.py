@@ -0,0 +1,261 @@
+import ast
+import difflib
+import os
+import re
+from dataclasses import dataclass
+
+# Similarity a SEARCH block needs with the lines it is matched to when it is not found verbatim
+FUZZY_THRESHOLD = float(os.getenv("PATCHPILOT_EDIT_FUZZ", "0.9"))
+DIFF_CONTEXT = 3
+
+EDIT_BLOCK = re.compile(
+    r"^<{5,}[ \t]*SEARCH[^\n]*\n(.*?)^={5,}[ \t]*\n(.*?)^>{5,}[ \t]*REPLACE[^\n]*$", re.MULTILINE | re.DOTALL
+)
+HUNK_HEADER = re.compile(r"^@@ -\d+(?:,\d+)? \+\d+(?:,\d+)? @@")
+LINE_ENDING = re.compile(r"\r\n|\n|\r")
+# Everything str.splitlines() ends a line at
+LINE_TERMINATORS = "\r\n\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029"
+
+EDIT_FORMAT = """Return ONLY search/replace blocks, one per changed region, in this exact format:
+
+<<<<<<< SEARCH
+exact lines copied from the code, including a few unchanged lines around the change
+=======
+the same lines with the change applied
+>>>>>>> REPLACE
+
+- Copy SEARCH lines verbatim, with their indentation, so they match exactly one place in the code.
+- Keep each block small: the changed lines plus one or two lines of context.
+- Use one block per separate region; never repeat or overlap regions.
+- To add lines (e.g. an import), SEARCH for the line they go after and repeat it in REPLACE.
+- Do NOT return the rest of the file."""
+
+
+class EditError(ValueError):
+    pass
+
+
+@dataclass
+class Edit:
+    search: list
+    replace: list
+
+
+@dataclass
+class Match:
+    """Lines [start, end) of the original replaced by new (lines without line endings)."""
+    start: int
+    end: int
+    new: list
+
+
+def parse_edits(text):
+    """
+    Edits in a model response: search/replace blocks, or the hunks of a
+    unified diff (context and removed lines to search for, context and
+    added lines to put back). Raises EditError when there are none.
+    """
+    edits = [Edit(search.splitlines(), replace.splitlines()) for search, replace in EDIT_BLOCK.findall(text)]
+    if edits:
+        return edits
+    hunk = None
+    for line in text.splitlines():
+        if HUNK_HEADER.match(line):
+            hunk = Edit([], [])
+            edits.append(hunk)
+        elif hunk is None or line.startswith(("--- ", "+++ ", "\\")):
+            continue
+        elif line.startswith("-"):
+            hunk.search.append(line[1:])
+        elif line.startswith("+"):
+            hunk.replace.append(line[1:])
+        elif line.startswith(" ") or not line:
+            hunk.search.append(line[1:])
+            hunk.replace.append(line[1:])
+        else:
+            # Prose or a closing fence ends the diff
+            hunk = None
+    edits = [edit for edit in edits if edit.search or edit.replace]
+    if not edits:
+        raise EditError("no search/replace blocks or diff hunks in the response")
+    return edits
+
+
+def _trim_blank(search, replace):
+    """Drops blank lines the model put around a block; they rarely match the file's spacing."""
+    while search and replace and not search[0].strip() and not replace[0].strip():
+        search, replace = search[1:], replace[1:]
+    while search and replace and not search[-1].strip() and not replace[-1].strip():
+        search, replace = search[:-1], replace[:-1]
+    return search, replace
+
+
+def _indent(line):
+    return line[:len(line) - len(line.lstrip())]
+
+
+def _reindent(replace, search, found):
+    """Shifts the replacement to the indentation of the lines actually matched."""
+    want = next((_indent(line) for line in found if line.strip()), "")
+    have = next((_indent(line) for line in search if line.strip()), "")
+    if want == have:
+        return replace
+    out = []
+    for line in replace:
+        if not line.strip():
+            out.append(line)
+        elif line.startswith(have):
+            out.append(want + line[len(have):])
+        else:
+            out.append(want + line.lstrip())
+    return out
+
+
+def _allowed(i, k, taken, within):
+    if any(i < end and start < i + k for start, end in taken):
+        return False
+    return within is None or any(start <= i and i + k <= end for start, end in within)
+
+
+def _candidates(keys, search_keys, taken, within):
+    k = len(search_keys)
+    for i in range(len(keys) - k + 1):
+        if keys[i:i + k] == search_keys and _allowed(i, k, taken, within):
+            yield i
+
+
+def locate(lines, search, taken=(), within=None):
+    """
+    Index where search (a list of lines) sits in lines, trying in turn: the
+    exact lines, the lines ignoring indentation, and the most similar
+    window above FUZZY_THRESHOLD. Regions in taken are skipped, and with
+    within only windows inside one of its (start, end) ranges count, e.g.
+    the chunks the model was shown. With several exact hits the first free
+    one wins, since models list edits top to bottom. Raises EditError when
+    nothing qualifies.
+    """
+    k = len(search)
+    for normalize in (str.rstrip, str.strip):
+        keys = [normalize(line) for line in lines]
+        found = next(_candidates(keys, [normalize(line) for line in search], taken, within), None)
+        if found is not None:
+            return found
+    target = "\n".join(line.strip() for line in search)
+    stripped = [line.strip() for line in lines]
+    best, best_ratio = None, FUZZY_THRESHOLD
+    matcher = difflib.SequenceMatcher(autojunk=False)
+    matcher.set_seq2(target)
+    for i in range(len(lines) - k + 1):
+        if not _allowed(i, k, taken, within):
+            continue
+        matcher.set_seq1("\n".join(stripped[i:i + k]))
+        if matcher.real_quick_ratio() < best_ratio or matcher.quick_ratio() < best_ratio:
+            continue
+        ratio = matcher.ratio()
+        if ratio > best_ratio:
+            best, best_ratio = i, ratio
+    if best is None:
+        preview = next((line.strip() for line in search if line.strip()), "")
+        raise EditError(f"SEARCH block not found in the code: {preview[:80]!r}")
+    return best
+
+
+def apply_edits(code, edits, language=None, within=None):
+    """
+    (patched code, matches) for edits applied to code. Every edit is
+    located in the original before any is applied, so matches are in
+    original line numbers; overlapping edits, edits that change nothing
+    and (for Python) a result that no longer parses raise EditError.
+    Lines outside the matches are kept byte for byte and new lines take
+    the file's line ending, so a CRLF file stays CRLF. within limits the
+    matches to those line ranges (see locate).
+    """
+    raw = code.splitlines(keepends=True)
+    lines = [line.rstrip(LINE_TERMINATORS) for line in raw]
+    first_ending = LINE_ENDING.search(code)
+    newline = first_ending.group(0) if first_ending else "\n"
+    matches = []
+    for edit in edits:
+        search, replace = _trim_blank(edit.search, edit.replace)
+        if not search:
+            raise EditError("empty SEARCH block")
+        start = locate(lines, search, [(m.start, m.end) for m in matches], within)
+        found = lines[start:start + len(search)]
+        new = _reindent(replace, search, found)
+        # Context lines the block repeats unchanged are not part of the change
+        head = 0
+        while head < min(len(found), len(new)) and found[head] == new[head]:
+            head += 1
+        tail = 0
+        while tail < min(len(found), len(new)) - head and found[-1 - tail] == new[-1 - tail]:
+            tail += 1
+        if new != found:
+            matches.append(Match(start + head, start + len(found) - tail, new[head:len(new) - tail]))
+    if not matches:
+        raise EditError("edits change nothing")
+    matches.sort(key=lambda m: m.start)
+    out = []
+    position = 0
+    for match in matches:
+        out.extend(raw[position:match.start])
+        if match.new:
+            # An insertion takes the ending of the line before it, a replacement that of the last line replaced;
+            # at the end of a file without a final newline that is none
+            last = raw[match.end - 1] if match.end > match.start else (out[-1] if out else newline)
+            ending = last[len(last.rstrip(LINE_TERMINATORS)):]
+            if match.end == match.start and out and not ending:
+                out[-1] += newline
+            elif match.end == match.start:
+                ending = newline
+            out.append(newline.join(match.new) + ending)
+        position = match.end
+    out.extend(raw[position:])
+    patched = "".join(out)
+    if language == "python":
+        try:
+            ast.parse(code)
+        except (SyntaxError, ValueError):
+            pass
+        else:
+            try:
+                ast.parse(patched)
+            except (SyntaxError, ValueError) as e:
+                raise EditError(f"patched code does not parse: {e}")
+    return patched, matches
+
+
+def _range(start, length):
+    # Same range notation as difflib.unified_diff
+    if length == 1:
+        return f"{start + 1}"
+    return f"{start if not length else start + 1},{length}"
+
+
+def render_diff(code, matches, fromfile="initial_code", tofile="generated_code", context=DIFF_CONTEXT):
+    """Unified diff of the applied matches against code, in the form difflib.unified_diff(lineterm="") gives."""
+    lines = code.splitlines()
+    groups = []
+    for match in matches:
+        if groups and match.start - groups[-1][-1].end <= 2 * context:
+            groups[-1].append(match)
+        else:
+            groups.append([match])
+    out = [f"--- {fromfile}", f"+++ {tofile}"]
+    shift = 0
+    for group in groups:
+        first = max(0, group[0].start - context)
+        last = min(len(lines), group[-1].end + context)
+        body = []
+        position = first
+        for match in group:
+            body.extend(" " + line for line in lines[position:match.start])
+            body.extend("-" + line for line in lines[match.start:match.end])
+            body.extend("+" + line for line in match.new)
+            position = match.end
+        body.extend(" " + line for line in lines[position:last])
+        old_length = last - first
+        new_length = old_length + sum(len(m.new) - (m.end - m.start) for m in group)
+        out.append(f"@@ -{_range(first, old_length)} +{_range(first + shift, new_length)} @@")
+        out.extend(body)
+        shift += new_length - old_length
+    return "\n".join(out)
@@ -0,0 +1,130 @@
+import os
+import re
+
+# Directories never worth ingesting; hidden directories are skipped as well
+DEFAULT_IGNORED_DIRS = frozenset({
+    "node_modules", "venv", ".venv", "__pycache__", "dist", "build",
+    "site-packages", "target", ".git", ".hg", ".svn", ".tox", ".mypy_cache", ".pytest_cache",
+})
+
+
+def _translate(pattern):
+    """Turns a gitignore glob into a regex over '/'-separated relative paths."""
+    out = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            out.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            out.append("[^/]")
+            i += 1
+        elif pattern[i] == "[":
+            end = pattern.find("]", i + 1)
+            if end == -1:
+                out.append(re.escape(pattern[i]))
+                i += 1
+            else:
+                out.append("[" + pattern[i + 1:end].replace("\\", "\\\\") + "]")
+                i = end + 1
+        else:
+            out.append(re.escape(pattern[i]))
+            i += 1
+    return "".join(out)
+
+
+class GitIgnoreRule:
+    __slots__ = ("base", "negate", "dir_only", "regex")
+
+    def __init__(self, base, pattern):
+        self.base = base
+        self.negate = pattern.startswith("!")
+        if self.negate:
+            pattern = pattern[1:]
+        self.dir_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        # A slash anywhere but the end anchors the pattern to its .gitignore's directory
+        anchored = "/" in pattern
+        pattern = pattern.lstrip("/")
+        prefix = "^" if anchored else "^(?:.*/)?"
+        self.regex = re.compile(prefix + _translate(pattern) + "$")
+
+    def matches(self, path, is_dir):
+        if self.dir_only and not is_dir:
+            return False
+        rel = os.path.relpath(path, self.base).replace(os.sep, "/")
+        return bool(self.regex.match(rel))
+
+
+def load_gitignore(directory):
+    rules = []
+    try:
+        with open(os.path.join(directory, ".gitignore"), encoding="utf-8", errors="ignore") as f:
+            for line in f:
+                line = line.rstrip("\n").rstrip()
+                if not line or line.startswith("#"):
+                    continue
+                if line.startswith("\\"):
+                    line = line[1:]
+                rules.append(GitIgnoreRule(directory, line))
+    except OSError:
+        pass
+    return rules
+
+
+def is_ignored(path, is_dir, rules):
+    ignored = False
+    for rule in rules:
+        if rule.matches(path, is_dir):
+            ignored = not rule.negate
+    return ignored
+
+
+def walk_files(root, ignore_dirs=DEFAULT_IGNORED_DIRS, use_gitignore=True, skip_dirs=()):
+    """
+    Iterative os.scandir walk yielding os.DirEntry objects for files under root.
+
+    DirEntry caches its type, so no extra stat is made per entry, and deep
+    trees cannot hit the recursion limit. Directories in ignore_dirs, hidden
+    directories, and anything matched by .gitignore files along the way are
+    pruned. skip_dirs holds directory paths to leave out (e.g. ones the
+    caller walks separately); it is checked when a directory is reached, so
+    the caller may still add to it while the walk is running.
+    """
+    stack = [(os.fspath(root), ())]
+    while stack:
+        directory, rules = stack.pop()
+        if directory in skip_dirs:
+            continue
+        try:
+            with os.scandir(directory) as it:
+                entries = list(it)
+        except OSError as e:
+            print(f"Error accessing directory {directory}: {e}")
+            continue
+        if use_gitignore and any(entry.name == ".gitignore" for entry in entries):
+            rules = rules + tuple(load_gitignore(directory))
+        subdirs = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+            if is_dir:
+                if entry.name.startswith(".") or entry.name in ignore_dirs:
+                    continue
+                if rules and is_ignored(entry.path, True, rules):
+                    continue
+                subdirs.append(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                if rules and is_ignored(entry.path, False, rules):
+                    continue
+                yield entry
+        # Reversed so directories are visited in listing order
+        stack.extend((path, rules) for path in reversed(subdirs))
@@ -0,0 +1,272 @@
+import ast
+import hashlib
+import multiprocessing
+import os
+import re
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from importlib import metadata
+
+from RAGs.import_scanner import open_buffer, scan_imports
+
+PARSE_PROCESSES = int(os.getenv("PATCHPILOT_PARSE_PROCESSES", str(min(8, os.cpu_count() or 1))))
+# Files per parse task; a scan with fewer misses than this never starts the pool
+PARSE_BATCH = 128
+
+STDLIB_MODULES = frozenset(getattr(sys, "stdlib_module_names", ())) | frozenset(sys.builtin_module_names)
+
+# Import names whose PyPI distribution is named differently. Dotted keys win over their top-level name.
+IMPORT_ALIASES = {
+    "jose": "python-jose",
+    "jwt": "PyJWT",
+    "yaml": "PyYAML",
+    "PIL": "Pillow",
+    "cv2": "opencv-python",
+    "sklearn": "scikit-learn",
+    "skimage": "scikit-image",
+    "bs4": "beautifulsoup4",
+    "dateutil": "python-dateutil",
+    "dotenv": "python-dotenv",
+    "multipart": "python-multipart",
+    "docx": "python-docx",
+    "pptx": "python-pptx",
+    "magic": "python-magic",
+    "telegram": "python-telegram-bot",
+    "attr": "attrs",
+    "Crypto": "pycryptodome",
+    "OpenSSL": "pyOpenSSL",
+    "serial": "pyserial",
+    "usb": "pyusb",
+    "fitz": "PyMuPDF",
+    "git": "GitPython",
+    "MySQLdb": "mysqlclient",
+    "psycopg2": "psycopg2-binary",
+    "zmq": "pyzmq",
+    "win32api": "pywin32",
+    "win32con": "pywin32",
+    "pkg_resources": "setuptools",
+    "google.protobuf": "protobuf",
+}
+# Namespace roots shared by many distributions, e.g. google.cloud.storage -> google-cloud-storage
+NAMESPACE_PACKAGES = frozenset({"google", "azure"})
+NAMESPACE_DEPTH = 3
+
+
+def canonical_name(name):
+    """PEP 503 normalized distribution name, used to match imports against manifests."""
+    return re.sub(r"[-_.]+", "-", str(name)).lower()
+
+
+@lru_cache(maxsize=1)
+def _installed_distributions():
+    """Import name -> distribution for packages installed here, where that is unambiguous."""
+    try:
+        mapping = metadata.packages_distributions()
+    except Exception:
+        return {}
+    return {name: dists[0] for name, dists in mapping.items() if len(set(dists)) == 1}
+
+
+def distribution_for(module):
+    """Distribution providing a dotted absolute module name, as a canonical name."""
+    parts = module.split(".")
+    for depth in range(len(parts), 0, -1):
+        alias = IMPORT_ALIASES.get(".".join(parts[:depth]))
+        if alias:
+            return canonical_name(alias)
+    top = parts[0]
+    if top in NAMESPACE_PACKAGES and len(parts) > 1:
+        return canonical_name("-".join(parts[:NAMESPACE_DEPTH]))
+    return canonical_name(_installed_distributions().get(top, top))
+
+
+# Top-level dirs code is imported from, as in the src layout
+SOURCE_DIRS = frozenset({"src", "lib"})
+TEST_DIRS = frozenset({"test", "tests", "testing"})
+
+# Where an import statement can start: a line, or after `;` or a compound statement's `:`
+IMPORT_START = re.compile(rb'(?:^|[;:])[ \t]*(?:import|from)\b', re.MULTILINE)
+# Fields holding nested statement lists; imports are statements, so expressions are never visited
+STATEMENT_FIELDS = ("body", "handlers", "orelse", "finalbody", "cases")
+
+
+def _statements(body):
+    stack = list(reversed(body))
+    while stack:
+        node = stack.pop()
+        yield node
+        nested = []
+        for name in STATEMENT_FIELDS:
+            children = getattr(node, name, None)
+            if isinstance(children, list):
+                nested.extend(children)
+        # Pushed reversed so statements come out in source order
+        stack.extend(reversed(nested))
+
+
+def extract_imports(source):
+    """
+    Unique absolute imports of a Python source in first-seen order, as dotted
+    module names. Relative imports are always intra-project and are left out.
+    Raises SyntaxError for code ast cannot parse (e.g. Python 2).
+    """
+    found = {}
+    for node in _statements(ast.parse(source).body):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                found.setdefault(alias.name, None)
+        elif isinstance(node, ast.ImportFrom) and not node.level and node.module:
+            found.setdefault(node.module, None)
+    return list(found)
+
+
+def _import_prefix(buf):
+    """
+    The source up to the end of the line holding the last possible import
+    start, or None when nothing could be an import. Nothing after it can be
+    an import statement, so ast only has to build the prefix.
+    """
+    last = None
+    for last in IMPORT_START.finditer(buf):
+        pass
+    if last is None:
+        return None
+    end = buf.find(b"\n", last.end())
+    return bytes(buf[:len(buf) if end == -1 else end + 1])
+
+
+def parse_file(path, known_hash=None):
+    """(content hash, imports), with imports None when the hash equals known_hash."""
+    with open_buffer(path) as buf:
+        content_hash = hashlib.sha1(buf).hexdigest()
+        if content_hash == known_hash:
+            return content_hash, None
+        prefix = _import_prefix(buf)
+        if prefix is None:
+            return content_hash, []
+        try:
+            return content_hash, extract_imports(prefix)
+        except (SyntaxError, ValueError):
+            pass
+        try:
+            # The cut may split a statement (e.g. a try without its except)
+            return content_hash, extract_imports(bytes(buf))
+        except (SyntaxError, ValueError):
+            # Not parseable by this interpreter: the line scan still finds most imports
+            return content_hash, scan_imports(buf, "python")
+
+
+def parse_batch(batch):
+    """Runs in a worker process: parse_file over [(path, known_hash)]."""
+    results = []
+    for path, known_hash in batch:
+        try:
+            results.append(parse_file(path, known_hash))
+        except OSError:
+            results.append(None)
+    return results
+
+
+def _is_test_module(name):
+    return name == "conftest.py" or name.startswith("test_") or name.endswith("_test.py")
+
+
+def local_modules(paths, root, imports=None):
+    """
+    Top-level names the project itself provides. Source roots are root,
+    src/ and lib/, and every dir at any depth that directly holds non-test
+    modules without being a package itself (backend/, scripts/): code may
+    run with any of them on the path. Their modules and packages (dirs with
+    __init__.py) count; a plain subdir only counts when the project imports
+    one of its own modules through it (RAGs.ProjectIngestion for
+    backend/RAGs/ProjectIngestion.py). imports maps paths to the modules
+    they import. So intermediate dirs (integrations/redis, tests/pydantic)
+    never hide a third-party import.
+    """
+    names = set()
+    if root is None and paths:
+        root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in paths])
+    relative = {}
+    for path in paths:
+        parts = os.path.relpath(path, root).replace(os.sep, "/").split("/")
+        relative[path] = tuple([os.path.basename(path)] if parts[0] == ".." else parts)
+    packages = {parts[:-1] for parts in relative.values() if parts[-1] == "__init__.py"}
+    code_dirs = {parts[:depth] for parts in relative.values() for depth in range(1, len(parts))}
+    source_roots = {()} | {(name,) for name in SOURCE_DIRS if (name,) in code_dirs}
+    for parts in relative.values():
+        base = parts[:-1]
+        if base and base not in packages and not _is_test_module(parts[-1]) and not set(base) & TEST_DIRS:
+            source_roots.add(base)
+    for parts in relative.values():
+        for depth in range(len(parts)):
+            base = parts[:depth]
+            if base not in source_roots:
+                continue
+            name = os.path.splitext(parts[depth])[0] if depth == len(parts) - 1 else parts[depth]
+            # Code directly under root or src/ may be a namespace package; deeper dirs must be packages
+            if depth < len(parts) - 1 and len(base) > 0 and base[0] not in SOURCE_DIRS and base + (name,) not in packages:
+                continue
+            if name.isidentifier() and name != "__init__":
+                names.add(name)
+    # Namespace dirs imported with a submodule they hold: `from RAGs.ProjectIngestion import ...`
+    # with backend/RAGs/ProjectIngestion.py under the source root backend/
+    submodules = code_dirs | {parts[:-1] + (os.path.splitext(parts[-1])[0],) for parts in relative.values()}
+    for modules in (imports or {}).values():
+        for module in modules:
+            top, _, rest = module.partition(".")
+            if not rest or not top.isidentifier() or top in names:
+                continue
+            second = rest.split(".")[0]
+            if any(base + (top, second) in submodules for base in source_roots):
+                names.add(top)
+    return names
+
+
+def third_party(imports, local):
+    """Canonical distribution names for imports that are neither stdlib nor part of the project."""
+    found = {}
+    for module in imports:
+        top = module.split(".")[0]
+        if not top or top in STDLIB_MODULES or top in local:
+            continue
+        found.setdefault(distribution_for(module), None)
+    return list(found)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_parse_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a server process that holds threads and locks is not safe
+            _pool = ProcessPoolExecutor(max_workers=PARSE_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def reset_parse_pool():
+    """Drops a pool whose workers died so the next batch starts a fresh one."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def submit_batch(batch):
+    """Future of parse_batch(batch) on the process pool."""
+    return get_parse_pool().submit(parse_batch, batch)
+
+
+def batch_result(future, batch):
+    """Result of a submitted batch, parsing it in-process if the pool broke."""
+    try:
+        return future.result()
+    except BrokenProcessPool:
+        reset_parse_pool()
+        return parse_batch(batch)
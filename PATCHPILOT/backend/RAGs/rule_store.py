@@ -0,0 +1,294 @@
+import hashlib
+import json
+import re
+import sqlite3
+import time
+import orjson
+from contextlib import contextmanager
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve()
+while BASE_DIR.name != "backend":
+    BASE_DIR = BASE_DIR.parent
+RULE_STORE_PATH = BASE_DIR / "orjsonfiles" / "rule_store.sqlite3"
+# Compiled rules the Rule Synthesis node kept before the store existed
+LEGACY_RULES_PATH = BASE_DIR / "orjsonfiles" / "initial_rules.json"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rules (
+    library TEXT NOT NULL,
+    rule_id TEXT NOT NULL,
+    version_range TEXT NOT NULL DEFAULT '',
+    priority TEXT NOT NULL DEFAULT '',
+    position INTEGER NOT NULL,
+    payload BLOB NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (library, rule_id)
+);
+CREATE INDEX IF NOT EXISTS rules_library_version ON rules(library, version_range);
+CREATE TABLE IF NOT EXISTS compiled_chunks (
+    library TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    compiled BLOB NOT NULL,
+    PRIMARY KEY (library, digest)
+);
+CREATE TABLE IF NOT EXISTS layouts (
+    library TEXT PRIMARY KEY,
+    digests BLOB NOT NULL,
+    updated_at REAL NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+# Compiled chunk holding a library's chunks merged into one rule set; stands in for them when present
+REDUCE_PREFIX = "reduce:"
+# Start of a rule object in a supervisor response
+RULE_OBJECT = re.compile(r'\{\s*"rule_id"')
+
+
+class StaleLayoutError(RuntimeError):
+    """Another run saved a library since this writer loaded it; reload and compile again."""
+
+
+def normalize_library(name):
+    return str(name or "").strip().lower().replace("_", "-").replace(".", "-")
+
+
+def _salvage_rules(text):
+    """The complete rule objects in a supervisor response cut off mid-JSON."""
+    decoder = json.JSONDecoder()
+    rules = []
+    position = 0
+    for match in RULE_OBJECT.finditer(text):
+        if match.start() < position:
+            continue
+        try:
+            rule, position = decoder.raw_decode(text, match.start())
+        except ValueError:
+            continue
+        if isinstance(rule, dict):
+            rules.append(rule)
+    return rules
+
+
+def _rule_key(rule):
+    """rule_id, or for rules without one a digest of the text, which is the same in every run."""
+    if rule.get("rule_id"):
+        return str(rule["rule_id"])
+    text = rule.get("rule_text") or orjson.dumps(rule, option=orjson.OPT_SORT_KEYS).decode()
+    return "rule-" + hashlib.sha1(str(text).encode()).hexdigest()[:16]
+
+
+class RuleStore:
+    """
+    SQLite (WAL) store for synthesized rules and their compiled chunks, keyed
+    by library and rule_id. Every write runs in a BEGIN IMMEDIATE transaction,
+    and each library's layout carries a version: a save of a library another
+    run saved since it was loaded raises StaleLayoutError instead of
+    overwriting that run's rules and chunks.
+    """
+    def __init__(self, path=RULE_STORE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(layouts)")}
+            if "version" not in columns:
+                # Stores created before layouts were versioned
+                conn.execute("ALTER TABLE layouts ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+    def _connect(self):
+        conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def _write(self):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def libraries(self):
+        conn = self._connect()
+        try:
+            return [row[0] for row in conn.execute("SELECT DISTINCT library FROM rules ORDER BY library")]
+        finally:
+            conn.close()
+
+    def compiled_rules(self, library):
+        """Compiled (supervised) rules for one library: its chunks merged by the reduce step, else each chunk in layout order."""
+        library = normalize_library(library)
+        conn = self._connect()
+        try:
+            layout = conn.execute("SELECT digests FROM layouts WHERE library = ?", (library,)).fetchone()
+            if not layout:
+                return []
+            compiled = dict(conn.execute(
+                "SELECT digest, compiled FROM compiled_chunks WHERE library = ?", (library,)
+            ).fetchall())
+        finally:
+            conn.close()
+        reduced = [digest for digest in compiled if digest.startswith(REDUCE_PREFIX)]
+        if reduced:
+            return orjson.loads(compiled[reduced[0]])
+        rules = []
+        for digest in orjson.loads(layout[0]):
+            if digest in compiled:
+                rules.extend(orjson.loads(compiled[digest]))
+        return rules
+
+    def load_partitions(self, libraries=None):
+        """
+        Partition state in the shape RuleSynthesizer.compile_incremental
+        expects, with each library's layout version for save_partitions.
+        """
+        libraries = [normalize_library(l) for l in libraries] if libraries is not None else self.libraries()
+        conn = self._connect()
+        try:
+            partitions = {}
+            for library in libraries:
+                rules = [orjson.loads(row[0]) for row in conn.execute(
+                    "SELECT payload FROM rules WHERE library = ? ORDER BY position", (library,)
+                )]
+                chunks = {digest: orjson.loads(compiled) for digest, compiled in conn.execute(
+                    "SELECT digest, compiled FROM compiled_chunks WHERE library = ?", (library,)
+                )}
+                version = conn.execute("SELECT version FROM layouts WHERE library = ?", (library,)).fetchone()
+                if rules or chunks:
+                    partitions[library] = {"rules": rules, "chunks": chunks, "version": version[0] if version else 0}
+            return partitions
+        finally:
+            conn.close()
+
+    def save_partitions(self, partitions, previous=None):
+        """
+        Atomically saves the libraries whose rules or chunks differ from
+        `previous` (what this writer loaded); the others are not touched.
+        Each saved library replaces what is stored for it, so its version
+        must still be the one loaded: otherwise StaleLayoutError is raised
+        and nothing is written. Returns the libraries saved.
+        """
+        previous = {normalize_library(library): partition for library, partition in (previous or {}).items()}
+        changed = {}
+        for library, partition in partitions.items():
+            library = normalize_library(library)
+            before = previous.get(library, {})
+            if (partition.get("rules", []) != before.get("rules", [])
+                    or list(partition.get("chunks", {})) != list(before.get("chunks", {}))):
+                changed[library] = partition
+        if not changed:
+            return []
+        now = time.time()
+        with self._write() as conn:
+            stored = dict(conn.execute(
+                f"SELECT library, version FROM layouts WHERE library IN ({','.join('?' * len(changed))})", list(changed)
+            ).fetchall())
+            stale = sorted(library for library, partition in changed.items()
+                           if stored.get(library, 0) != partition.get("version", 0))
+            if stale:
+                raise StaleLayoutError(f"rules of {', '.join(stale)} were saved by another run")
+            for library, partition in changed.items():
+                rules = partition.get("rules", [])
+                keep = []
+                for position, rule in enumerate(rules):
+                    rule_id = _rule_key(rule)
+                    keep.append(rule_id)
+                    conn.execute(
+                        """INSERT INTO rules (library, rule_id, version_range, priority, position, payload, updated_at)
+                           VALUES (?, ?, ?, ?, ?, ?, ?)
+                           ON CONFLICT(library, rule_id) DO UPDATE SET
+                               version_range = excluded.version_range, priority = excluded.priority,
+                               position = excluded.position, payload = excluded.payload,
+                               updated_at = excluded.updated_at""",
+                        (library, rule_id, str(rule.get("version_range") or ""),
+                         str(rule.get("priority") or ""), position, orjson.dumps(rule), now),
+                    )
+                # Rules merged away since the load
+                conn.execute(
+                    f"DELETE FROM rules WHERE library = ? AND rule_id NOT IN ({','.join('?' * len(keep)) or 'NULL'})",
+                    (library, *keep),
+                )
+                chunks = partition.get("chunks", {})
+                conn.executemany(
+                    "INSERT OR REPLACE INTO compiled_chunks (library, digest, compiled) VALUES (?, ?, ?)",
+                    [(library, digest, orjson.dumps(compiled)) for digest, compiled in chunks.items()],
+                )
+                conn.execute(
+                    """INSERT INTO layouts (library, digests, updated_at, version) VALUES (?, ?, ?, 1)
+                       ON CONFLICT(library) DO UPDATE SET
+                           digests = excluded.digests, updated_at = excluded.updated_at,
+                           version = layouts.version + 1""",
+                    (library, orjson.dumps([digest for digest in chunks if not digest.startswith(REDUCE_PREFIX)]), now),
+                )
+                # Drop compiled chunks that are no longer part of the layout
+                conn.execute(
+                    f"DELETE FROM compiled_chunks WHERE library = ? AND digest NOT IN ({','.join('?' * len(chunks)) or 'NULL'})",
+                    (library, *chunks),
+                )
+        return list(changed)
+
+    def import_legacy_rules(self, path=LEGACY_RULES_PATH):
+        """
+        One-off import of initial_rules.json, where compiled rules piled up
+        before the store existed: a list of rules and of raw supervisor
+        responses holding them. Rules are filed by library and rule_id next
+        to those already stored, as compiled chunks so they are used right
+        away without another supervisor pass. The file is renamed after.
+        """
+        # RuleSynthesis imports this module, so its parsing and chunking are imported late
+        from RAGs.RuleSynthesis import MAX_RULES_PER_COMPILE, RuleSynthesizer
+        path = Path(path)
+        if not path.exists():
+            return False
+        try:
+            data = orjson.loads(path.read_bytes())
+        except Exception as e:
+            print(f"Could not import legacy rules from {path}: {e}")
+            return False
+        rules = []
+        for item in data if isinstance(data, list) else [data]:
+            parsed = RuleSynthesizer.parse_rules(item, key="final_rules")
+            if not parsed and isinstance(item, str):
+                # Responses were stored raw, and long ones ran out of tokens
+                parsed = _salvage_rules(item)
+            rules.extend(parsed)
+        by_library = {}
+        for rule in rules:
+            by_library.setdefault(RuleSynthesizer.partition_key(rule), {})[_rule_key(rule)] = rule
+        previous = self.load_partitions()
+        partitions = {}
+        for library, found in by_library.items():
+            partition = previous.get(library, {"rules": [], "chunks": {}, "version": 0})
+            stored = {_rule_key(rule) for rule in partition["rules"]}
+            new = [rule for key, rule in found.items() if key not in stored]
+            if not new:
+                continue
+            chunks = dict(partition["chunks"])
+            for start in range(0, len(new), MAX_RULES_PER_COMPILE):
+                chunk = new[start:start + MAX_RULES_PER_COMPILE]
+                chunks[RuleSynthesizer._digest(chunk)] = chunk
+            partitions[library] = {**partition, "rules": partition["rules"] + new, "chunks": chunks}
+        self.save_partitions(partitions, previous=previous)
+        path.rename(path.with_suffix(".json.migrated"))
+        print(f"Imported {sum(len(p['rules']) for p in partitions.values())} legacy rules from {path}")
+        return True
+
+
+_rule_store = None
+
+
+def get_rule_store():
+    global _rule_store
+    if _rule_store is None:
+        _rule_store = RuleStore()
+        _rule_store.import_legacy_rules()
+    return _rule_store
@@ -0,0 +1,189 @@
+import atexit
+import hashlib
+import os
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from uuid import uuid4
+
+from telemetry import telemetry
+
+# Point at a fake docker CLI (any executable accepting the same arguments) to run without Docker
+DOCKER_BIN = os.getenv("PATCHPILOT_DOCKER_BIN", "docker")
+BUILD_TIMEOUT_SECONDS = int(os.getenv("PATCHPILOT_SANDBOX_BUILD_TIMEOUT", "1800"))
+VERIFY_TIMEOUT_SECONDS = int(os.getenv("PATCHPILOT_SANDBOX_VERIFY_TIMEOUT", "300"))
+BASE_IMAGE_REPO = "patchpilot-base"
+SANDBOX_WORKDIR = "/app"
+
+# Files whose content decides which dependencies end up in the base image
+DEPENDENCY_MANIFESTS = (
+    "requirements.txt", "pyproject.toml", "setup.py", "setup.cfg", "Pipfile", "Pipfile.lock", "poetry.lock",
+    "package.json", "package-lock.json", "yarn.lock", "pnpm-lock.yaml",
+    "go.mod", "go.sum", "pom.xml", "build.gradle",
+)
+
+
+@dataclass
+class VerificationResult:
+    ok: bool
+    output: bytes
+    duration: float
+    image: str = ""
+    container: str = ""
+
+
+def dependency_hash(context_dir, spec):
+    """Digest of everything that goes into a base image: language, version, preset, install steps and manifests."""
+    digest = hashlib.sha256()
+    for part in (spec["language"], spec["version"], spec["install_preset"], spec["base_image"], *spec["install_steps"]):
+        digest.update(str(part).encode())
+        digest.update(b"\0")
+    root = Path(context_dir)
+    for name in DEPENDENCY_MANIFESTS:
+        path = root / name
+        if path.is_file():
+            digest.update(name.encode())
+            digest.update(b"\0")
+            digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+class VerificationSandbox:
+    """
+    Verifies patches in warm containers instead of a build/run/rmi per attempt.
+
+    A base image holding only the dependency layer is built once per
+    (language, version, install preset, dependency-set hash) and reused by
+    every run. Each run gets its own uniquely named containers started from
+    it; patched files are copied with `docker cp` into a fresh work dir under
+    /app, the entry point runs there through `docker exec`, and the dir is
+    removed again so the next work item never sees this one's files. Idle
+    containers are reused by later attempts of the same run and removed by
+    release_run().
+    """
+    def __init__(self, docker_bin=DOCKER_BIN, build_timeout=BUILD_TIMEOUT_SECONDS, verify_timeout=VERIFY_TIMEOUT_SECONDS):
+        self.docker_bin = docker_bin
+        self.build_timeout = build_timeout
+        self.verify_timeout = verify_timeout
+        self._lock = threading.Lock()
+        self._built = set()
+        self._build_locks = {}
+        self._idle = {}      # (run_id, image) -> idle container names
+        self._owned = {}     # run_id -> every container started for it
+        self._broken = set() # checked-out containers to remove instead of returning
+
+    def _docker(self, *args, timeout=None, check=True, input=None):
+        with telemetry.span(f"docker.{args[0]}", "docker") as span:
+            proc = subprocess.run(
+                [self.docker_bin, *args], input=input, capture_output=True, timeout=timeout, check=check
+            )
+            span.attrs["returncode"] = proc.returncode
+            return proc
+
+    def base_image(self, spec, context_dir):
+        """Tag of the cached dependency image for this spec, building it on first use."""
+        tag = f"{BASE_IMAGE_REPO}:{dependency_hash(context_dir, spec)[:16]}"
+        with self._lock:
+            if tag in self._built:
+                return tag
+            build_lock = self._build_locks.setdefault(tag, threading.Lock())
+        with build_lock:
+            if tag in self._built:
+                return tag
+            if self._docker("image", "inspect", tag, check=False).returncode != 0:
+                dockerfile = "\n".join([f"FROM {spec['base_image']}", f"WORKDIR {SANDBOX_WORKDIR}", *spec["install_steps"], ""])
+                print(f"DEBUG: Building verification base image {tag} from {spec['base_image']}")
+                try:
+                    self._docker("build", "-t", tag, "-f", "-", str(context_dir),
+                                 input=dockerfile.encode(), timeout=self.build_timeout)
+                except subprocess.CalledProcessError as e:
+                    raise RuntimeError(f"Base image build failed: {(e.stderr or b'').decode(errors='replace')}") from e
+            with self._lock:
+                self._built.add(tag)
+        return tag
+
+    @contextmanager
+    def container(self, run_id, image):
+        """Checks out a warm container of `image` for this run; broken ones are discarded instead of returned."""
+        key = (run_id, image)
+        with self._lock:
+            idle = self._idle.get(key, [])
+            name = idle.pop() if idle else None
+        if name is None:
+            name = f"patchpilot-{(run_id or 'adhoc')[:12]}-{uuid4().hex[:8]}"
+            self._docker("run", "-d", "--name", name, "--entrypoint", "tail", image, "-f", "/dev/null")
+            with self._lock:
+                self._owned.setdefault(run_id, set()).add(name)
+        try:
+            yield name
+        except BaseException:
+            self._remove(run_id, name)
+            raise
+        with self._lock:
+            broken = name in self._broken
+            self._broken.discard(name)
+            if not broken:
+                self._idle.setdefault(key, []).append(name)
+        if broken:
+            self._remove(run_id, name)
+
+    def verify(self, run_id, spec, context_dir):
+        """Copies context_dir into a fresh dir of a warm container and runs the spec's command there."""
+        start = time.perf_counter()
+        image = self.base_image(spec, context_dir)
+        name = ""
+        # Below /app, so node_modules and the like installed in the image still resolve
+        workdir = f"{SANDBOX_WORKDIR}/work-{uuid4().hex[:12]}"
+        try:
+            with self.container(run_id, image) as name:
+                self._docker("exec", name, "mkdir", "-p", workdir)
+                self._docker("cp", f"{context_dir}/.", f"{name}:{workdir}")
+                # Project-root imports resolve whichever subdirectory the entry lives in
+                env = ["-e", f"PYTHONPATH={workdir}"] if spec["language"] == "python" else []
+                proc = self._docker("exec", "-w", workdir, *env, name, *spec["run_cmd"],
+                                    check=False, timeout=self.verify_timeout)
+                # The run is over either way; a container that cannot be cleaned is discarded, not reused
+                if self._docker("exec", name, "rm", "-rf", workdir, check=False).returncode != 0:
+                    with self._lock:
+                        self._broken.add(name)
+        except subprocess.TimeoutExpired:
+            output = f"Verification timed out after {self.verify_timeout}s".encode()
+            return VerificationResult(False, output, time.perf_counter() - start, image, name)
+        output = proc.stdout + proc.stderr
+        return VerificationResult(proc.returncode == 0, output, time.perf_counter() - start, image, name)
+
+    def _remove(self, run_id, name):
+        self._docker("rm", "-f", name, check=False)
+        with self._lock:
+            self._owned.get(run_id, set()).discard(name)
+
+    def release_run(self, run_id):
+        """Removes every container started for the run. Base images stay cached."""
+        with self._lock:
+            names = self._owned.pop(run_id, set())
+            for key in [k for k in self._idle if k[0] == run_id]:
+                del self._idle[key]
+        if names:
+            self._docker("rm", "-f", *sorted(names), check=False)
+
+    def release_all(self):
+        with self._lock:
+            run_ids = list(self._owned)
+        for run_id in run_ids:
+            self.release_run(run_id)
+
+
+_sandbox = None
+_sandbox_lock = threading.Lock()
+
+
+def get_sandbox():
+    global _sandbox
+    with _sandbox_lock:
+        if _sandbox is None:
+            _sandbox = VerificationSandbox()
+            atexit.register(_sandbox.release_all)
+    return _sandbox
@@ -1,5 +1,6 @@
 import re
 from pathlib import Path
+from RAGs.python_imports import canonical_name
 
 class TargetDiscovery:
     def __init__(self, ingestor):
@@ -74,7 +75,8 @@ class TargetDiscovery:
         results = []
         
         for dep, version in deps.items():
-            count = count_dependencies.get(dep, 0)
+            # Python imports are counted under canonical distribution names
+            count = count_dependencies.get(dep, count_dependencies.get(canonical_name(dep), 0))
             priority = "high" if count > 4 else "low"
             suggestion = "Upgrade if Possible" if count > 2 else "Stable Version"
             risk = "high" if priority == "high" else "medium" if priority == "medium" else "low"
@@ -0,0 +1,146 @@
+import threading
+import orjson
+import requests
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
+
+from cache_utils import DiskCache, CACHE_DIR
+from telemetry import telemetry
+
+PAGE_TTL_SECONDS = 7 * 24 * 3600
+SEARCH_TTL_SECONDS = 24 * 3600
+WEB_CACHE_MAX_BYTES = 512 * 1024 * 1024
+FETCH_TIMEOUT = (5, 30)
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+)
+# Query parameters that only track the visit, dropped from cache keys
+TRACKING_PARAMS = frozenset({"ref", "fbclid", "gclid"})
+TRACKING_PREFIXES = ("utm_",)
+# Hosts where ?ref= selects the content (a branch or tag), so it is kept
+REF_CONTENT_HOSTS = ("github.com", "gitlab.com", "bitbucket.org", "raw.githubusercontent.com")
+
+
+def _is_tracking(name, host):
+    name = name.lower()
+    if name.startswith(TRACKING_PREFIXES):
+        return True
+    if name == "ref" and any(host == h or host.endswith("." + h) for h in REF_CONTENT_HOSTS):
+        return False
+    return name in TRACKING_PARAMS
+
+
+def normalize_url(url: str) -> str:
+    parsed = urlparse(url.strip())
+    scheme = parsed.scheme.lower() or "http"
+    host = (parsed.hostname or "").lower()
+    port = parsed.port
+    if port and not ((scheme == "http" and port == 80) or (scheme == "https" and port == 443)):
+        host = f"{host}:{port}"
+    path = parsed.path or "/"
+    if len(path) > 1:
+        path = path.rstrip("/")
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True)
+        if not _is_tracking(k, (parsed.hostname or "").lower())
+    )
+    return urlunparse((scheme, host, path, "", urlencode(query), ""))
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.casefold().split())
+
+
+class WebContentCache:
+    """
+    On-disk cache for fetched documentation pages and search responses.
+
+    Pages are keyed on the normalized URL and revalidated with ETag /
+    Last-Modified once their TTL runs out; search responses are keyed on the
+    normalized query text.
+    """
+    def __init__(self, path=None, max_bytes=WEB_CACHE_MAX_BYTES,
+                 page_ttl=PAGE_TTL_SECONDS, search_ttl=SEARCH_TTL_SECONDS):
+        self.store = DiskCache(path or CACHE_DIR / "web_cache.sqlite3", max_bytes=max_bytes)
+        self.page_ttl = page_ttl
+        self.search_ttl = search_ttl
+        self.session = requests.Session()
+        self.session.headers.update({"User-Agent": USER_AGENT})
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "page_hits": 0,
+            "page_misses": 0,
+            "page_revalidated": 0,
+            "search_hits": 0,
+            "search_misses": 0,
+        }
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def fetch_page(self, url: str) -> str:
+        """Return the page HTML, from cache when fresh or still valid upstream."""
+        key = "page:" + normalize_url(url)
+        entry = self.store.get(key, include_expired=True)
+        if entry and not entry.expired:
+            self._count("page_hits")
+            return entry.value.decode("utf-8", errors="replace")
+
+        headers = {}
+        if entry:
+            if entry.meta.get("etag"):
+                headers["If-None-Match"] = entry.meta["etag"]
+            if entry.meta.get("last_modified"):
+                headers["If-Modified-Since"] = entry.meta["last_modified"]
+
+        with telemetry.span("http.get", "http", host=urlparse(url).netloc, revalidate=bool(entry)) as span:
+            response = self.session.get(url, headers=headers, timeout=FETCH_TIMEOUT)
+            span.attrs["status_code"] = response.status_code
+        if entry and response.status_code == 304:
+            self.store.touch(key, ttl=self.page_ttl)
+            self._count("page_revalidated")
+            return entry.value.decode("utf-8", errors="replace")
+
+        response.raise_for_status()
+        self._count("page_misses")
+        html = response.text
+        self.store.set(
+            key,
+            html.encode("utf-8"),
+            meta={
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            },
+            ttl=self.page_ttl,
+        )
+        return html
+
+    def cached_search(self, client, query: str, max_results: int = 1) -> dict:
+        key = f"search:{max_results}:{normalize_query(query)}"
+        entry = self.store.get(key)
+        if entry:
+            self._count("search_hits")
+            return orjson.loads(entry.value)
+        self._count("search_misses")
+        response = client.search(query=query, max_results=max_results)
+        self.store.set(key, orjson.dumps(response), ttl=self.search_ttl)
+        return response
+
+    def snapshot(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["bytes"] = self.store.total_bytes()
+        return stats
+
+
+_web_cache = None
+_web_cache_lock = threading.Lock()
+
+
+def get_web_cache() -> WebContentCache:
+    global _web_cache
+    with _web_cache_lock:
+        if _web_cache is None:
+            _web_cache = WebContentCache()
+        return _web_cache
@@ -0,0 +1,110 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+WORKSPACE_ROOT = Path(os.getenv("PATCHPILOT_WORKSPACE_ROOT", Path(tempfile.gettempdir()) / "patchpilot-workspaces"))
+# Workspaces left behind by a crashed process are removed after this long
+STALE_WORKSPACE_SECONDS = int(os.getenv("PATCHPILOT_WORKSPACE_TTL", str(24 * 3600)))
+IGNORED_DIRS = {".git", "node_modules", "venv", ".venv", "__pycache__", ".mypy_cache", ".pytest_cache"}
+
+
+def _link_or_copy(src, dst):
+    # Hardlinks make the project copy nearly free; files are only ever replaced, never edited in place
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _ignore(directory, names):
+    return [name for name in names if name in IGNORED_DIRS]
+
+
+class WorkspaceManager:
+    """
+    Per-run, per-work-item scratch copies of the project for verification.
+
+    Each work item (dependency::file) gets <root>/<run_id>/<item hash>/ with
+    the full project tree, so imports resolve and neither concurrent runs nor
+    files sharing a basename can overwrite each other. Paths are derived from
+    the run and work item, so a resumed run finds (or rebuilds) the same one.
+    """
+    def __init__(self, root=WORKSPACE_ROOT, stale_after=STALE_WORKSPACE_SECONDS):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._item_locks = {}
+        self.cleanup_stale(stale_after)
+
+    def path(self, run_id, work_item):
+        item = hashlib.sha1(work_item.encode()).hexdigest()[:16]
+        return self.root / (run_id or "adhoc") / item
+
+    def prepare(self, run_id, work_item, project_root="", files=None):
+        """
+        Creates the workspace from project_root if it does not exist yet, then
+        writes `files` ({relative path: content}) into it. Returns its path.
+        """
+        workspace = self.path(run_id, work_item)
+        with self._lock:
+            lock = self._item_locks.setdefault(workspace, threading.Lock())
+        with lock:
+            if not workspace.exists():
+                staging = workspace.with_name(workspace.name + ".tmp")
+                shutil.rmtree(staging, ignore_errors=True)
+                if project_root and Path(project_root).is_dir():
+                    shutil.copytree(project_root, staging, ignore=_ignore, copy_function=_link_or_copy, symlinks=True)
+                else:
+                    staging.mkdir(parents=True)
+                staging.rename(workspace)
+            for rel_path, content in (files or {}).items():
+                target = workspace / rel_path
+                target.parent.mkdir(parents=True, exist_ok=True)
+                # Unlink first so a hardlinked original in the project is never modified
+                if target.exists() or target.is_symlink():
+                    target.unlink()
+                target.write_text(content, encoding="utf-8")
+        return workspace
+
+    def cleanup_run(self, run_id):
+        shutil.rmtree(self.root / (run_id or "adhoc"), ignore_errors=True)
+        with self._lock:
+            prefix = self.root / (run_id or "adhoc")
+            for key in [k for k in self._item_locks if k.parent == prefix]:
+                del self._item_locks[key]
+
+    def cleanup_stale(self, max_age):
+        cutoff = time.time() - max_age
+        for run_dir in self.root.iterdir():
+            try:
+                if run_dir.stat().st_mtime < cutoff:
+                    shutil.rmtree(run_dir, ignore_errors=True)
+            except OSError:
+                continue
+
+
+def relative_entry(file_path, project_root=""):
+    """Path of a project file relative to the project root (its basename when outside it)."""
+    path = Path(file_path)
+    if project_root:
+        try:
+            return path.resolve().relative_to(Path(project_root).resolve()).as_posix()
+        except ValueError:
+            pass
+    return path.name
+
+
+_workspaces = None
+_workspaces_lock = threading.Lock()
+
+
+def get_workspaces():
+    global _workspaces
+    with _workspaces_lock:
+        if _workspaces is None:
+            _workspaces = WorkspaceManager()
+    return _workspaces
@@ -1,5 +1,6 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form , Query
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form , Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from typing import List
 import uuid
 import shutil
@@ -18,6 +19,19 @@ from Graph import *
 import difflib
 from RAGs.ProjectIngestion import ProjectIngestor
 from RAGs.target_discovery import TargetDiscovery
+from run_events import current_run_id, event_bus
+from jobs import job_queue, JobCancelled, ACTIVE_STATUSES, PRIORITY_HIGH, PRIORITY_NORMAL, WORKER_ID
+from run_store import create_run_store
+from RAGs.sandbox import get_sandbox
+from RAGs.workspace import get_workspaces
+from RAGs.archive_extractor import ArchiveLimitExceeded, archive_kind, archive_root
+from clone_service import get_clone_service
+from telemetry import telemetry
+import asyncio
+import json
+import queue
+import tarfile
+import zipfile
 
 SECRET_KEY = SECRET_KEY
 ALGORITHM = "HS256"
@@ -135,7 +149,26 @@ UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 REPOS_DIR = "repos"
 os.makedirs(REPOS_DIR, exist_ok=True)
-runs = {}
+# Run state and job records live in the store (see run_store for the backends),
+# so any API worker can admit, inspect or cancel a run. Each run executes on
+# the worker that claimed it; only that worker can stream its events.
+runs = create_run_store(state_cls=InputState)
+job_queue.on_update = lambda job: runs.set_run_info(job.run_id, job.to_dict())
+job_queue.claim = lambda job: runs.claim_job(job.run_id, job.to_dict())
+
+def cancel_requested(job):
+    info = runs.get_run_info(job.run_id)
+    # A job whose claim was taken over (see JOB_CLAIM_TTL) stops as well
+    return bool(info.get("cancel_requested")) or info.get("job_id") != job.job_id
+
+job_queue.cancel_requested = cancel_requested
+
+def active_elsewhere(run_id):
+    """True while the run's job is queued or running on another API worker."""
+    if job_queue.get(run_id) is not None:
+        return False
+    info = runs.get_run_info(run_id)
+    return info.get("status") in ACTIVE_STATUSES and info.get("worker") != WORKER_ID
 
 @app.get("/config/inputs", response_model=ConfigResponse)
 async def get_input_config():
@@ -187,6 +220,22 @@ def run():
         message=f"Analysis run {run_id} created."
     )
 
+def ingest_upload(source, filename, dest):
+    """
+    Unpacks an uploaded archive straight into ingestion: only supported files
+    are written, and their imports land in the manifest so the overview's
+    walk reuses them instead of rescanning. Returns the code file count.
+    """
+    if os.path.exists(dest):
+        shutil.rmtree(dest)
+    ingestor = ProjectIngestor()
+    try:
+        code_files, _, _ = ingestor.detect_dependencies(ingestor.iter_archive(source, filename, dest))
+    except BaseException:
+        shutil.rmtree(dest, ignore_errors=True)
+        raise
+    return len(code_files)
+
 @app.post("/upload", response_model=AnalysisResponse)
 async def upload_file(file: UploadFile = File(...), run_id: str = Form(None)):
     if run_id is None:
@@ -204,19 +253,29 @@ async def upload_file(file: UploadFile = File(...), run_id: str = Form(None)):
             "trace": ""
         }
     try:
-        if not file.filename.endswith(('.zip', '.tar.gz')):
+        if archive_kind(file.filename) is None:
              raise HTTPException(status_code=400, detail="Invalid file format. Please upload a ZIP or TAR.GZ file.")
 
-        file_location = f"{UPLOAD_DIR}/{run_id}_{file.filename}"
-        with open(file_location, "wb+") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        runs[run_id]["filename"] = file.filename
-        runs[run_id]["status"] = "uploaded"
+        project_path = os.path.join(UPLOAD_DIR, f"{run_id}_{archive_root(os.path.basename(file.filename))}")
+        try:
+            file_count = await asyncio.to_thread(ingest_upload, file.file, file.filename, project_path)
+        except ArchiveLimitExceeded as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except (zipfile.BadZipFile, tarfile.TarError) as e:
+            raise HTTPException(status_code=400, detail=f"Could not read archive: {e}")
+        run_data = runs[run_id]
+        if isinstance(run_data, dict):
+            run_data["filename"] = file.filename
+            run_data["upload_path"] = project_path
+            run_data["status"] = "uploaded"
+            runs[run_id] = run_data
         return AnalysisResponse(
             run_id=run_id,
             status="uploaded",
-            message=f"File {file.filename} uploaded successfully. Analysis run {run_id} created."
+            message=f"File {file.filename} uploaded successfully ({file_count} code files). Analysis run {run_id} created."
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -252,10 +311,12 @@ async def analyze_github(url: str = Form(...), depth: str = Form("Quick Scan"),
         repo_name = "unknown_repo"
     target_dir = os.path.join(REPOS_DIR, f"{run_id}_{repo_name}")
     try:
-        subprocess.run(["git", "clone", url, target_dir], check=True, capture_output=True)
-        runs[run_id]["gitlink"] = url
-        runs[run_id]["depth"] = depth
-        runs[run_id]["status"] = "queued"
+        await get_clone_service().checkout_async(url, target_dir)
+        run_data = runs[run_id]
+        run_data["gitlink"] = url
+        run_data["depth"] = depth
+        run_data["status"] = "queued"
+        runs[run_id] = run_data
         return AnalysisResponse(
             run_id=run_id,
             status="queued",
@@ -263,6 +324,8 @@ async def analyze_github(url: str = Form(...), depth: str = Form("Quick Scan"),
         )
     except subprocess.CalledProcessError as e:
          raise HTTPException(status_code=400, detail=f"Failed to clone repository: {e.stderr.decode() if e.stderr else str(e)}")
+    except subprocess.TimeoutExpired:
+         raise HTTPException(status_code=504, detail=f"Cloning {url} timed out.")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
@@ -350,10 +413,13 @@ def get_overview(run_id: str, instruction: str = Form(None), User = Depends(get_
         if isinstance(run_data, dict):
             git_url = run_data.get("gitlink", "")
             current_topics = run_data.get("topics", "")
+            upload_path = run_data.get("upload_path", "")
         else:
             git_url = run_data.git_link
             current_topics = run_data.topics
+            upload_path = "" if git_url else run_data.project_root
 
+        repo_path = ""
         code_files = []
         dependencies = {}
         dependencies_in_code_files = {}
@@ -381,13 +447,19 @@ def get_overview(run_id: str, instruction: str = Form(None), User = Depends(get_
             
             if not os.path.exists(repo_path):
                     try:
-                        subprocess.run(["git", "clone", git_url, repo_path], check=True)
+                        get_clone_service().checkout(git_url, repo_path)
                     except Exception as e:
                         print(f"Error cloning repo: {e}")
 
+        elif upload_path:
+            # Unpacked (and its imports scanned) when it was uploaded
+            repo_path = upload_path
+
+        if repo_path:
             ingestor = ProjectIngestor()
-            ingestor.ingest_directory_recursive(repo_path)
-            code_files, dependencies , dependencies_in_code_files = ingestor.detect_dependencies()
+            code_files, dependencies , dependencies_in_code_files = ingestor.detect_dependencies(
+                ingestor.iter_directory(repo_path)
+            )
             
             target_discovery = TargetDiscovery(ingestor)
             targets = target_discovery.discover(dependencies)
@@ -426,6 +498,7 @@ def get_overview(run_id: str, instruction: str = Form(None), User = Depends(get_
                 install_preset="",
                 run_profile="",
                 run_args={},
+                project_root=repo_path,
                 code_files=code_files,
                 dependencies=dependencies,
                 dependencies_in_code_files=dependencies_in_code_files,
@@ -441,26 +514,169 @@ def get_overview(run_id: str, instruction: str = Form(None), User = Depends(get_
         print(f"CRITICAL ERROR in get_overview: {e}")
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
 
-@app.post("/run/{run_id}/generate_migration_plan")
-def generate_migration_plan(run_id: str):
-    try:
-        if run_id not in runs:
-            raise HTTPException(status_code=404, detail="Run ID not found")
-        run_data = runs[run_id]
-        
-        if isinstance(run_data, dict):
-             raise HTTPException(status_code=500, detail="Invalid run state: Data is dict, expected InputState")
-        
-        state = run_data
+def execute_run(job, resume=False):
+    """
+    Runs the migration graph for a queued job, recording per-node progress.
+    With resume=True it continues from the run's last checkpoint instead.
+    """
+    run_id = job.run_id
+    if resume:
+        snapshot = graph.get_state(run_config(run_id))
+        graph_input, config = None, run_config(run_id, InputState(**snapshot.values))
+        print(f"Resuming graph for run {run_id} at {list(snapshot.next)}")
+    else:
+        graph_input = runs[run_id]
+        config = run_config(run_id, graph_input)
         print(f"Invoking graph for run {run_id}")
-        result = graph.invoke(state)
-        runs[run_id] = result
-        return result
+    token = current_run_id.set(run_id)
+    event_bus.publish(run_id, {"type": "status", "status": "running"})
+    values = None
+    try:
+        steps = 0
+        for mode, chunk in graph.stream(graph_input, config, stream_mode=["updates", "values"]):
+            if mode == "values":
+                values = chunk
+                continue
+            steps += 1
+            node = next(iter(chunk), "")
+            job.set_progress(node=node, steps=steps)
+            event_bus.publish(run_id, {"type": "node", "node": node, "steps": steps})
+            job.check_cancelled()
+        if values is not None:
+            runs[run_id] = InputState(**values)
+        # Nothing left to resume once the run has finished
+        graph.checkpointer.delete_thread(run_id)
+        event_bus.publish(run_id, {"type": "end", "status": "completed"})
+    except JobCancelled:
+        if values is not None:
+            runs[run_id] = InputState(**values)
+        event_bus.publish(run_id, {"type": "end", "status": "cancelled"})
+        raise
     except Exception as e:
+        # Keep the progress made so far; POST /run/{run_id}/resume picks up from the checkpoint
+        if values is not None:
+            runs[run_id] = InputState(**values)
+        event_bus.publish(run_id, {"type": "end", "status": "failed", "detail": str(e)})
         print(f"CRITICAL ERROR in generate_migration_plan: {e}")
-        import traceback
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"Plan generation failed: {str(e)}")
+        raise
+    finally:
+        # Warm verification containers and workspaces belong to the run; base images stay cached
+        get_sandbox().release_run(run_id)
+        get_workspaces().cleanup_run(run_id)
+        # Persisted so any API worker can serve the breakdown, not only the one that ran it
+        timings = telemetry.run_summary(run_id, include_spans=False)
+        if timings:
+            runs.set_run_info(run_id, {"timings": timings})
+        if not checkpoints_persistent(graph.checkpointer):
+            # In-memory checkpoints would otherwise pile up for every run the process has seen
+            graph.checkpointer.delete_thread(run_id)
+        current_run_id.reset(token)
+
+def submit_run(run_id, user, resume=False):
+    run_data = runs[run_id]
+    if isinstance(run_data, dict):
+         raise HTTPException(status_code=500, detail="Invalid run state: Data is dict, expected InputState")
+
+    high = user is not None or run_data.is_authenticated or get_run_attr(run_data, "depth") == "Deep Research"
+    priority = PRIORITY_HIGH if high else PRIORITY_NORMAL
+    try:
+        job = job_queue.submit(run_id, lambda job: execute_run(job, resume=resume), priority=priority)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {**job.to_dict(), "queue_position": job_queue.position(run_id)}
+
+@app.post("/run/{run_id}/generate_migration_plan")
+def generate_migration_plan(run_id: str, User = Depends(get_current_user_optional)):
+    if run_id not in runs:
+        raise HTTPException(status_code=404, detail="Run ID not found")
+    return submit_run(run_id, User)
+
+@app.post("/run/{run_id}/resume")
+def resume_run(run_id: str, User = Depends(get_current_user_optional)):
+    """Continues a failed or cancelled run from its last completed node."""
+    if run_id not in runs:
+        raise HTTPException(status_code=404, detail="Run ID not found")
+    if not graph.get_state(run_config(run_id)).next:
+        detail = "Run has no interrupted checkpoint to resume from"
+        if not checkpoints_persistent(graph.checkpointer):
+            detail += " (checkpoints are in memory and dropped when a run ends; install langgraph-checkpoint-sqlite)"
+        raise HTTPException(status_code=409, detail=detail)
+    return submit_run(run_id, User, resume=True)
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus text exposition of this worker's latency histograms and counters."""
+    return PlainTextResponse(telemetry.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get("/run/{run_id}/status")
+def get_run_status(run_id: str):
+    if run_id not in runs:
+        raise HTTPException(status_code=404, detail="Run ID not found")
+    job = job_queue.get(run_id)
+    if job is None:
+        # The job may belong to another API worker; use the persisted copy
+        info = runs.get_run_info(run_id)
+        if info:
+            return info
+        return {"run_id": run_id, "status": get_run_attr(runs[run_id], "status", "ready") or "ready", "progress": {}}
+    return {**job.to_dict(), "queue_position": job_queue.position(run_id)}
+
+@app.post("/run/{run_id}/cancel")
+def cancel_run(run_id: str):
+    if run_id not in runs:
+        raise HTTPException(status_code=404, detail="Run ID not found")
+    job = job_queue.get(run_id)
+    if job_queue.cancel(run_id):
+        # The worker drops the job from the queue once it has finished
+        return job.to_dict()
+    # Queued or running on another API worker, which polls the flag between steps
+    info = runs.request_cancel(run_id)
+    if info is None:
+        raise HTTPException(status_code=409, detail="Run has no active job to cancel")
+    return info
+
+@app.get("/run/{run_id}/stream")
+async def stream_run(run_id: str, request: Request, current_user: User = Depends(get_current_user_optional)):
+    """
+    Server-Sent Events feed of a run: LLM tokens as they are generated plus
+    status events. Open it before (or while) generate_migration_plan runs.
+    """
+    if run_id not in runs:
+        raise HTTPException(status_code=404, detail="Run ID not found")
+    if get_run_attr(runs[run_id], "depth") == "Deep Research" and not current_user:
+        raise HTTPException(401, "Login required for deep research")
+    if active_elsewhere(run_id):
+        # Events are published in the process executing the run
+        raise HTTPException(status_code=503, detail="Run is executing on another API worker; reconnect to reach it")
+    listener = event_bus.subscribe(run_id)
+
+    async def event_source():
+        try:
+            yield f"data: {json.dumps({'type': 'status', 'status': 'subscribed'})}\n\n"
+            while True:
+                if await request.is_disconnected():
+                    break
+                try:
+                    event = await asyncio.to_thread(listener.get, True, 1.0)
+                except queue.Empty:
+                    if await asyncio.to_thread(active_elsewhere, run_id):
+                        # Submitted after we subscribed and picked up by another worker
+                        yield f"data: {json.dumps({'type': 'end', 'status': 'unavailable', 'detail': 'Run is executing on another API worker'})}\n\n"
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"data: {json.dumps(event)}\n\n"
+                if event.get("type") == "end":
+                    break
+        finally:
+            event_bus.unsubscribe(run_id, listener)
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 def get_run_attr(run_state, attr_name, default=None):
     if isinstance(run_state, dict):
         return run_state.get(attr_name, default)
@@ -509,6 +725,7 @@ def get_changes(run_id: str,current_user: User = Depends(get_current_user_option
         
     gen_code = get_run_attr(run_state, "generated_code") or {}
     ini_code = get_run_attr(run_state, "code") or {}
+    gen_diffs = get_run_attr(run_state, "generated_diffs") or {}
     
     # Fallback if names mismatch in InputState
     if not ini_code:
@@ -518,6 +735,9 @@ def get_changes(run_id: str,current_user: User = Depends(get_current_user_option
     for u,v in ini_code.items():
         if not gen_code.get(u):
             changed_code[u] = "No changes"
+        elif gen_diffs.get(u):
+            # Rendered from the applied edits when the patch was made
+            changed_code[u] = gen_diffs[u]
         else:
             i_code = v.splitlines()
             g_code = gen_code.get(u).splitlines()
@@ -569,6 +789,9 @@ def get_trace(run_id: str,current_user: User = Depends(get_current_user_optional
             return "Completed"
         else:
             return errors
+    elif req.action == "Timing":
+        # Spans are only held by the worker that ran the graph; others serve the persisted summary
+        return telemetry.run_summary(run_id) or runs.get_run_info(run_id).get("timings", {})
     ##this is used to trace the working of the langgraph
 
 
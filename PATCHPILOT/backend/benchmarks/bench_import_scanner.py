@@ -0,0 +1,159 @@
+"""
+Benchmark for the import scan behind ProjectIngestor.detect_dependencies.
+
+Generates a synthetic project (50k files by default: Python, JS, Java and Go
+with realistic import headers and bodies) and compares the previous
+line-by-line regex scan against the single-pass scanner, then times the full
+walk + detect_dependencies pipeline with a cold and then a warm manifest.
+
+"file links" counts (dependency, file) entries. The old scan listed a file
+once per matching line and missed Go import blocks; the new one lists each
+file once per dependency. The Python rows compare the line scan with the ast
+extractor on the Python files alone; in the pipeline their imports are
+resolved to distributions with stdlib modules dropped, so it links fewer.
+
+Run from the backend directory:
+    python benchmarks/bench_import_scanner.py [file_count]
+"""
+import contextlib
+import io
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from RAGs import ingest_manifest
+from RAGs.ProjectIngestion import ProjectIngestor
+from RAGs.import_scanner import scan_file
+from RAGs.python_imports import parse_batch
+
+FILE_COUNT = 50_000
+BODY_LINES = 120
+PY_LIBS = ["os", "sys", "json", "requests", "numpy", "pandas", "flask", "django.db", "pydantic", "sqlalchemy"]
+JS_LIBS = ["react", "express", "lodash", "axios", "./utils", "../lib/api"]
+JAVA_LIBS = ["java.util.List", "java.io.File", "org.springframework.boot.SpringApplication", "com.google.gson.Gson"]
+GO_LIBS = ["fmt", "net/http", "github.com/gin-gonic/gin", "github.com/stretchr/testify/assert"]
+
+# The scan as it was before: one regex per stripped line, every match recorded
+LEGACY_PATTERNS = {
+    "python": re.compile(r'^\s*(?:import|from)\s+([a-zA-Z_][\w.]*)', re.IGNORECASE),
+    "node": re.compile(r'(?:from\s+[\'"]([^\'"]+)[\'"])|(?:require\s*\(\s*[\'"]([^\'"]+)[\'"])', re.IGNORECASE),
+    "java": re.compile(r'^\s*import\s+([a-zA-Z_][\w.]*);', re.IGNORECASE),
+    "go": re.compile(r'^\s*import\s+[\'"]([^\'"]+)[\'"]', re.IGNORECASE),
+}
+
+
+def legacy_scan(path, lang):
+    found = []
+    pattern = LEGACY_PATTERNS[lang]
+    for line in Path(path).read_text(errors="ignore").splitlines():
+        match = pattern.search(line.strip())
+        if match:
+            dep = next((g for g in match.groups() if g is not None), None)
+            if dep:
+                found.append(dep)
+    return found
+
+
+def python_file(rng):
+    libs = rng.sample(PY_LIBS, 4)
+    head = [f"import {lib}" if rng.random() < 0.5 else f"from {lib} import thing" for lib in libs]
+    body = [f"    value_{i} = compute({i})  # import-free body line" for i in range(BODY_LINES)]
+    # Repeated local imports are what used to list a file several times
+    body.insert(BODY_LINES // 2, f"    import {libs[0]}")
+    return "\n".join(head + ["", "def main():"] + body) + "\n"
+
+
+def js_file(rng):
+    libs = rng.sample(JS_LIBS, 3)
+    head = [f"const m{i} = require('{lib}');" if i % 2 else f"import m{i} from '{lib}';" for i, lib in enumerate(libs)]
+    body = [f"function f{i}() {{ return m0.call({i}); }}" for i in range(BODY_LINES)]
+    return "\n".join(head + body) + "\n"
+
+
+def java_file(rng):
+    libs = rng.sample(JAVA_LIBS, 3)
+    head = ["package com.example.app;", ""] + [f"import {lib};" for lib in libs]
+    body = [f"    int field{i} = {i};" for i in range(BODY_LINES)]
+    return "\n".join(head + ["", "public class Main {"] + body + ["}"]) + "\n"
+
+
+def go_file(rng):
+    libs = rng.sample(GO_LIBS, 3)
+    head = ["package main", "", "import ("] + [f'\t"{lib}"' for lib in libs] + [")"]
+    body = [f"\tx{i} := {i}" for i in range(BODY_LINES)]
+    return "\n".join(head + ["", "func main() {"] + body + ["}"]) + "\n"
+
+
+GENERATORS = [("py", "python", python_file), ("js", "node", js_file), ("java", "java", java_file), ("go", "go", go_file)]
+
+
+def build_tree(root, count):
+    rng = random.Random(42)
+    files = []
+    for i in range(count):
+        ext, lang, make = GENERATORS[i % len(GENERATORS)]
+        directory = root / f"pkg{i % 200}" / f"mod{i % 7}"
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"file{i}.{ext}"
+        path.write_text(make(rng))
+        files.append((str(path), lang))
+    (root / "node_modules" / "left-pad").mkdir(parents=True)
+    (root / "node_modules" / "left-pad" / "index.js").write_text("module.exports = 1;\n")
+    return files
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def run_pipeline():
+    ingestor = ProjectIngestor()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = ingestor.detect_dependencies(ingestor.iter_directory(ROOT))
+    return ingestor, result
+
+
+def main():
+    global ROOT
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else FILE_COUNT
+    workdir = Path(tempfile.mkdtemp(prefix="patchpilot-bench-"))
+    ROOT = workdir / "project"
+    try:
+        elapsed, files = timed(lambda: build_tree(ROOT, count))
+        print(f"Generated {len(files)} files in {elapsed:.1f}s")
+
+        legacy_time, legacy = timed(lambda: [legacy_scan(path, lang) for path, lang in files])
+        scanner_time, scanned = timed(lambda: [scan_file(path, lang) for path, lang in files])
+        legacy_links = sum(len(found) for found in legacy)
+        scanner_links = sum(len(found) for found in scanned)
+        print(f"{'scan':<26}{'seconds':>10}{'files/s':>12}{'file links':>12}")
+        print(f"{'line-by-line (before)':<26}{legacy_time:>10.2f}{len(files) / legacy_time:>12.0f}{legacy_links:>12}")
+        print(f"{'single-pass scanner':<26}{scanner_time:>10.2f}{len(files) / scanner_time:>12.0f}{scanner_links:>12}")
+
+        python_files = [path for path, lang in files if lang == "python"]
+        line_time, lines = timed(lambda: [scan_file(path, "python") for path in python_files])
+        ast_time, parsed = timed(lambda: parse_batch([(path, None) for path in python_files]))
+        print(f"{'python, line scan':<26}{line_time:>10.2f}{len(python_files) / line_time:>12.0f}"
+              f"{sum(len(found) for found in lines):>12}")
+        print(f"{'python, ast (1 process)':<26}{ast_time:>10.2f}{len(python_files) / ast_time:>12.0f}"
+              f"{sum(len(imports) for _, imports in parsed):>12}")
+
+        ingest_manifest._manifest = ingest_manifest.IngestionManifest(workdir / "manifest.sqlite3")
+        for label in ("pipeline, cold manifest", "pipeline, warm manifest"):
+            elapsed, (ingestor, (code_files, counts, index)) = timed(run_pipeline)
+            print(f"{label:<26}{elapsed:>10.2f}{len(code_files) / elapsed:>12.0f}"
+                  f"{sum(len(v) for v in index.values()):>12}   {ingestor.stats}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
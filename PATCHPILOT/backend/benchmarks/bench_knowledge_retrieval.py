@@ -0,0 +1,100 @@
+"""
+Benchmark for KnowledgeRetriever.search (the Knowledge node).
+
+Starts a local stub server that answers both search requests and page
+fetches with artificial latency, then compares wall time of the old
+one-at-a-time behaviour (a single worker) against the concurrent pool
+for an increasing number of queries.
+
+Run from the backend directory:
+    python benchmarks/bench_knowledge_retrieval.py
+"""
+import json
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs, quote
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from RAGs.KnowledgeRetrieval import KnowledgeRetriever
+
+SEARCH_LATENCY = 0.3
+PAGE_LATENCY = 0.2
+LLM_LATENCY = 0.2
+QUERY_COUNTS = [1, 2, 4, 8, 16]
+
+PAGE_BODY = "<html><body>" + "<p>" + " ".join(["migration guide breaking change"] * 20) + "</p>" + "</body></html>"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        if parsed.path == "/search":
+            time.sleep(SEARCH_LATENCY)
+            q = parse_qs(parsed.query).get("q", [""])[0]
+            host, port = self.server.server_address
+            body = json.dumps({"results": [{
+                "title": q,
+                "url": f"http://{host}:{port}/page/{quote(q)}",
+                "content": q,
+                "score": 1.0,
+            }]}).encode()
+            content_type = "application/json"
+        else:
+            time.sleep(PAGE_LATENCY)
+            body = PAGE_BODY.encode()
+            content_type = "text/html"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubSearchClient:
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    def search(self, query, max_results=1):
+        with urllib.request.urlopen(f"{self.base_url}/search?q={quote(query)}") as resp:
+            return json.loads(resp.read())
+
+
+class StubRetriever(KnowledgeRetriever):
+    def priority_assignment(self, url):
+        # Stands in for the LLM authority classifier.
+        time.sleep(LLM_LATENCY)
+        return "Medium"
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    client = StubSearchClient(f"http://{host}:{port}")
+
+    print(f"{'queries':>8} {'sequential (s)':>15} {'concurrent (s)':>15} {'speedup':>8}")
+    for n in QUERY_COUNTS:
+        queries = [f"pydantic migration query {i}" for i in range(n)]
+        timings = []
+        for workers, host_limit in ((1, 1), (8, 8)):
+            retriever = StubRetriever(search_client=client, max_workers=workers,
+                                       per_host_limit=host_limit, use_cache=False)
+            start = time.perf_counter()
+            docs = retriever.search(queries)
+            timings.append(time.perf_counter() - start)
+            assert len(docs) == n, f"expected {n} documents, got {len(docs)}"
+        print(f"{n:>8} {timings[0]:>15.2f} {timings[1]:>15.2f} {timings[0] / timings[1]:>7.1f}x")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
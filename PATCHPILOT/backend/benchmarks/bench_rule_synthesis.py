@@ -0,0 +1,58 @@
+"""
+Benchmark for RuleSynthesizer.rules_synthesis.
+
+Swaps the LLM client for a mock with artificial per-call latency and compares
+serial synthesis (concurrency=1) against the parallel mode.
+
+Run from the backend directory:
+    python benchmarks/bench_rule_synthesis.py
+"""
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from model_utils import ChatCompletion, Choice, Message
+from RAGs.RuleSynthesis import RuleSynthesizer
+
+LLM_LATENCY = 0.5
+DOC_COUNTS = [1, 4, 8, 12]
+CONCURRENCY_LEVELS = [1, 2, 4, 8]
+
+
+@dataclass
+class MockCompletions:
+    latency: float
+
+    def create(self, messages, max_tokens=None, temperature=None, **kwargs):
+        time.sleep(self.latency)
+        content = '{"rules": [{"rule_id": "mock", "rule_text": "mock rule", "priority": "LOW"}]}'
+        return ChatCompletion(choices=[Choice(message=Message(role="assistant", content=content))])
+
+
+class MockClient:
+    def __init__(self, latency):
+        self.chat = type("Chat", (), {"completions": MockCompletions(latency)})()
+
+
+def main():
+    header = f"{'docs':>6}" + "".join(f"{'c=' + str(c):>10}" for c in CONCURRENCY_LEVELS)
+    print(header + "   (seconds)")
+    for n in DOC_COUNTS:
+        docs = [{"url": f"https://docs.example.com/{i}", "chunk": "text"} for i in range(n)]
+        row = f"{n:>6}"
+        for concurrency in CONCURRENCY_LEVELS:
+            synthesizer = RuleSynthesizer(concurrency=concurrency)
+            synthesizer.client_guide = MockClient(LLM_LATENCY)
+            start = time.perf_counter()
+            rules = synthesizer.rules_synthesis(docs)
+            elapsed = time.perf_counter() - start
+            assert len(rules) == n
+            row += f"{elapsed:>10.2f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
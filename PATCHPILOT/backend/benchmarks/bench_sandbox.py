@@ -0,0 +1,132 @@
+"""
+Benchmark for VerificationSandbox.verify (the Reflection node's Docker check).
+
+Runs against a fake docker CLI (PATCHPILOT_DOCKER_BIN) written to a temp dir:
+containers are plain directories, `docker exec` runs the command locally
+with container paths mapped into them, and starting a container sleeps for
+START_LATENCY. Compares a fresh container per verification against warm
+containers reused across work items, and checks that no work item sees the
+files of the one verified before it in the same container.
+
+Run from the backend directory:
+    python benchmarks/bench_sandbox.py [work_items]
+"""
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import textwrap
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from RAGs.sandbox import SANDBOX_WORKDIR, VerificationSandbox
+
+WORK_ITEMS = 20
+START_LATENCY = 0.3
+
+FAKE_DOCKER = textwrap.dedent('''\
+    #!{python}
+    import os, shutil, subprocess, sys, time
+    ROOT = {root!r}
+
+    def host(path, name):
+        return os.path.join(ROOT, name, path.lstrip("/")) if path.startswith("/") else path
+
+    args = sys.argv[1:]
+    if args[0] in ("build", "image"):
+        sys.exit(0)
+    if args[0] == "run":
+        name = args[args.index("--name") + 1]
+        time.sleep({latency})
+        os.makedirs(host({workdir!r}, name), exist_ok=True)
+        print(name)
+    elif args[0] == "rm":
+        for name in args[2:]:
+            shutil.rmtree(os.path.join(ROOT, name), ignore_errors=True)
+    elif args[0] == "cp":
+        name, dest = args[2].split(":", 1)
+        shutil.copytree(args[1], host(dest, name), dirs_exist_ok=True)
+    elif args[0] == "exec":
+        args, cwd, env = args[1:], None, dict(os.environ)
+        while args[0] in ("-w", "-e"):
+            if args[0] == "-w":
+                cwd = args[1]
+            else:
+                key, value = args[1].split("=", 1)
+                env[key] = value
+            args = args[2:]
+        name, cmd = args[0], args[1:]
+        env = {{k: host(v, name) if k == "PYTHONPATH" else v for k, v in env.items()}}
+        cmd = [host(part, name) if part.startswith({workdir!r}) else part for part in cmd]
+        cwd = host(cwd, name) if cwd else None
+        sys.exit(subprocess.run(cmd, cwd=cwd, env=env).returncode)
+''')
+
+# Fails when a previous work item's file is still around, then leaves its own behind
+ENTRY = textwrap.dedent('''\
+    import glob, sys
+    if glob.glob("item_*.txt"):
+        sys.exit("stale files from an earlier work item: " + ", ".join(glob.glob("item_*.txt")))
+    open("item_{item}.txt", "w").write("{item}")
+''')
+
+
+def write_fake_docker(directory):
+    root = directory / "containers"
+    root.mkdir()
+    path = directory / "docker"
+    path.write_text(FAKE_DOCKER.format(
+        python=sys.executable, root=str(root), latency=START_LATENCY, workdir=SANDBOX_WORKDIR
+    ))
+    path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    return path
+
+
+def write_context(directory, item):
+    context = directory / f"context_{item}"
+    context.mkdir()
+    (context / "main.py").write_text(ENTRY.format(item=item))
+    return context
+
+
+def run(sandbox, contexts, warm):
+    spec = {
+        "language": "python", "version": "3.11", "install_preset": "", "base_image": "python:3.11-slim",
+        "install_steps": [], "run_cmd": ["python", "main.py"],
+    }
+    failures = []
+    start = time.perf_counter()
+    for item, context in enumerate(contexts):
+        result = sandbox.verify("bench", spec, context)
+        if not result.ok:
+            failures.append(f"item {item}: {result.output.decode(errors='replace').strip()}")
+        if not warm:
+            sandbox.release_run("bench")
+    sandbox.release_run("bench")
+    return time.perf_counter() - start, failures
+
+
+def main():
+    items = int(sys.argv[1]) if len(sys.argv) > 1 else WORK_ITEMS
+    directory = Path(tempfile.mkdtemp(prefix="bench_sandbox_"))
+    try:
+        docker = write_fake_docker(directory)
+        contexts = [write_context(directory, item) for item in range(items)]
+        print(f"{items} work items, {START_LATENCY}s container start (fake docker at {docker})")
+        print(f"{'mode':<28} {'seconds':>8} {'per item':>9} {'stale':>6}")
+        for label, warm in (("fresh container per item", False), ("warm container reused", True)):
+            seconds, failures = run(VerificationSandbox(docker_bin=str(docker)), contexts, warm)
+            print(f"{label:<28} {seconds:>8.2f} {seconds / items:>9.3f} {len(failures):>6}")
+            for failure in failures[:3]:
+                print(f"    {failure}")
+        leftovers = [p for p in (directory / "containers").rglob("*") if p.is_file()]
+        print(f"files left in removed containers: {len(leftovers)}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
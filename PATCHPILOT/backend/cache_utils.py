@@ -0,0 +1,120 @@
+import sqlite3
+import threading
+import time
+import zlib
+import orjson
+from dataclasses import dataclass, field
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+CACHE_DIR = BASE_DIR / "cache"
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+@dataclass
+class CacheEntry:
+    value: bytes
+    meta: dict = field(default_factory=dict)
+    stored_at: float = 0.0
+    expires_at: float | None = None
+
+    @property
+    def expired(self):
+        return self.expires_at is not None and self.expires_at <= time.time()
+
+
+class DiskCache:
+    """
+    SQLite backed key/value cache with zlib-compressed values, per-entry TTL
+    and size-based LRU eviction. Safe to share between threads.
+    """
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, default_ttl=None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                meta TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                stored_at REAL NOT NULL,
+                expires_at REAL,
+                accessed_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed_at)")
+
+    def get(self, key, include_expired=False):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, meta, stored_at, expires_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        entry = CacheEntry(
+            value=zlib.decompress(row[0]),
+            meta=orjson.loads(row[1]),
+            stored_at=row[2],
+            expires_at=row[3],
+        )
+        if entry.expired and not include_expired:
+            return None
+        return entry
+
+    def set(self, key, value: bytes, meta=None, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        now = time.time()
+        blob = zlib.compress(value)
+        expires_at = now + ttl if ttl else None
+        with self._lock:
+            self._conn.execute(
+                """INSERT INTO entries (key, value, meta, size, stored_at, expires_at, accessed_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(key) DO UPDATE SET
+                       value = excluded.value, meta = excluded.meta, size = excluded.size,
+                       stored_at = excluded.stored_at, expires_at = excluded.expires_at,
+                       accessed_at = excluded.accessed_at""",
+                (key, blob, orjson.dumps(meta or {}).decode(), len(blob), now, expires_at, now),
+            )
+            self._evict()
+
+    def touch(self, key, ttl=None):
+        """Extend an entry's lifetime, e.g. after a successful revalidation."""
+        ttl = self.default_ttl if ttl is None else ttl
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE entries SET stored_at = ?, expires_at = ?, accessed_at = ? WHERE key = ?",
+                (now, now + ttl if ttl else None, now, key),
+            )
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def total_bytes(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT key, size FROM entries ORDER BY accessed_at ASC").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,114 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import subprocess
+import threading
+from pathlib import Path
+from urllib.parse import urlsplit, urlunsplit
+
+from cache_utils import CACHE_DIR
+
+GIT_BIN = os.getenv("PATCHPILOT_GIT_BIN", "git")
+MIRROR_ROOT = Path(os.getenv("PATCHPILOT_GIT_CACHE", CACHE_DIR / "git-mirrors"))
+CLONE_TIMEOUT_SECONDS = int(os.getenv("PATCHPILOT_CLONE_TIMEOUT", "600"))
+# Only the tip commit's trees are fetched; blobs are fetched on checkout and then stay in the mirror
+SHALLOW_ARGS = ("--depth", "1", "--filter=blob:none")
+
+
+def normalize_url(url):
+    """Cache key form of a repo URL: lowercase scheme and host, no trailing slash or .git."""
+    url = url.strip().rstrip("/")
+    if url.endswith(".git"):
+        url = url[:-4]
+    parts = urlsplit(url)
+    if parts.scheme and parts.netloc:
+        url = urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.query, ""))
+    return url
+
+
+class CloneService:
+    """
+    Shallow, cached checkouts of remote repositories.
+
+    Each repo URL has one bare, shallow, blob-filtered mirror under the
+    cache. The first run clones it; later runs update it with a shallow
+    fetch, so a repo analyzed minutes ago costs one round trip. Every run
+    then gets its own detached worktree of the fetched commit, which shares
+    the mirror's object store instead of holding a second copy. Work on
+    different URLs runs concurrently; work on the same URL is serialized.
+    """
+    def __init__(self, root=MIRROR_ROOT, git_bin=GIT_BIN, timeout=CLONE_TIMEOUT_SECONDS):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.git_bin = git_bin
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._url_locks = {}
+
+    def _git(self, *args, cwd=None):
+        # Never wait on a credential prompt for private or mistyped repos
+        env = {**os.environ, "GIT_TERMINAL_PROMPT": "0"}
+        proc = subprocess.run(
+            [self.git_bin, *args], cwd=cwd, env=env, capture_output=True, timeout=self.timeout, check=True
+        )
+        return proc.stdout.decode().strip()
+
+    def mirror_path(self, url):
+        return self.root / (hashlib.sha1(normalize_url(url).encode()).hexdigest()[:16] + ".git")
+
+    def _url_lock(self, url):
+        with self._lock:
+            return self._url_locks.setdefault(normalize_url(url), threading.Lock())
+
+    def _update_mirror(self, url, mirror):
+        """Brings the mirror to the remote's current HEAD and returns that commit."""
+        if not mirror.exists():
+            staging = mirror.with_name(mirror.name + ".tmp")
+            shutil.rmtree(staging, ignore_errors=True)
+            print(f"DEBUG: Creating shallow mirror of {url}")
+            self._git("clone", "--bare", *SHALLOW_ARGS, url, str(staging))
+            staging.rename(mirror)
+            return self._git("rev-parse", "HEAD", cwd=mirror)
+        try:
+            self._git("fetch", *SHALLOW_ARGS, url, "HEAD", cwd=mirror)
+            # HEAD is a symbolic ref, so this moves the default branch and leaves old commits for gc
+            self._git("update-ref", "HEAD", "FETCH_HEAD", cwd=mirror)
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+            stderr = getattr(e, "stderr", b"") or b""
+            print(f"Fetch of {url} failed, using the cached commit: {stderr.decode(errors='replace').strip() or e}")
+        # Worktrees whose directories were deleted would otherwise pin their commits
+        self._git("worktree", "prune", cwd=mirror)
+        return self._git("rev-parse", "HEAD", cwd=mirror)
+
+    def checkout(self, url, dest):
+        """
+        Materializes the latest commit of url at dest as a worktree of the
+        cached mirror and returns dest. An existing dest is left as it is.
+        Raises subprocess.CalledProcessError when git fails.
+        """
+        dest = Path(dest).resolve()
+        if dest.exists():
+            return dest
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        mirror = self.mirror_path(url)
+        with self._url_lock(url):
+            commit = self._update_mirror(url, mirror)
+            self._git("worktree", "add", "--detach", str(dest), commit, cwd=mirror)
+        return dest
+
+    async def checkout_async(self, url, dest):
+        """checkout() on a worker thread, so the event loop keeps serving requests during the clone."""
+        return await asyncio.to_thread(self.checkout, url, dest)
+
+
+_clone_service = None
+_clone_service_lock = threading.Lock()
+
+
+def get_clone_service():
+    global _clone_service
+    with _clone_service_lock:
+        if _clone_service is None:
+            _clone_service = CloneService()
+    return _clone_service
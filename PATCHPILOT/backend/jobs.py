@@ -0,0 +1,229 @@
+import itertools
+import os
+import queue
+import socket
+import threading
+import time
+import traceback
+import contextvars
+from dataclasses import dataclass, field
+from uuid import uuid4
+
+JOB_WORKERS = int(os.getenv("PATCHPILOT_JOB_WORKERS", "2"))
+PRIORITY_HIGH = 0    # authenticated / Deep Research runs
+PRIORITY_NORMAL = 10
+ACTIVE_STATUSES = ("queued", "running")
+# How often a running job asks cancel_hook whether another worker cancelled it
+CANCEL_POLL_SECONDS = float(os.getenv("PATCHPILOT_CANCEL_POLL_SECONDS", "1"))
+# Identifies this API process in persisted job info
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# The job whose fn is executing, so work deep inside it (pool tasks, graph
+# nodes) can stop early without being handed the job.
+current_job = contextvars.ContextVar("current_job", default=None)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def check_cancelled():
+    """Raises JobCancelled if the job running in this context was cancelled; no-op outside a job."""
+    job = current_job.get()
+    if job is not None:
+        job.check_cancelled()
+
+
+@dataclass
+class Job:
+    run_id: str
+    priority: int
+    job_id: str = field(default_factory=lambda: uuid4().hex)
+    status: str = "queued"
+    progress: dict = field(default_factory=dict)
+    error: str = ""
+    submitted_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+    worker: str = WORKER_ID
+    cancel_event: threading.Event = field(default_factory=threading.Event, repr=False)
+    on_update: object = field(default=None, repr=False)
+    cancel_hook: object = field(default=None, repr=False)
+    _polled_at: float = field(default=0.0, repr=False)
+
+    def notify(self):
+        """Runs the update hook; True when the change was handed to one without error."""
+        if self.on_update is None:
+            return False
+        try:
+            self.on_update(self)
+            return True
+        except Exception as e:
+            print(f"Job update hook failed for {self.run_id}: {e}")
+            return False
+
+    def set_progress(self, **progress):
+        self.progress = progress
+        self.notify()
+
+    @property
+    def finished(self):
+        return self.status in ("completed", "failed", "cancelled")
+
+    def cancelled(self):
+        """True once cancelled here or, through cancel_hook, from another API worker."""
+        if self.cancel_event.is_set():
+            return True
+        now = time.monotonic()
+        if self.cancel_hook is not None and now - self._polled_at >= CANCEL_POLL_SECONDS:
+            self._polled_at = now
+            try:
+                if self.cancel_hook(self):
+                    self.cancel_event.set()
+            except Exception as e:
+                print(f"Job cancel hook failed for {self.run_id}: {e}")
+        return self.cancel_event.is_set()
+
+    def check_cancelled(self):
+        """Called by the job between steps; aborts cooperatively."""
+        if self.cancelled():
+            raise JobCancelled(f"Run {self.run_id} was cancelled")
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "run_id": self.run_id,
+            "status": self.status,
+            "priority": self.priority,
+            "worker": self.worker,
+            "progress": self.progress,
+            "error": self.error,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobQueue:
+    """
+    Bounded pool of worker threads fed by a priority queue. Submitting returns
+    immediately; lower priority numbers run first, FIFO within a priority.
+    Finished jobs are dropped once on_update has persisted their final
+    status, so callers fall back to the persisted copy for those.
+
+    With several API workers each has its own queue; the claim and
+    cancel_requested hooks let them share one record per run (see
+    RunStore.claim_job) so a run executes on one worker at a time and can be
+    cancelled from any of them.
+    """
+    def __init__(self, workers=JOB_WORKERS):
+        self.workers = max(1, workers)
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        # Called with the job on every status/progress change (e.g. to persist it)
+        self.on_update = None
+        # Called with a new job before it is queued; False when the run is active elsewhere
+        self.claim = None
+        # Polled with a queued or running job; True when it was cancelled elsewhere
+        self.cancel_requested = None
+
+    def _ensure_workers(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"patchpilot-job-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, run_id, fn, priority=PRIORITY_NORMAL):
+        """Queue fn(job) for run_id. Raises ValueError if the run already has an active job."""
+        with self._lock:
+            current = self._jobs.get(run_id)
+            if current and not current.finished:
+                raise ValueError(f"Run {run_id} already has an active job ({current.status})")
+            job = Job(run_id=run_id, priority=priority, on_update=self.on_update,
+                      cancel_hook=self.cancel_requested)
+            self._jobs[run_id] = job
+        claimed = False
+        try:
+            claimed = self.claim is None or self.claim(job)
+        finally:
+            if not claimed:
+                self._evict(job)
+        if not claimed:
+            raise ValueError(f"Run {run_id} already has an active job on another worker")
+        job.notify()
+        self._queue.put((priority, next(self._counter), job, contextvars.copy_context(), fn))
+        self._ensure_workers()
+        return job
+
+    def get(self, run_id):
+        with self._lock:
+            return self._jobs.get(run_id)
+
+    def cancel(self, run_id):
+        job = self.get(run_id)
+        if not job or job.finished:
+            return False
+        job.cancel_event.set()
+        if job.status == "queued":
+            # Never started: the worker will skip it when dequeued
+            job.status = "cancelled"
+            job.finished_at = time.time()
+        job.notify()
+        return True
+
+    def position(self, run_id):
+        """Number of queued jobs ahead of this run (0 when running or finished)."""
+        job = self.get(run_id)
+        if not job or job.status != "queued":
+            return 0
+        with self._lock:
+            return sum(
+                1 for other in self._jobs.values()
+                if other.status == "queued" and (other.priority, other.submitted_at) < (job.priority, job.submitted_at)
+            )
+
+    def _worker(self):
+        while True:
+            _, _, job, ctx, fn = self._queue.get()
+            try:
+                if job.cancelled():
+                    job.status = "cancelled"
+                    continue
+                job.status = "running"
+                job.started_at = time.time()
+                job.notify()
+                ctx.run(self._run, job, fn)
+                job.status = "completed"
+            except JobCancelled:
+                job.status = "cancelled"
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+                traceback.print_exc()
+            finally:
+                if job.finished_at is None:
+                    job.finished_at = time.time()
+                if job.notify():
+                    self._evict(job)
+                self._queue.task_done()
+
+    @staticmethod
+    def _run(job, fn):
+        # Runs inside the submitter's copied context, so the value reaches pool tasks that copy it
+        current_job.set(job)
+        fn(job)
+
+    def _evict(self, job):
+        with self._lock:
+            # A resubmitted run has replaced it already
+            if self._jobs.get(job.run_id) is job:
+                del self._jobs[job.run_id]
+
+
+job_queue = JobQueue()
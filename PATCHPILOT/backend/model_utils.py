@@ -1,13 +1,66 @@
 import os
+import asyncio
 import requests
+from requests.adapters import HTTPAdapter
 import json
+import hashlib
+import threading
+from collections import OrderedDict
 from dataclasses import dataclass
+from cache_utils import DiskCache, CACHE_DIR
+from run_events import current_run_id, event_bus
+from telemetry import telemetry
 
 # Configuration
 USE_OLLAMA = True
 OLLAMA_BASE_URL = "http://localhost:11434/api/chat"
 MODEL_NAME = "llama3.2"  # Ensure this model is pulled in Ollama: `ollama pull llama3.2`
 
+# Response cache: only near-deterministic calls are cached unless asked otherwise
+LLM_CACHE_ENABLED = os.getenv("PATCHPILOT_LLM_CACHE", "1") != "0"
+LLM_CACHE_MAX_TEMPERATURE = 0.1
+LLM_CACHE_MEMORY_ENTRIES = 512
+LLM_CACHE_MAX_BYTES = 128 * 1024 * 1024
+
+# Connection pooling / model residency
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "8"))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "120"))
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")  # How long Ollama keeps the model loaded after a request
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Process-wide keep-alive session shared by every Ollama call."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=OLLAMA_POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+
+def configure_ollama(pool_size=None, connect_timeout=None, read_timeout=None, keep_alive=None):
+    """Adjust pooling, timeouts and keep_alive; the pool is rebuilt on next use."""
+    global OLLAMA_POOL_SIZE, OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT, OLLAMA_KEEP_ALIVE, _session
+    with _session_lock:
+        if pool_size is not None:
+            OLLAMA_POOL_SIZE = pool_size
+        if connect_timeout is not None:
+            OLLAMA_CONNECT_TIMEOUT = connect_timeout
+        if read_timeout is not None:
+            OLLAMA_READ_TIMEOUT = read_timeout
+        if keep_alive is not None:
+            OLLAMA_KEEP_ALIVE = keep_alive
+        if _session is not None:
+            _session.close()
+            _session = None
+
 @dataclass
 class Message:
     role: str
@@ -21,6 +74,90 @@ class Choice:
 class ChatCompletion:
     choices: list[Choice]
 
+class ResponseCache:
+    """
+    Content-addressed cache for chat completions: an in-memory LRU in front of
+    a persistent SQLite tier. Keys hash (model, messages, temperature, num_predict).
+    """
+    def __init__(self, path=None, memory_entries=LLM_CACHE_MEMORY_ENTRIES, max_bytes=LLM_CACHE_MAX_BYTES):
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+        self._disk_path = path or CACHE_DIR / "llm_cache.sqlite3"
+        self._max_bytes = max_bytes
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    @property
+    def disk(self):
+        if self._disk is None:
+            self._disk = DiskCache(self._disk_path, max_bytes=self._max_bytes)
+        return self._disk
+
+    @staticmethod
+    def make_key(model, messages, temperature, num_predict):
+        payload = json.dumps(
+            [model, messages, temperature, num_predict], sort_keys=True, ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _remember(self, key, content):
+        self._memory[key] = content
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return self._memory[key]
+        entry = self.disk.get(key)
+        with self._lock:
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            content = entry.value.decode("utf-8")
+            self._remember(key, content)
+            self.stats["disk_hits"] += 1
+            return content
+
+    def set(self, key, content):
+        with self._lock:
+            self._remember(key, content)
+        self.disk.set(key, content.encode("utf-8"))
+
+
+response_cache = ResponseCache()
+
+
+def should_cache(temperature, use_cache=None):
+    if use_cache is not None:
+        return use_cache
+    if not LLM_CACHE_ENABLED or temperature is None:
+        return False
+    return 0.0 <= temperature <= LLM_CACHE_MAX_TEMPERATURE
+
+
+def record_usage(span, model, data):
+    """Token counts and model time from an Ollama response (or final stream chunk)."""
+    prompt_tokens = data.get("prompt_eval_count") or 0
+    completion_tokens = data.get("eval_count") or 0
+    prompt_seconds = (data.get("prompt_eval_duration") or 0) / 1e9
+    eval_seconds = (data.get("eval_duration") or 0) / 1e9
+    span.attrs.update(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        prompt_eval_seconds=prompt_seconds,
+        eval_seconds=eval_seconds,
+    )
+    telemetry.count("llm_tokens", prompt_tokens, model=model, type="prompt")
+    telemetry.count("llm_tokens", completion_tokens, model=model, type="completion")
+    telemetry.count("llm_model_seconds", prompt_seconds, model=model, phase="prompt_eval")
+    telemetry.count("llm_model_seconds", eval_seconds, model=model, phase="eval")
+
+
 class OllamaClient:
     def __init__(self, model, token=None):
         self.model = model
@@ -36,7 +173,7 @@ class OllamaClient:
             def __init__(self, client):
                 self.client = client
 
-            def create(self, messages, max_tokens=None, temperature=None):
+            def _build_payload(self, messages, max_tokens=None, temperature=None, stream=False):
                 # Convert object messages to dict if they aren't already
                 formatted_messages = []
                 for msg in messages:
@@ -48,7 +185,8 @@ class OllamaClient:
                 payload = {
                     "model": self.client.model,
                     "messages": formatted_messages,
-                    "stream": False,
+                    "stream": stream,
+                    "keep_alive": OLLAMA_KEEP_ALIVE,
                 }
                 
                 if temperature is not None:
@@ -60,27 +198,110 @@ class OllamaClient:
                     if "options" not in payload:
                         payload["options"] = {}
                     payload["options"]["num_predict"] = max_tokens
+                return formatted_messages, payload
 
-                try:
-                    response = requests.post(OLLAMA_BASE_URL, json=payload, timeout=120)
-                    response.raise_for_status()
-                    data = response.json()
-                    
-                    content = data.get("message", {}).get("content", "")
+            def create(self, messages, max_tokens=None, temperature=None, use_cache=None):
+                """
+                use_cache=None caches only low-temperature calls; pass True/False
+                to force or bypass the response cache for a single call.
+                """
+                formatted_messages, payload = self._build_payload(messages, max_tokens, temperature)
+                run_id = current_run_id.get()
+                streaming = event_bus.has_subscribers(run_id)
+
+                with telemetry.span("ollama.chat", "llm", model=self.client.model, streaming=streaming) as span:
+                    cache_key = None
+                    if should_cache(temperature, use_cache):
+                        cache_key = ResponseCache.make_key(self.client.model, formatted_messages, temperature, max_tokens)
+                        cached = response_cache.get(cache_key)
+                        if cached is not None:
+                            span.attrs["cached"] = True
+                            telemetry.count("llm_calls", model=self.client.model, cached="true")
+                            if streaming:
+                                event_bus.publish(run_id, {"type": "token", "model": self.client.model, "content": cached})
+                                event_bus.publish(run_id, {"type": "completion_end", "model": self.client.model})
+                            return ChatCompletion(choices=[Choice(message=Message(role="assistant", content=cached))])
+
+                    telemetry.count("llm_calls", model=self.client.model, cached="false")
+                    try:
+                        if streaming:
+                            # Someone is watching this run: stream tokens out as they
+                            # arrive while still returning the full completion.
+                            tokens = []
+                            usage = {}
+                            for token in self.stream(messages, max_tokens, temperature, usage=usage):
+                                tokens.append(token)
+                                event_bus.publish(run_id, {"type": "token", "model": self.client.model, "content": token})
+                            event_bus.publish(run_id, {"type": "completion_end", "model": self.client.model})
+                            content = "".join(tokens)
+                            record_usage(span, self.client.model, usage)
+                        else:
+                            response = get_session().post(
+                                OLLAMA_BASE_URL, json=payload, timeout=(OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT)
+                            )
+                            response.raise_for_status()
+                            data = response.json()
+                            record_usage(span, self.client.model, data)
+
+                            content = data.get("message", {}).get("content", "")
+                        if cache_key and content:
+                            response_cache.set(cache_key, content)
                     
-                    # Return structure mimicking OpenAI/InferenceClient response
-                    return ChatCompletion(choices=[Choice(message=Message(role="assistant", content=content))])
+                        # Return structure mimicking OpenAI/InferenceClient response
+                        return ChatCompletion(choices=[Choice(message=Message(role="assistant", content=content))])
                     
-                except requests.exceptions.RequestException as e:
-                    print(f"Error communicating with Ollama: {e}")
-                    # Return empty or error message to avoid crashing
-                    return ChatCompletion(choices=[Choice(message=Message(role="assistant", content="Error: Could not connect to Ollama"))])
+                    except (requests.exceptions.RequestException, ValueError) as e:
+                        # ValueError: a malformed NDJSON line or response body
+                        span.status = "error"
+                        span.attrs["error"] = str(e)[:500]
+                        print(f"Error communicating with Ollama: {e}")
+                        # Return empty or error message to avoid crashing
+                        return ChatCompletion(choices=[Choice(message=Message(role="assistant", content="Error: Could not connect to Ollama"))])
+
+            def stream(self, messages, max_tokens=None, temperature=None, usage=None):
+                """
+                Yields content tokens as Ollama's NDJSON chunks arrive. The final
+                chunk's counters (prompt_eval_count, eval_count, ...) go into `usage`.
+                """
+                _, payload = self._build_payload(messages, max_tokens, temperature, stream=True)
+                with get_session().post(
+                    OLLAMA_BASE_URL, json=payload, stream=True,
+                    timeout=(OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT)
+                ) as response:
+                    response.raise_for_status()
+                    for line in response.iter_lines():
+                        if not line:
+                            continue
+                        chunk = json.loads(line)
+                        if chunk.get("error"):
+                            raise requests.exceptions.RequestException(chunk["error"])
+                        token = chunk.get("message", {}).get("content", "")
+                        if token:
+                            yield token
+                        if chunk.get("done"):
+                            if usage is not None:
+                                usage.update(chunk)
+                            break
+
+            async def acreate(self, messages, max_tokens=None, temperature=None, use_cache=None):
+                # Runs on a worker thread but shares the pooled session, so
+                # concurrent completions reuse warm connections.
+                return await asyncio.to_thread(self.create, messages, max_tokens, temperature, use_cache)
+
+_clients = {}
+_clients_lock = threading.Lock()
 
 def get_llm_client(model_name=MODEL_NAME):
-    if USE_OLLAMA:
-        return OllamaClient(model=model_name)
-    else:
-        # Fallback to HuggingFace if needed (requires huggingface_hub installed)
-        from huggingface_hub import InferenceClient
-        from RAGs.api_import import HUGGING_FACE
-        return InferenceClient(model=model_name, token=HUGGING_FACE)
+    """Returns one shared client per model for the whole process."""
+    with _clients_lock:
+        if model_name in _clients:
+            return _clients[model_name]
+        if USE_OLLAMA:
+            client = OllamaClient(model=model_name)
+        else:
+            # Fallback to HuggingFace if needed (requires huggingface_hub installed)
+            from huggingface_hub import InferenceClient
+            from RAGs.api_import import HUGGING_FACE
+            client = InferenceClient(model=model_name, token=HUGGING_FACE)
+        _clients[model_name] = client
+        return client
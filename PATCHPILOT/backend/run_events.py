@@ -0,0 +1,49 @@
+import contextvars
+import queue
+import threading
+
+# Set by the API while a run's graph executes so deeper layers (LLM client,
+# nodes) know which run they are working for.
+current_run_id = contextvars.ContextVar("current_run_id", default="")
+
+SUBSCRIBER_QUEUE_SIZE = 10000
+
+
+class RunEventBus:
+    """In-process fan-out of per-run events (LLM tokens, status changes) to stream listeners."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, run_id):
+        q = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(run_id, []).append(q)
+        return q
+
+    def unsubscribe(self, run_id, q):
+        with self._lock:
+            listeners = self._subscribers.get(run_id, [])
+            if q in listeners:
+                listeners.remove(q)
+            if not listeners:
+                self._subscribers.pop(run_id, None)
+
+    def has_subscribers(self, run_id):
+        if not run_id:
+            return False
+        with self._lock:
+            return bool(self._subscribers.get(run_id))
+
+    def publish(self, run_id, event):
+        with self._lock:
+            listeners = list(self._subscribers.get(run_id, []))
+        for q in listeners:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                # A stalled listener must never block the pipeline.
+                pass
+
+
+event_bus = RunEventBus()
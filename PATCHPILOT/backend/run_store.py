@@ -0,0 +1,420 @@
+import hashlib
+from abc import ABC, abstractmethod
+import os
+import sqlite3
+import threading
+import time
+import zlib
+import orjson
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from pathlib import Path
+
+from cache_utils import CACHE_DIR
+from jobs import ACTIVE_STATUSES
+
+RUN_STORE_URL = os.getenv("PATCHPILOT_RUN_STORE", "sqlite")
+RUN_STORE_PATH = CACHE_DIR / "runs.sqlite3"
+RUN_TTL_SECONDS = int(os.getenv("PATCHPILOT_RUN_TTL", str(7 * 24 * 3600)))
+META_CACHE_ENTRIES = 1024
+# A queued/running job whose worker has not updated it for this long is
+# presumed dead, and the run can be claimed again
+JOB_CLAIM_TTL = int(os.getenv("PATCHPILOT_JOB_CLAIM_TTL", "3600"))
+
+# Large InputState fields kept out-of-line from the compact run metadata
+BLOB_FIELDS = (
+    "code",
+    "generated_code",
+    "generated_diffs",
+    "final_generated_code",
+    "codemod_code",
+    "retrieved_docs",
+    "errors",
+    "code_files",
+    "dependencies_in_code_files",
+    "initial_rules",
+)
+
+
+def _default(obj):
+    if isinstance(obj, (bytes, bytearray)):
+        return obj.decode("utf-8", errors="replace")
+    if isinstance(obj, set):
+        return sorted(obj)
+    raise TypeError
+
+
+def _dumps(value):
+    return orjson.dumps(value, default=_default)
+
+
+class RunStore(MutableMapping, ABC):
+    """
+    Dict-like store for run state and job status.
+
+    Values are either plain run dicts (before ingestion) or InputState objects.
+    Only compact metadata is cached in memory; the large state fields are
+    serialized separately and rewritten only when their content changes.
+    Entries expire RUN_TTL_SECONDS after their last write.
+
+    Values are returned as copies: write them back (runs[run_id] = value) after
+    mutating them. Every write reads and replaces the stored metadata in one
+    atomic _update, so a state write and a job status update racing each
+    other both land. The same atomicity backs claim_job and request_cancel,
+    which let several API workers share one job record per run.
+    """
+    def __init__(self, state_cls=None, ttl=RUN_TTL_SECONDS):
+        self.state_cls = state_cls
+        self.ttl = ttl
+        self._meta_cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    # -- backend hooks -------------------------------------------------
+    @abstractmethod
+    def _read_meta(self, run_id):
+        """Stored metadata of a live run, or None."""
+
+    @abstractmethod
+    def _read_blobs(self, run_id):
+        """{field: serialized blob} of a run."""
+
+    @abstractmethod
+    def _update(self, run_id, change):
+        """
+        Atomically calls change(stored meta or None) and writes the (meta,
+        changed blobs) it returns; None writes nothing. Returns the meta
+        written, or None.
+        """
+
+    @abstractmethod
+    def _remove(self, run_id):
+        """Deletes a run and its blobs."""
+
+    @abstractmethod
+    def _ids(self):
+        """Ids of the live runs."""
+
+    def purge_expired(self):
+        return 0
+
+    # -- helpers -------------------------------------------------------
+    def _remember(self, run_id, meta):
+        with self._lock:
+            self._meta_cache[run_id] = meta
+            self._meta_cache.move_to_end(run_id)
+            while len(self._meta_cache) > META_CACHE_ENTRIES:
+                self._meta_cache.popitem(last=False)
+
+    def _forget(self, run_id):
+        with self._lock:
+            self._meta_cache.pop(run_id, None)
+
+    def _split(self, value, previous_meta):
+        if isinstance(value, dict):
+            kind, data = "dict", dict(value)
+        else:
+            kind, data = "state", value.model_dump()
+        blobs = {}
+        digests = {}
+        old_digests = (previous_meta or {}).get("_blob_digests", {})
+        for name in BLOB_FIELDS:
+            if name not in data:
+                continue
+            payload = _dumps(data.pop(name))
+            digest = hashlib.sha1(payload).hexdigest()
+            digests[name] = digest
+            if old_digests.get(name) != digest:
+                blobs[name] = payload
+        meta = orjson.loads(_dumps(data))
+        meta["_kind"] = kind
+        meta["_blob_digests"] = digests
+        meta["_run"] = (previous_meta or {}).get("_run", {})
+        return meta, blobs
+
+    def _join(self, meta, blobs):
+        data = {k: v for k, v in meta.items() if not k.startswith("_")}
+        for name, payload in blobs.items():
+            if name in meta.get("_blob_digests", {}):
+                data[name] = orjson.loads(payload)
+        if meta.get("_kind") == "state" and self.state_cls is not None:
+            return self.state_cls(**data)
+        return data
+
+    # -- mapping API -----------------------------------------------------
+    def __getitem__(self, run_id):
+        meta = self._read_meta(run_id)
+        if meta is None:
+            self._forget(run_id)
+            raise KeyError(run_id)
+        self._remember(run_id, meta)
+        return self._join(meta, self._read_blobs(run_id))
+
+    def __setitem__(self, run_id, value):
+        meta = self._update(run_id, lambda previous: self._split(value, previous))
+        self._remember(run_id, meta)
+
+    def __delitem__(self, run_id):
+        if self._read_meta(run_id) is None:
+            raise KeyError(run_id)
+        self._remove(run_id)
+        self._forget(run_id)
+
+    def __contains__(self, run_id):
+        return self._read_meta(run_id) is not None
+
+    def __iter__(self):
+        return iter(self._ids())
+
+    def __len__(self):
+        return len(self._ids())
+
+    def get_meta(self, run_id):
+        """Compact metadata for a run without loading any of its blobs."""
+        with self._lock:
+            cached = self._meta_cache.get(run_id)
+        if cached is not None:
+            return cached
+        meta = self._read_meta(run_id)
+        if meta is not None:
+            self._remember(run_id, meta)
+        return meta
+
+    def set_run_info(self, run_id, info):
+        """
+        Updates out-of-band run info (job status, progress) without touching
+        the state. Info carrying a job_id is dropped once another job has
+        claimed the run, so a superseded job cannot overwrite its successor.
+        """
+        def change(meta):
+            if meta is None:
+                return None
+            current = meta.get("_run", {}).get("job_id")
+            if info.get("job_id") and current and current != info["job_id"]:
+                return None
+            return {**meta, "_run": {**meta.get("_run", {}), **info, "updated_at": time.time()}}, {}
+        meta = self._update(run_id, change)
+        if meta is not None:
+            self._remember(run_id, meta)
+
+    def claim_job(self, run_id, info):
+        """
+        Records info as the run's job unless another job for the run is still
+        queued or running (on any worker). Returns whether the claim was taken.
+        """
+        def change(meta):
+            if meta is None:
+                return None
+            run = meta.get("_run", {})
+            if run.get("status") in ACTIVE_STATUSES and time.time() - run.get("updated_at", 0) < JOB_CLAIM_TTL:
+                return None
+            return {**meta, "_run": {**run, **info, "cancel_requested": False, "updated_at": time.time()}}, {}
+        meta = self._update(run_id, change)
+        if meta is None:
+            return False
+        self._remember(run_id, meta)
+        return True
+
+    def request_cancel(self, run_id):
+        """
+        Flags the run's queued or running job as cancelled for the worker that
+        owns it to pick up. Returns the job info, or None when no job is active.
+        """
+        def change(meta):
+            run = (meta or {}).get("_run", {})
+            if run.get("status") not in ACTIVE_STATUSES:
+                return None
+            return {**meta, "_run": {**run, "cancel_requested": True}}, {}
+        meta = self._update(run_id, change)
+        if meta is None:
+            return None
+        self._remember(run_id, meta)
+        return meta["_run"]
+
+    def get_run_info(self, run_id):
+        # Read through: another worker may have updated it since we cached it
+        meta = self._read_meta(run_id)
+        return (meta or {}).get("_run", {})
+
+
+class SqliteRunStore(RunStore):
+    def __init__(self, path=RUN_STORE_PATH, **kwargs):
+        super().__init__(**kwargs)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._writes = 0
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(
+                """CREATE TABLE IF NOT EXISTS runs (
+                       run_id TEXT PRIMARY KEY,
+                       meta BLOB NOT NULL,
+                       updated_at REAL NOT NULL,
+                       expires_at REAL
+                   );
+                   CREATE INDEX IF NOT EXISTS runs_expires ON runs(expires_at);
+                   CREATE TABLE IF NOT EXISTS run_blobs (
+                       run_id TEXT NOT NULL,
+                       field TEXT NOT NULL,
+                       data BLOB NOT NULL,
+                       PRIMARY KEY (run_id, field)
+                   );"""
+            )
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+
+    @staticmethod
+    def _select_meta(conn, run_id):
+        row = conn.execute(
+            "SELECT meta FROM runs WHERE run_id = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (run_id, time.time()),
+        ).fetchone()
+        return orjson.loads(zlib.decompress(row[0])) if row else None
+
+    def _read_meta(self, run_id):
+        conn = self._connect()
+        try:
+            return self._select_meta(conn, run_id)
+        finally:
+            conn.close()
+
+    def _read_blobs(self, run_id):
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT field, data FROM run_blobs WHERE run_id = ?", (run_id,)).fetchall()
+        finally:
+            conn.close()
+        return {field: zlib.decompress(data) for field, data in rows}
+
+    def _update(self, run_id, change):
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            changed = change(self._select_meta(conn, run_id))
+            if changed is None:
+                conn.execute("ROLLBACK")
+                return None
+            meta, blobs = changed
+            conn.execute(
+                "INSERT OR REPLACE INTO runs (run_id, meta, updated_at, expires_at) VALUES (?, ?, ?, ?)",
+                (run_id, zlib.compress(_dumps(meta)), now, now + self.ttl if self.ttl else None),
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO run_blobs (run_id, field, data) VALUES (?, ?, ?)",
+                [(run_id, name, zlib.compress(payload)) for name, payload in blobs.items()],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        self._writes += 1
+        if self._writes % 50 == 0:
+            self.purge_expired()
+        return meta
+
+    def _remove(self, run_id):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+            conn.execute("DELETE FROM run_blobs WHERE run_id = ?", (run_id,))
+        finally:
+            conn.close()
+
+    def _ids(self):
+        conn = self._connect()
+        try:
+            return [row[0] for row in conn.execute(
+                "SELECT run_id FROM runs WHERE expires_at IS NULL OR expires_at > ?", (time.time(),)
+            )]
+        finally:
+            conn.close()
+
+    def purge_expired(self):
+        conn = self._connect()
+        try:
+            expired = [row[0] for row in conn.execute(
+                "SELECT run_id FROM runs WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)
+            )]
+            for run_id in expired:
+                conn.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+                conn.execute("DELETE FROM run_blobs WHERE run_id = ?", (run_id,))
+        finally:
+            conn.close()
+        for run_id in expired:
+            self._forget(run_id)
+        return len(expired)
+
+
+class RedisRunStore(RunStore):
+    """Redis-backed store; pass client=fakeredis.FakeRedis() to run without a server."""
+    def __init__(self, url=None, client=None, prefix="patchpilot:run:", **kwargs):
+        super().__init__(**kwargs)
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+
+    def _meta_key(self, run_id):
+        return f"{self.prefix}{run_id}:meta"
+
+    def _blob_key(self, run_id):
+        return f"{self.prefix}{run_id}:blobs"
+
+    def _read_meta(self, run_id):
+        raw = self.client.get(self._meta_key(run_id))
+        return orjson.loads(zlib.decompress(raw)) if raw else None
+
+    def _read_blobs(self, run_id):
+        raw = self.client.hgetall(self._blob_key(run_id))
+        return {(k.decode() if isinstance(k, bytes) else k): zlib.decompress(v) for k, v in raw.items()}
+
+    def _update(self, run_id, change):
+        from redis.exceptions import WatchError
+        meta_key = self._meta_key(run_id)
+        while True:
+            with self.client.pipeline() as pipe:
+                try:
+                    # Optimistic: execute() fails if another writer touched the meta after watch()
+                    pipe.watch(meta_key)
+                    raw = pipe.get(meta_key)
+                    changed = change(orjson.loads(zlib.decompress(raw)) if raw else None)
+                    if changed is None:
+                        return None
+                    meta, blobs = changed
+                    pipe.multi()
+                    pipe.set(meta_key, zlib.compress(_dumps(meta)), ex=self.ttl or None)
+                    if blobs:
+                        pipe.hset(self._blob_key(run_id), mapping={k: zlib.compress(v) for k, v in blobs.items()})
+                    if self.ttl:
+                        pipe.expire(self._blob_key(run_id), self.ttl)
+                    pipe.execute()
+                    return meta
+                except WatchError:
+                    continue
+
+    def _remove(self, run_id):
+        self.client.delete(self._meta_key(run_id), self._blob_key(run_id))
+
+    def _ids(self):
+        suffix = ":meta"
+        ids = []
+        for key in self.client.scan_iter(match=f"{self.prefix}*{suffix}"):
+            key = key.decode() if isinstance(key, bytes) else key
+            ids.append(key[len(self.prefix):-len(suffix)])
+        return ids
+
+
+def create_run_store(state_cls=None, url=RUN_STORE_URL):
+    """'sqlite' (default) or 'sqlite:///path/to/runs.sqlite3' or a redis:// URL."""
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisRunStore(url=url, state_cls=state_cls)
+    if url.startswith("sqlite:///"):
+        return SqliteRunStore(path=url[len("sqlite:///"):], state_cls=state_cls)
+    return SqliteRunStore(state_cls=state_cls)
@@ -0,0 +1,244 @@
+import contextvars
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from uuid import uuid4
+
+from run_events import current_run_id
+
+# Finished spans kept per run for the timing breakdown, and how many runs are kept
+MAX_SPANS_PER_RUN = int(os.getenv("PATCHPILOT_TRACE_SPANS", "5000"))
+MAX_TRACED_RUNS = int(os.getenv("PATCHPILOT_TRACED_RUNS", "200"))
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+METRIC_PREFIX = "patchpilot"
+
+COUNTER_HELP = {
+    "codemod_files": "Target files the rename codemods changed or left as they were",
+    "codemod_rules": "Rules per work item applied by codemods or left to the LLM",
+    "llm_calls": "LLM completions requested, by model and whether the response cache answered",
+    "llm_tokens": "Tokens processed by the LLM (Ollama prompt_eval_count / eval_count)",
+    "llm_model_seconds": "Model time reported by Ollama (prompt_eval_duration / eval_duration)",
+    "patch_edits": "Model edit responses applied to the file, or falling back to regenerating it",
+    "patch_chunks": "Chunks of files patched, skipped as untouched by the steps, or patched as whole files",
+    "retries": "Retries made by retry_with_backoff, by function",
+    "rule_dedup_rules": "Synthesized rules kept or merged into a duplicate before compilation",
+    "rule_dedup_saved": "Supervisor calls and prompt tokens the rule dedup avoided",
+    "span_errors": "Instrumented nodes and calls that raised",
+}
+
+# The innermost open span of this thread or task; new spans become its children
+current_span = contextvars.ContextVar("current_span", default=None)
+
+
+@dataclass
+class Span:
+    name: str
+    kind: str
+    run_id: str
+    parent_id: str | None = None
+    span_id: str = field(default_factory=lambda: uuid4().hex[:16])
+    start: float = field(default_factory=time.time)
+    duration: float = 0.0
+    status: str = "ok"
+    attrs: dict = field(default_factory=dict)
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _labels(pairs):
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}" if pairs else ""
+
+
+def propagate_context(fn):
+    """
+    fn bound to the caller's context (run id, current span), for handing to
+    a pool. Each call runs in its own copy, since one context cannot be
+    entered by two threads at once.
+    """
+    ctx = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        return ctx.copy().run(fn, *args, **kwargs)
+    return run
+
+
+class Telemetry:
+    """
+    Spans and counters for the whole process.
+
+    Spans time graph nodes and the LLM, HTTP and Docker calls made under
+    them. They nest through a context variable, so work handed to pools
+    must run in a copied context to keep its run and parent. Finished spans
+    feed a latency histogram per (kind, name). The most recent ones are
+    also kept per run for run_summary(). Counters hold token, retry and
+    error totals. Everything is rendered in the Prometheus text format by
+    render_prometheus(). Numbers are per process: each API worker reports
+    its own.
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS, max_runs=MAX_TRACED_RUNS, max_spans=MAX_SPANS_PER_RUN):
+        self.buckets = tuple(buckets)
+        self.max_runs = max_runs
+        self.max_spans = max_spans
+        self._lock = threading.Lock()
+        self._latency = {}                  # (kind, name) -> [per-bucket counts..., +Inf count, sum]
+        self._counters = defaultdict(float)  # (metric, ((label, value), ...)) -> total
+        self._runs = OrderedDict()          # run_id -> {"spans": deque, "counters": defaultdict}
+
+    def _run(self, run_id):
+        run = self._runs.get(run_id)
+        if run is None:
+            run = self._runs[run_id] = {"spans": deque(maxlen=self.max_spans), "counters": defaultdict(float)}
+            while len(self._runs) > self.max_runs:
+                self._runs.popitem(last=False)
+        self._runs.move_to_end(run_id)
+        return run
+
+    @contextmanager
+    def span(self, name, kind="internal", **attrs):
+        """Times the block as a child of the current span; the yielded Span takes extra attrs."""
+        parent = current_span.get()
+        span = Span(name, kind, current_run_id.get(), parent.span_id if parent else None, attrs=attrs)
+        token = current_span.set(span)
+        started = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.status = "error"
+            span.attrs["error"] = f"{type(e).__name__}: {e}"[:500]
+            raise
+        finally:
+            span.duration = time.perf_counter() - started
+            current_span.reset(token)
+            self._finish(span)
+
+    def traced(self, name=None, kind="internal"):
+        """Decorator form of span(); the name defaults to the function's."""
+        def decorator(func):
+            span_name = name or func.__name__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name, kind):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _finish(self, span):
+        if span.status == "error":
+            self.count("span_errors", kind=span.kind, name=span.name)
+        with self._lock:
+            hist = self._latency.get((span.kind, span.name))
+            if hist is None:
+                hist = self._latency[(span.kind, span.name)] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if span.duration <= bound:
+                    hist[i] += 1
+                    break
+            else:
+                hist[len(self.buckets)] += 1
+            hist[-1] += span.duration
+            if span.run_id:
+                self._run(span.run_id)["spans"].append(span)
+
+    def count(self, metric, value=1, **labels):
+        """Adds to a counter, and to the current run's copy of it."""
+        key = (metric, tuple(sorted(labels.items())))
+        run_id = current_run_id.get()
+        with self._lock:
+            self._counters[key] += value
+            if run_id:
+                self._run(run_id)["counters"][key] += value
+
+    def run_summary(self, run_id, include_spans=True):
+        """
+        Timing breakdown of a run: wall time, time per node, time per call
+        kind (and per call name), token and retry totals. None when this
+        process has recorded nothing for the run.
+        """
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is None:
+                return None
+            spans = list(run["spans"])
+            counters = dict(run["counters"])
+        nodes = {}
+        calls = {}
+        for span in spans:
+            if span.kind == "node":
+                bucket = nodes.setdefault(span.name, {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+            else:
+                group = calls.setdefault(span.kind, {"count": 0, "seconds": 0.0, "by_name": {}})
+                group["count"] += 1
+                group["seconds"] += span.duration
+                bucket = group["by_name"].setdefault(span.name, {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+            bucket["count"] += 1
+            bucket["seconds"] += span.duration
+            bucket["max_seconds"] = max(bucket["max_seconds"], span.duration)
+        totals = defaultdict(dict)
+        for (metric, labels), value in counters.items():
+            totals[metric][",".join(f"{k}={v}" for k, v in labels) or "total"] = value
+        summary = {
+            "run_id": run_id,
+            "wall_seconds": (max(s.start + s.duration for s in spans) - min(s.start for s in spans)) if spans else 0.0,
+            "nodes": nodes,
+            "calls": calls,
+            "tokens": totals.get("llm_tokens", {}),
+            "model_seconds": totals.get("llm_model_seconds", {}),
+            "llm_calls": totals.get("llm_calls", {}),
+            "codemod_files": totals.get("codemod_files", {}),
+            "codemod_rules": totals.get("codemod_rules", {}),
+            "rule_dedup": {**totals.get("rule_dedup_rules", {}), **totals.get("rule_dedup_saved", {})},
+            "retries": totals.get("retries", {}),
+            "errors": totals.get("span_errors", {}),
+        }
+        if include_spans:
+            summary["spans"] = [span.to_dict() for span in sorted(spans, key=lambda s: s.start)]
+        return summary
+
+    def render_prometheus(self):
+        with self._lock:
+            latency = {key: list(hist) for key, hist in self._latency.items()}
+            counters = dict(self._counters)
+        name = f"{METRIC_PREFIX}_span_duration_seconds"
+        lines = [
+            f"# HELP {name} Latency of graph nodes and of the LLM, HTTP and Docker calls they make",
+            f"# TYPE {name} histogram",
+        ]
+        for (kind, span_name), hist in sorted(latency.items()):
+            base = [("kind", kind), ("name", span_name)]
+            cumulative = 0
+            for bound, count in zip(self.buckets, hist):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(base + [('le', bound)])} {cumulative}")
+            cumulative += hist[len(self.buckets)]
+            lines.append(f"{name}_bucket{_labels(base + [('le', '+Inf')])} {cumulative}")
+            lines.append(f"{name}_sum{_labels(base)} {hist[-1]:.6f}")
+            lines.append(f"{name}_count{_labels(base)} {cumulative}")
+        by_metric = defaultdict(list)
+        for (metric, labels), value in counters.items():
+            by_metric[metric].append((labels, value))
+        for metric in sorted(by_metric):
+            full = f"{METRIC_PREFIX}_{metric}_total"
+            lines.append(f"# HELP {full} {COUNTER_HELP.get(metric, metric)}")
+            lines.append(f"# TYPE {full} counter")
+            for labels, value in sorted(by_metric[metric]):
+                lines.append(f"{full}{_labels(labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+telemetry = Telemetry()
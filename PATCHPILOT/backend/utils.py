@@ -1,6 +1,7 @@
 import time
 import functools
 import random
+from telemetry import telemetry
 
 def retry_with_backoff(retries=3, backoff_in_seconds=1):
     def decorator(func):
@@ -16,6 +17,7 @@ def retry_with_backoff(retries=3, backoff_in_seconds=1):
                     sleep = (backoff_in_seconds * 2 ** x +
                              random.uniform(0, 1))
                     print(f"Error {e}, retrying in {sleep} seconds...")
+                    telemetry.count("retries", function=func.__qualname__)
                     time.sleep(sleep)
                     x += 1
         return wrapper
@@ -114,9 +114,8 @@ export const api = {
         return response.json();
     },
     generatePlan: async (runId, selectedMigrations) => {
-        // The backend currently generates a plan for the whole state.
-        // We pass runId. selectedMigrations might need to be sent if we want to filter, 
-        // but for now we follow the backend signature: POST /{runId}/generate_migration_plan
+        // Submitting only queues the run on the backend; poll its status
+        // until the graph has finished so callers can fetch the plan after.
         const response = await fetch(`${API_BASE_URL}/run/${runId}/generate_migration_plan`, {
             method: 'POST',
              headers: api.getAuthHeaders()
@@ -126,11 +125,69 @@ export const api = {
              const error = await response.json().catch(() => ({}));
              throw new Error(error.detail || 'Plan generation failed');
         }
-        // The backend returns graph state/result. 
-        // We might want to return it, or fetch the formatted plan via getPlan after this.
+        let job = await response.json();
+        while (job.status === 'queued' || job.status === 'running') {
+            await new Promise(r => setTimeout(r, 2000));
+            job = await api.getRunStatus(runId);
+        }
+        if (job.status !== 'completed') {
+            throw new Error(job.error || `Plan generation ${job.status}`);
+        }
+        return job;
+    },
+
+    getRunStatus: async (runId) => {
+        const response = await fetch(`${API_BASE_URL}/run/${runId}/status`, {
+            headers: api.getAuthHeaders()
+        });
+        if (!response.ok) throw new Error('Failed to fetch run status');
+        return response.json();
+    },
+
+    cancelRun: async (runId) => {
+        const response = await fetch(`${API_BASE_URL}/run/${runId}/cancel`, {
+            method: 'POST',
+            headers: api.getAuthHeaders()
+        });
+        if (!response.ok) {
+            const error = await response.json().catch(() => ({}));
+            throw new Error(error.detail || 'Failed to cancel run');
+        }
         return response.json();
     },
 
+    resumeRun: async (runId) => {
+        // Continues a failed or cancelled run from its last checkpoint
+        const response = await fetch(`${API_BASE_URL}/run/${runId}/resume`, {
+            method: 'POST',
+            headers: api.getAuthHeaders()
+        });
+        if (!response.ok) {
+            const error = await response.json().catch(() => ({}));
+            throw new Error(error.detail || 'Failed to resume run');
+        }
+        return response.json();
+    },
+
+    /**
+     * Subscribes to the live event stream of a run (LLM tokens and status).
+     * Returns a function that closes the stream.
+     * @param {string} runId
+     * @param {(event: object) => void} onEvent
+     */
+    streamRun: (runId, onEvent) => {
+        const source = new EventSource(`${API_BASE_URL}/run/${runId}/stream`);
+        source.onmessage = (message) => {
+            const event = JSON.parse(message.data);
+            onEvent(event);
+            if (event.type === 'end') {
+                source.close();
+            }
+        };
+        source.onerror = () => source.close();
+        return () => source.close();
+    },
+
     requestFix: async (verificationId) => {
         // Backend does not yet have a granular "fix this specific ID" endpoint exposed in app.py
         // We will mock a success for UI responsiveness or log it.